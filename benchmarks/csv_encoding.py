@@ -0,0 +1,70 @@
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import load_template, generate_columns, encode_csv_rows, encode_csv_columns
+
+"""
+Benchmark of csv encoding: rows/sec of the bulk encoder (engine/csv_encoding.py) against the previous paths, on the same
+generated records. Every path must produce the same bytes.
+
+    python3 benchmarks/csv_encoding.py --template cde_template.yaml --row_count 100000
+"""
+
+def encode_per_row(columns):
+    """ Original `save_cde` path: one dict per record, turned back into a list and written with one `writerow` per record. """
+    header = columns.header
+    records = columns.to_records()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=",")
+    for cde_row in records:
+        writer.writerow([cde_row[variable] for variable in header])
+    return buffer.getvalue()
+
+def encode_writerows(columns):
+    """ Columnar path before the bulk encoder: `csv.writer.writerows` over rows materialized from the index columns. """
+    return encode_csv_rows(columns.iter_rows())
+
+ENCODERS = {
+    "per_row": encode_per_row,
+    "writerows": encode_writerows,
+    "bulk": encode_csv_columns
+}
+
+def benchmark(template_file, row_count, repeat=3, seed=0):
+    template, compiled = load_template(template_file)
+    columns = generate_columns(compiled, row_count, rng=np.random.default_rng(seed), seed=seed)
+    results = {}
+    expected = None
+    for name, encode in ENCODERS.items():
+        best = None
+        for i in range(repeat):
+            start = time.perf_counter()
+            encoded = encode(columns)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if expected is None:
+            expected = encoded
+        elif encoded != expected:
+            raise Exception(f'Encoder "{name}" does not produce the same csv as "per_row".')
+        results[name] = {"seconds": best, "rows_per_second": row_count / best}
+    return (len(compiled.header), results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark csv encoding of generated records")
+    parser.add_argument("-t", "--template", action="store", default="cde_template.yaml")
+    parser.add_argument("-n", "--row_count", action="store", type=int, default=100000)
+    parser.add_argument("--repeat", action="store", type=int, default=3)
+    args = parser.parse_args()
+
+    variable_count, results = benchmark(args.template, args.row_count, repeat=args.repeat)
+    print(f'csv encoding of {args.row_count} rows x {variable_count} variables ("{args.template}"), best of {args.repeat}:')
+    for name in results:
+        speedup = results[name]["rows_per_second"] / results["per_row"]["rows_per_second"]
+        print(f'- {name}: {results[name]["rows_per_second"]:,.0f} rows/s ({results[name]["seconds"]:.3f}s, {speedup:.1f}x)')
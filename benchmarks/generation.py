@@ -0,0 +1,184 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import ruamel.yaml as yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from relationships import Register
+from engine import (
+    CompiledTemplate, preprocess_template, load_template, to_plain, seed_shard, generate_columns,
+    RelationshipExecutor, infer_column_types
+)
+import generate
+
+"""
+Benchmark suite of the generation pipeline.
+
+Times each phase separately: template load (YAML parse, `preprocess_template`, compilation, and a load through the compiled
+template cache), sampling, every relationship of the plan, and `save_cde`. Generation phases are run for every row count,
+both without relationships and with each relationship file given, and the results are written as JSON so that runs can be
+compared over time.
+
+    python3 benchmarks/generation.py --template cde_template.yaml --relationships global_relationships.yaml
+"""
+
+DEFAULT_ROW_COUNTS = [1000, 100000, 1000000]
+DEFAULT_RESULTS_DIRECTORY = os.path.join(ROOT, "benchmarks", "results")
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self.start
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def benchmark_template_load(template_file):
+    """ Time each step of loading a template. """
+    with open(template_file, "rb") as f:
+        template_bytes = f.read()
+    with Timer() as parse:
+        template = to_plain(yaml.round_trip_load(template_bytes))
+    with Timer() as preprocess:
+        preprocess_template(template)
+    with Timer() as compile_:
+        CompiledTemplate(template)
+    # Make sure the cache is warm, then time a cached load.
+    load_template(template_file)
+    with Timer() as cached_load:
+        load_template(template_file)
+    return {
+        "parse": parse.seconds,
+        "preprocess_template": preprocess.seconds,
+        "compile": compile_.seconds,
+        "cached_load": cached_load.seconds,
+        "variables": len(template["variables"])
+    }
+
+def load_relationship_plan(relationship_file, compiled):
+    if relationship_file is None:
+        return []
+    with open(relationship_file, "r") as f:
+        relationships = yaml.round_trip_load(f)
+    relationship_plan = Register.plan(relationships["relationships"])
+    compiled.check_relationships(relationship_plan)
+    return relationship_plan
+
+def benchmark_generation(compiled, relationship_plan, row_count, output_format="csv", seed=0):
+    """ Time sampling, every relationship of the plan, and writing `row_count` records generated as a single shard. """
+    rng = seed_shard(seed, 0)
+    with Timer() as sampling:
+        columns = generate_columns(compiled, row_count, rng=rng, seed=seed)
+    with Timer() as relationships:
+        relationship_timings = RelationshipExecutor(relationship_plan).run(columns, rng=rng)
+    column_types = infer_column_types(compiled) if output_format != "csv" else None
+    with tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, f"benchmark{generate.get_writer(output_format).extension}")
+        with Timer() as save:
+            generate.save_cde(compiled.header, columns, output_path, output_format=output_format, column_types=column_types)
+        output_bytes = os.path.getsize(output_path)
+    total = sampling.seconds + relationships.seconds + save.seconds
+    return {
+        "sampling": sampling.seconds,
+        "relationships": relationships.seconds,
+        "relationship_timings": relationship_timings,
+        "save_cde": save.seconds,
+        "total": total,
+        "rows_per_second": row_count / total if total > 0 else None,
+        "output_bytes": output_bytes
+    }
+
+def run_benchmarks(template_file, relationship_files, row_counts, output_format="csv", seed=0):
+    """
+    :param relationship_files: Relationship files to benchmark, None standing for no relationships
+    :type relationship_files: list
+    :rtype: dict
+    """
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "template": template_file,
+        "output_format": output_format,
+        "seed": seed,
+        "template_load": benchmark_template_load(template_file),
+        "runs": []
+    }
+    template, compiled = load_template(template_file)
+    for relationship_file in relationship_files:
+        relationship_plan = load_relationship_plan(relationship_file, compiled)
+        for row_count in row_counts:
+            print(f"- {row_count} rows, relationships: {relationship_file}")
+            run = benchmark_generation(compiled, relationship_plan, row_count, output_format=output_format, seed=seed)
+            run["row_count"] = row_count
+            run["relationships_file"] = relationship_file
+            print(
+                f'  sampling {run["sampling"]:.3f}s, relationships {run["relationships"]:.3f}s, '
+                f'save_cde {run["save_cde"]:.3f}s ({run["rows_per_second"]:,.0f} rows/s)'
+            )
+            results["runs"].append(run)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark template loading, generation, relationships, and output")
+    parser.add_argument("-t", "--template", action="store", default="cde_template.yaml")
+    parser.add_argument(
+        "-r",
+        "--relationships",
+        help="Relationship file to benchmark in addition to running without relationships. May be repeated.",
+        action="append",
+        default=[]
+    )
+    parser.add_argument(
+        "-n",
+        "--row_counts",
+        help="Comma-separated row counts",
+        action="store",
+        default=",".join(str(row_count) for row_count in DEFAULT_ROW_COUNTS)
+    )
+    parser.add_argument("-f", "--format", action="store", choices=generate.OUTPUT_FORMATS, default="csv")
+    parser.add_argument("-s", "--seed", action="store", type=int, default=0)
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        help="JSON results file. Defaults to benchmarks/results/<timestamp>.json",
+        action="store",
+        default=None
+    )
+    args = parser.parse_args()
+
+    row_counts = [int(row_count) for row_count in args.row_counts.split(",")]
+    results = run_benchmarks(
+        args.template,
+        [None] + args.relationships,
+        row_counts,
+        output_format=args.format,
+        seed=args.seed
+    )
+    output_path = args.output_path
+    if output_path is None:
+        os.makedirs(DEFAULT_RESULTS_DIRECTORY, exist_ok=True)
+        output_path = os.path.join(DEFAULT_RESULTS_DIRECTORY, f'{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.json')
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f'Wrote benchmark results to "{output_path}".')
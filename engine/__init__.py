@@ -0,0 +1,14 @@
+from .sampler import *
+from .compiled import *
+from .counter_rng import *
+from .columnar import *
+from .parallel import *
+from .cache import *
+from .text import *
+from .executor import *
+from .metrics import *
+from .csv_encoding import *
+from .compression import *
+from .writers import *
+from .validation import *
+from .jobs import *
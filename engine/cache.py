@@ -0,0 +1,124 @@
+import hashlib
+import os
+import pickle
+import time
+import ruamel.yaml as yaml
+from pathlib import Path
+from .compiled import CompiledTemplate, preprocess_template
+
+"""
+Compiled template cache.
+
+Round-trip loading a large template with ruamel (comments, CommentedMaps, ...) dominates the startup time of small jobs.
+The first time a template is loaded, the preprocessed template and its CompiledTemplate (frequencies, sampling tables and
+response lookup indexes) are pickled next to it as `<template>.compiled`. Later loads of the same template read that file instead.
+The cache is keyed by a hash of the template's bytes, so it is rebuilt automatically whenever the YAML changes.
+"""
+
+# Bump whenever the layout of the cached objects changes, to invalidate caches written by older versions.
+CACHE_VERSION = 3
+CACHE_SUFFIX = ".compiled"
+
+def cache_path(template_file):
+    return Path(f"{template_file}{CACHE_SUFFIX}")
+
+def hash_template(template_bytes):
+    return hashlib.sha256(template_bytes).hexdigest()
+
+def to_plain(data):
+    """ Recursively convert ruamel round-trip types (CommentedMap, CommentedSeq, ScalarFloat, ...) to plain Python types. """
+    if isinstance(data, dict):
+        return {to_plain(key): to_plain(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [to_plain(value) for value in data]
+    if isinstance(data, bool) or data is None:
+        return data
+    if isinstance(data, int):
+        return int(data)
+    if isinstance(data, float):
+        return float(data)
+    if isinstance(data, str):
+        return str(data)
+    return data
+
+def compile_template(template_bytes, timings=None):
+    """
+    Parse, preprocess and compile a template from its YAML source.
+    :param timings: If given, seconds spent parsing, preprocessing and compiling are recorded into this dict.
+    :type timings: dict
+    :rtype: (dict, CompiledTemplate)
+    """
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    template = to_plain(yaml.round_trip_load(template_bytes))
+    timings["parse"] = time.perf_counter() - start
+    start = time.perf_counter()
+    preprocess_template(template)
+    timings["preprocess"] = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled = CompiledTemplate(template)
+    timings["compile"] = time.perf_counter() - start
+    return (template, compiled)
+
+def _read_cache(path, template_hash):
+    try:
+        with open(path, "rb") as f:
+            cached = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # Corrupt or incompatible cache files are simply rebuilt.
+        return None
+    if cached.get("version") != CACHE_VERSION or cached.get("template_hash") != template_hash:
+        return None
+    return (cached["template"], cached["compiled"])
+
+def _write_cache(path, template_hash, template, compiled):
+    tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump({
+                "version": CACHE_VERSION,
+                "template_hash": template_hash,
+                "template": template,
+                "compiled": compiled
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # Atomic, so that concurrent runs never read a partially written cache.
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f'Could not write compiled template cache "{path}": {e}')
+        if tmp_path.is_file():
+            tmp_path.unlink()
+
+def load_template(template_file, use_cache=True, timings=None):
+    """
+    Load, preprocess and compile a template file, going through the compiled template cache.
+    :param template_file: File path to CDE generation template.
+    :type template_file: str
+    :param use_cache: If False, always parse the YAML and don't read or write the cache.
+    :type use_cache: bool
+    :param timings: If given, seconds spent in each step (cache_read, or parse/preprocess/compile/cache_write) are recorded into this dict.
+    :type timings: dict
+    :return: The preprocessed template (as plain dicts/lists) and its CompiledTemplate
+    :rtype: (dict, CompiledTemplate)
+    """
+    with open(template_file, "rb") as f:
+        template_bytes = f.read()
+    if timings is None:
+        timings = {}
+    if not use_cache:
+        return compile_template(template_bytes, timings=timings)
+
+    template_hash = hash_template(template_bytes)
+    path = cache_path(template_file)
+    start = time.perf_counter()
+    cached = _read_cache(path, template_hash)
+    timings["cache_read"] = time.perf_counter() - start
+    if cached is not None:
+        return cached
+    template, compiled = compile_template(template_bytes, timings=timings)
+    start = time.perf_counter()
+    _write_cache(path, template_hash, template, compiled)
+    timings["cache_write"] = time.perf_counter() - start
+    return (template, compiled)
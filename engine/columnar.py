@@ -0,0 +1,309 @@
+import time
+import random
+import numpy as np
+from relationships import Register, UdfContext
+from .sampler import SAMPLERS, sample_cdf
+from .text import get_lorem_generator
+from .counter_rng import CounterRNG
+
+"""
+Columnar generation engine.
+
+Rather than materializing a {"response_name", "response_value"} dict for every cell, each variable is stored as an integer
+array of selected response indices into its compiled response list. Responses with a `response_value_generator` additionally
+keep their generated values in a per-variable object array. Values are only looked up when the rows are written.
+"""
+
+class ColumnarRows:
+    def __init__(self, compiled, row_count):
+        """
+        :param compiled: Compiled template the columns index into.
+        :type compiled: CompiledTemplate
+        :param row_count: Number of records held by the columns.
+        :type row_count: int
+        """
+        self.compiled = compiled
+        self.header = compiled.header
+        self.row_count = row_count
+        # { variable_name: array of selected response indices }
+        self.indices = {}
+        # { variable_name: object array of generated values } (only for variables with generated responses)
+        self.generated = {}
+        # { variable_name: seconds } spent sampling and generating these records, if recorded.
+        self.sampling_timings = {}
+        # { "<position>:<relationship_name>": seconds } spent post-processing these records, if recorded.
+        self.relationship_timings = {}
+        # { phase: MB } memory peak of the generating process during each phase, if recorded (see engine/metrics.py).
+        self.max_rss_mb = {}
+
+    def __len__(self):
+        return self.row_count
+
+    def slice(self, start, stop):
+        """
+        Records [start, stop) as a ColumnarRows whose columns are views into this one's,
+        so that modifying the slice modifies these columns as well.
+        """
+        columns = ColumnarRows(self.compiled, stop - start)
+        columns.indices = {variable_name: indices[start:stop] for variable_name, indices in self.indices.items()}
+        columns.generated = {variable_name: generated[start:stop] for variable_name, generated in self.generated.items()}
+        return columns
+
+    def response_names(self, variable_name):
+        """ Selected response names of a variable as an object array. """
+        return self.compiled[variable_name].names.take(self.indices[variable_name])
+
+    def response_values(self, variable_name):
+        """ Selected response values of a variable as an object array, with generated values filled in. """
+        variable = self.compiled[variable_name]
+        indices = self.indices[variable_name]
+        values = variable.values.take(indices)
+        generated = self.generated.get(variable_name)
+        if generated is not None:
+            mask = variable.is_generated.take(indices)
+            values[mask] = generated[mask]
+        return values
+
+    def iter_rows(self):
+        """ Yield each record as a list of response values in header order. """
+        columns = [self.response_values(variable_name) for variable_name in self.header]
+        for row in zip(*columns):
+            yield list(row)
+
+    def to_records(self):
+        """ Convert to the reference engine's row format: a list of { variable_name: response_value } dicts. """
+        return [dict(zip(self.header, row)) for row in self.iter_rows()]
+
+class ColumnView:
+    """
+    Read-only view of one dependency column, as handed to vectorized relationships.
+    Names and values are only materialized when accessed.
+    :param get_response_names: Callable returning the selected response name of every record
+    :param get_response_values: Callable returning the selected response value of every record
+    """
+    def __init__(self, get_response_names, get_response_values):
+        self._get_response_names = get_response_names
+        self._get_response_values = get_response_values
+        self._response_names = None
+        self._response_values = None
+
+    @property
+    def response_names(self):
+        if self._response_names is None:
+            self._response_names = self._get_response_names()
+        return self._response_names
+
+    @property
+    def response_values(self):
+        if self._response_values is None:
+            self._response_values = self._get_response_values()
+        return self._response_values
+
+    def is_response(self, response_name):
+        """ Boolean mask of the records whose selected response is `response_name`. """
+        return self.response_names == response_name
+
+class IndexColumnView(ColumnView):
+    """ ColumnView over a ColumnarRows column, which compares response indices rather than names. """
+    def __init__(self, columns, variable_name, relationship_name=None):
+        super().__init__(
+            lambda: columns.response_names(variable_name),
+            lambda: columns.response_values(variable_name)
+        )
+        self.columns = columns
+        self.variable_name = variable_name
+        self.relationship_name = relationship_name
+
+    def is_response(self, response_name):
+        response_index = self.columns.compiled.resolve(self.variable_name, {"response_name": response_name}, self.relationship_name)
+        return self.columns.indices[self.variable_name] == response_index
+
+class RelationshipColumns:
+    """
+    The dependency columns of a batch of records, passed as the first argument of vectorized relationships.
+    `columns[variable_name]` returns a ColumnView; `columns.rng` should be used for any randomness.
+    """
+    def __init__(self, name, views, row_count, rng):
+        self.name = name
+        self.views = views
+        self.row_count = row_count
+        self.rng = rng
+
+    def __len__(self):
+        return self.row_count
+
+    def __getitem__(self, variable_name):
+        if variable_name not in self.views:
+            raise Exception(f'Relationship "{self.name}" accessed variable "{variable_name}" which is not listed under its `dependencies` field.')
+        return self.views[variable_name]
+
+    @classmethod
+    def from_columns(cls, columns, relationship, rng):
+        views = {
+            variable_name: IndexColumnView(columns, variable_name, relationship["name"])
+            for variable_name in relationship["dependencies"] if variable_name in columns.indices
+        }
+        return cls(relationship["name"], views, columns.row_count, rng)
+
+    @classmethod
+    def from_records(cls, records, relationship, rng):
+        """ Build the dependency columns from the reference engine's { variable_name: response } records. """
+        def get_column(variable_name, key):
+            column = np.empty(len(records), dtype=object)
+            column[:] = [record[variable_name][key] for record in records]
+            return column
+        views = {
+            variable_name: ColumnView(
+                lambda variable_name=variable_name: get_column(variable_name, "response_name"),
+                lambda variable_name=variable_name: get_column(variable_name, "response_value")
+            ) for variable_name in relationship["dependencies"]
+        }
+        return cls(relationship["name"], views, len(records), rng)
+
+def sample_indices(variable, row_count, rng, sampler="alias"):
+    """
+    Vectorized weighted sampling of response indices.
+    Equivalent to `random.choices(responses, weights=frequencies, k=row_count)`.
+    :param sampler: One of SAMPLERS (see engine/sampler.py)
+    :type sampler: str
+    """
+    if sampler == "alias":
+        indices = variable.alias_table.sample(rng, row_count)
+    elif sampler == "cdf":
+        indices = sample_cdf(variable.cumulative, rng, row_count)
+    else:
+        raise Exception(f'Unknown sampler "{sampler}". Expected one of: {", ".join(SAMPLERS)}')
+    return indices.astype(variable.dtype, copy=False)
+
+def generate_values(kind, config, count, rng, rows=None, seed=None):
+    """
+    Generate `count` values for a response with a `response_value_generator`.
+    With a CounterRNG, every value only depends on its own row: lorem draws are row-aligned and per-record UDFs get the
+    `random` module reseeded for each record.
+    :param rows: Global row indices of the cells being generated (passed to batch UDFs)
+    :type rows: numpy.ndarray
+    :param seed: Seed of the whole run (passed to batch UDFs)
+    :type seed: int
+    :return: list of generated values
+    """
+    if kind == "udf":
+        name = config["name"]
+        args = config.get("args", [])
+        kwargs = config.get("kwargs", {})
+        if Register.has_batch_udf(name):
+            values = Register.invoke_batch_udf(name, count, UdfContext(rng, rows, seed=seed), *args, **kwargs)
+            # Keep generated cells as Python objects, e.g. for when a batch UDF returns a numpy array.
+            return values.tolist() if isinstance(values, np.ndarray) else list(values)
+        if isinstance(rng, CounterRNG):
+            values = []
+            for row_seed in rng.row_seeds():
+                random.seed(row_seed)
+                values.append(Register.invoke_udf(name, *args, **kwargs))
+            return values
+        return [Register.invoke_udf(name, *args, **kwargs) for i in range(count)]
+    elif kind == "lorem":
+        # num_sentences and sentence_length are inclusive ranges.
+        generator = get_lorem_generator(config)
+        return generator.generate_aligned(count, rng) if isinstance(rng, CounterRNG) else generator.generate(count, rng)
+    elif kind == "range":
+        min_val, max_val = config # inclusive
+        return rng.integers(min_val, max_val + 1, size=count).tolist()
+    elif kind == "valid_inputs":
+        choices = rng.integers(0, len(config), size=count)
+        return [config[choice] for choice in choices]
+    raise Exception(f'Unknown response_value_generator "{kind}"')
+
+def generate_columns(compiled, row_count, rng=None, sampler="alias", start=0, seed=None, streams=None):
+    """
+    Draw every variable of a compiled template as a column of response indices and generate the values of
+    special (text/integer) responses.
+    :param compiled: Compiled template
+    :type compiled: CompiledTemplate
+    :param row_count: Number of records to generate
+    :type row_count: int
+    :param rng: Random generator, defaults to a freshly seeded one
+    :type rng: numpy.random.Generator
+    :param sampler: Weighted sampler used to select responses, one of SAMPLERS
+    :type sampler: str
+    :param start: Global row index of the first generated record, when generating a chunk of a larger file
+    :type start: int
+    :param seed: Seed of the whole run, shared by every chunk (passed to batch UDFs)
+    :type seed: int
+    :param streams: If given, `rng` is ignored and every variable is drawn from its own counter-based streams instead, keyed
+                    by global row index, so that a record doesn't depend on which chunk it is generated in
+    :type streams: CounterStreams
+    :return: The generated columns, with the time spent on each variable under `sampling_timings`
+    :rtype: ColumnarRows
+    """
+    if rng is None and streams is None:
+        rng = np.random.default_rng()
+    rows = np.arange(start, start + row_count, dtype=np.int64)
+    columns = ColumnarRows(compiled, row_count)
+    for variable_name in compiled.header:
+        variable_start = time.perf_counter()
+        variable = compiled[variable_name]
+        variable_rng = rng if streams is None else streams.rng("sample", variable_name, rows=rows)
+        indices = sample_indices(variable, row_count, variable_rng, sampler=sampler)
+        columns.indices[variable_name] = indices
+        if len(variable.generators) > 0:
+            columns.generated[variable_name] = _generate_column_values(variable, indices, rng, start, seed, streams=streams)
+        columns.sampling_timings[variable_name] = time.perf_counter() - variable_start
+    return columns
+
+def _generate_column_values(variable, indices, rng, start, seed, streams=None):
+    """ Object array of the generated values of a variable's column (None outside of generated responses). """
+    row_count = len(indices)
+    generated = np.empty(row_count, dtype=object)
+    for response_index, (kind, config) in variable.generators.items():
+        rows = np.flatnonzero(indices == response_index)
+        if len(rows) == 0:
+            continue
+        rows_rng = rng if streams is None else streams.rng("generate", variable.name, response_index, rows=rows + start)
+        generated[rows] = generate_values(kind, config, len(rows), rows_rng, rows=rows + start, seed=seed)
+    return generated
+
+def apply_relationship(columns, relationship, rng=None):
+    """
+    Apply a relationship to every record of `columns` in place.
+    Vectorized relationships are invoked once for the whole batch, others once per record. With a CounterRNG, the `random`
+    module is reseeded before each record is passed to a per-record relationship.
+    """
+    compiled = columns.compiled
+    if relationship.get("vectorized"):
+        if rng is None:
+            rng = np.random.default_rng()
+        modifications = Register.invoke_relationship_batch(
+            relationship,
+            RelationshipColumns.from_columns(columns, relationship, rng)
+        )
+        if modifications is None: return
+        for modified_variable in modifications:
+            for mask, modified_response in modifications[modified_variable]:
+                response_index = compiled.resolve(modified_variable, modified_response, relationship["name"])
+                columns.indices[modified_variable][mask] = response_index
+        return
+
+    dependencies = [variable_name for variable_name in relationship["dependencies"] if variable_name in columns.indices]
+    dependency_names = [columns.response_names(variable_name).tolist() for variable_name in dependencies]
+    dependency_values = [columns.response_values(variable_name).tolist() for variable_name in dependencies]
+    row_seeds = rng.row_seeds() if isinstance(rng, CounterRNG) else None
+    for i in range(columns.row_count):
+        if row_seeds is not None:
+            random.seed(row_seeds[i])
+        record = {
+            variable_name: {
+                "response_name": dependency_names[j][i],
+                "response_value": dependency_values[j][i]
+            } for j, variable_name in enumerate(dependencies)
+        }
+        modifications = Register.invoke_relationship(relationship, record)
+        if modifications is None: continue
+        for modified_variable in modifications:
+            modified_response = modifications[modified_variable]
+            response_index = compiled.resolve(modified_variable, modified_response, relationship["name"])
+            columns.indices[modified_variable][i] = response_index
+
+def apply_relationships(columns, relationship_plan, rng=None):
+    """ Apply each relationship of a plan (see `Register.plan`) to `columns` in order. """
+    for relationship in relationship_plan:
+        apply_relationship(columns, relationship, rng=rng)
@@ -0,0 +1,186 @@
+import numpy as np
+from relationships import Register
+from .sampler import AliasTable
+from .csv_encoding import csv_field
+
+"""
+A compiled template is a read-only, array-backed view of a preprocessed template.
+Everything that the columnar engine needs per variable (weights, value tables, generator configs) is computed once here
+so that generation never has to walk the template's response dicts again.
+"""
+
+def preprocess_template(template):
+    for variable_name in template["variables"]:
+        responses = template["variables"][variable_name]
+        no_freq_responses = []
+        total_freq = 0
+        for response in responses:
+            if response.get("frequency") is None:
+                no_freq_responses.append(response)
+            else:
+                total_freq += response["frequency"]
+        if total_freq > 1:
+            raise Exception(f"Sum of response frequencies for variable \"{variable_name}\" should not exceed 1.0 (total_freq={total_freq})")
+        if len(no_freq_responses) > 0:
+            remaining_freq = 1 - total_freq
+            per_response_freq = remaining_freq / len(no_freq_responses)
+            # Due to floating-point imprecision, this will result in very slightly less or more than 1.0 total frequency,
+            for response in no_freq_responses:
+                response["frequency"] = per_response_freq
+
+def get_generator(response):
+    """
+    Resolve which generator a response uses, following the same prioritization as the reference engine
+    (udf > lorem > range > valid_inputs).
+    :return: (kind, config) tuple or None if the response has a fixed response_value.
+    """
+    generator_schema = response.get("response_value_generator")
+    if generator_schema is None:
+        return None
+    udf = generator_schema.get("udf")
+    lorem = generator_schema.get("lorem")
+    range_ = generator_schema.get("range")
+    valid_inputs = generator_schema.get("valid_inputs")
+    if udf is not None:
+        return ("udf", udf)
+    elif lorem is not None:
+        return ("lorem", lorem)
+    elif range_:
+        return ("range", range_)
+    elif valid_inputs:
+        return ("valid_inputs", valid_inputs)
+    return None
+
+def index_dtype(response_count):
+    """ Smallest integer dtype able to hold an index into a response list of size `response_count`. """
+    if response_count <= np.iinfo(np.uint8).max:
+        return np.uint8
+    if response_count <= np.iinfo(np.uint16).max:
+        return np.uint16
+    return np.uint32
+
+class CompiledVariable:
+    def __init__(self, name, responses):
+        self.name = name
+        self.responses = list(responses)
+        self.response_names = [response.get("response_name") for response in self.responses]
+        # Object arrays so that `take` returns the original Python values (ints, strs, None).
+        self.names = np.empty(len(self.responses), dtype=object)
+        self.names[:] = self.response_names
+        self.values = np.empty(len(self.responses), dtype=object)
+        self.values[:] = [response.get("response_value") for response in self.responses]
+        # Values pre-formatted as csv fields, see engine/csv_encoding.py.
+        self.csv_values = np.empty(len(self.responses), dtype=object)
+        self.csv_values[:] = [csv_field(value) for value in self.values]
+        self.frequencies = np.array([response["frequency"] for response in self.responses], dtype=np.float64)
+        self.cumulative = np.cumsum(self.frequencies)
+        self.alias_table = AliasTable(self.frequencies)
+        self.dtype = index_dtype(len(self.responses))
+        # { response_index: (kind, config) } for every response that generates its own value.
+        self.generators = {}
+        for i, response in enumerate(self.responses):
+            generator = get_generator(response)
+            if generator is not None:
+                self.generators[i] = generator
+        self.is_generated = np.zeros(len(self.responses), dtype=bool)
+        self.is_generated[list(self.generators)] = True
+        # Hash indexes of { response_name: index } and { response_value: index }.
+        # If a name/value occurs more than once, the first occurrence wins (as with a linear scan).
+        self.name_index = {}
+        self.value_index = {}
+        for i, response in enumerate(self.responses):
+            self.name_index.setdefault(response.get("response_name"), i)
+            response_value = response.get("response_value")
+            if response_value is not None:
+                self.value_index.setdefault(response_value, i)
+
+    def find_response(self, response_name=None, response_value=None):
+        """
+        Find the index of a response by name or, if no name is given, by value.
+        :return: Index of the response or None if not found.
+        """
+        if response_name is not None:
+            return self.name_index.get(response_name)
+        elif response_value is not None:
+            return self.value_index.get(response_value)
+        return None
+
+class CompiledTemplate:
+    def __init__(self, template):
+        """
+        :param template: A template that has already gone through `preprocess_template`.
+        :type template: dict
+        """
+        self.header = list(template["variables"].keys())
+        self.variables = {
+            variable_name: CompiledVariable(variable_name, template["variables"][variable_name])
+            for variable_name in self.header
+        }
+
+    def resolve(self, variable_name, modified_response, relationship_name=None):
+        """
+        Look up the index of the response requested by a relationship modification ({"response_name": ...} or {"response_value": ...}).
+        :raises Exception: If the modification can't be interpreted or doesn't match any response of the variable.
+        """
+        source = f'Relationship "{relationship_name}"' if relationship_name is not None else "Modification"
+        if variable_name not in self.variables:
+            raise Exception(f'{source} modifies variable "{variable_name}" which does not exist in the template.')
+        # These are functionally equivalent, except for special responses (i.e. text), in which it is necessary to support both.
+        response_name = modified_response.get("response_name")
+        response_value = modified_response.get("response_value")
+        if response_name is None and response_value is None:
+            raise Exception("Could not interpret modification requested by relationship:", modified_response)
+        response_index = self.variables[variable_name].find_response(response_name, response_value)
+        if response_index is None:
+            if response_name is not None:
+                requested = f'response_name "{response_name}"'
+            else:
+                requested = f'response_value "{response_value}"'
+            raise Exception(
+                f'{source} requested {requested} for variable "{variable_name}", but the variable has no such response. '
+                f'Valid response names: {", ".join(str(name) for name in self.variables[variable_name].name_index)}'
+            )
+        return response_index
+
+    def relationship_errors(self, relationship_plan):
+        """
+        Find every relationship of a plan that reads or modifies a variable missing from the template, or, for typed
+        relationships (e.g. rules and CPTs), references a response that the variable doesn't have.
+        :return: One error message per invalid relationship
+        :rtype: list
+        """
+        errors = []
+        for relationship in relationship_plan:
+            missing_variables = [
+                f'Relationship "{relationship["name"]}" lists variable "{variable_name}" under its `{field}` field, '
+                f'but the variable does not exist in the template.'
+                for field in ["dependencies", "modifies"] for variable_name in relationship[field]
+                if variable_name not in self.variables
+            ]
+            if len(missing_variables) > 0:
+                errors.extend(missing_variables)
+                continue
+            try:
+                Register.check_relationship(
+                    relationship,
+                    lambda variable_name, response, name=relationship["name"]: self.resolve(variable_name, response, name)
+                )
+            except Exception as e:
+                errors.append(str(e))
+        return errors
+
+    def check_relationships(self, relationship_plan):
+        """
+        Verify, before any records are generated, that every variable read or modified by the relationships in a plan exists,
+        and that the responses referenced by typed relationships exist (see `relationship_errors`).
+        :raises Exception: On the first invalid relationship.
+        """
+        errors = self.relationship_errors(relationship_plan)
+        if len(errors) > 0:
+            raise Exception(errors[0])
+
+    def __getitem__(self, variable_name):
+        return self.variables[variable_name]
+
+    def __contains__(self, variable_name):
+        return variable_name in self.variables
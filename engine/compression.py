@@ -0,0 +1,128 @@
+import gzip
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+"""
+Compressed output.
+
+The codec is picked from the output file's extension (e.g. `synthetic_cde.csv.gz`, `synthetic_cde.csv.zst`).
+Written text is gathered into large blocks, and each block is compressed on a thread pool as an independent gzip member or
+zstd frame while the next chunks are being generated (zlib and zstd release the GIL while compressing). Blocks are written
+in order, and since both formats allow a file to be a concatenation of members/frames, the result decompresses to exactly
+the same text as an uncompressed file.
+"""
+
+CODECS = {
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".zst": "zstd",
+    ".zstd": "zstd"
+}
+DEFAULT_LEVELS = {
+    "gzip": 6,
+    "zstd": 3
+}
+# Size of the blocks compressed at once, and the write buffer size of uncompressed files.
+DEFAULT_BUFFER_SIZE = 8 * 1024 * 1024
+
+def get_codec(output_path):
+    """
+    :return: The codec selected by the extension of `output_path`, or None for uncompressed output.
+    :rtype: str
+    """
+    return CODECS.get(Path(output_path).suffix.lower())
+
+def default_compression_threads():
+    return max(1, min(4, os.cpu_count() or 1))
+
+def _compress_gzip(data, level):
+    # mtime=0 so that the same data always compresses to the same bytes.
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def _compress_zstd(data, level):
+    # Compressor objects are not thread-safe, so every block gets its own.
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+class CompressedTextFile:
+    """
+    Write-only text file compressed with `codec` in blocks of `buffer_size` characters on `threads` threads.
+    :param path: Output file path
+    :type path: str
+    :param codec: "gzip" or "zstd"
+    :type codec: str
+    :param level: Compression level, defaults to DEFAULT_LEVELS[codec]
+    :type level: int
+    :param threads: Number of compression threads
+    :type threads: int
+    :param buffer_size: Number of characters compressed at once
+    :type buffer_size: int
+    """
+    def __init__(self, path, codec, level=None, threads=None, buffer_size=DEFAULT_BUFFER_SIZE):
+        if codec == "gzip":
+            self.compress = _compress_gzip
+        elif codec == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception("Writing zstd compressed files requires zstandard. Install it with: pip3 install zstandard")
+            self.compress = _compress_zstd
+        else:
+            raise Exception(f'Unknown compression codec "{codec}". Expected one of: {", ".join(DEFAULT_LEVELS)}')
+        self.level = level if level is not None else DEFAULT_LEVELS[codec]
+        self.threads = threads if threads is not None else default_compression_threads()
+        self.buffer_size = buffer_size
+        self.file = open(path, "wb")
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = []
+        self.buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.buffer_size:
+            self._submit_block()
+        return len(text)
+
+    def _submit_block(self):
+        if self.buffered == 0:
+            return
+        data = "".join(self.buffer).encode("utf-8")
+        self.buffer = []
+        self.buffered = 0
+        self.pending.append(self.executor.submit(self.compress, data, self.level))
+        # Bound the number of blocks in flight so that memory stays flat when compression is slower than generation.
+        while len(self.pending) > 2 * self.threads:
+            self.file.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.file.closed:
+            return
+        try:
+            self._submit_block()
+            while len(self.pending) > 0:
+                self.file.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+            self.file.close()
+
+def open_output(output_path, threads=None, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Open a text output file for writing, compressed according to its extension (see CODECS).
+    :param threads: Number of compression threads, only used for compressed files
+    :type threads: int
+    :return: A file-like object with `write` and `close`
+    """
+    codec = get_codec(output_path)
+    if codec is None:
+        return open(output_path, "w", buffering=buffer_size)
+    return CompressedTextFile(output_path, codec, threads=threads, buffer_size=buffer_size)
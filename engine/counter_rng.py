@@ -0,0 +1,83 @@
+import hashlib
+import numpy as np
+from utils.record_ids import _mix64
+
+"""
+Counter-based random numbers.
+
+In "counter" mode, every random draw is a pure function of (seed, stream key, global row index, draw number): the row index
+and a per-stream key derived from the seed and e.g. the variable name are hashed together with splitmix64, rather than
+consumed from a sequential stream. A row therefore gets the same records whichever range, chunk size or worker it is generated
+in, so any row range of a file can be generated on its own (`generate.py --rows START:END`).
+
+The default "stream" mode (see engine/parallel.py) draws from one sequential generator per shard instead, which is slightly
+faster but makes rows depend on the shard they are generated in.
+"""
+
+RNG_MODES = ["stream", "counter"]
+
+_DRAW_MULTIPLIER = np.uint64(0xD1B54A32D192ED03)
+
+def stream_key(*parts):
+    """ Stable 64-bit key of a tuple of values (e.g. a seed and a variable name), independent of Python's hash seed. """
+    digest = hashlib.blake2b("\x1f".join(str(part) for part in parts).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+class CounterRNG:
+    """
+    The subset of numpy.random.Generator used by the engine, samplers, generators, batch UDFs and vectorized relationships
+    (`random` and `integers`), computed from row indices rather than drawn from a stream.
+    Every draw must be row-aligned: its size is the number of rows, or (rows, k) for k values per row. The i-th value of the
+    n-th call then only depends on the key, rows[i] and n, never on the other rows being generated alongside it.
+    :param key: Stream key, see `stream_key`
+    :type key: int
+    :param rows: Global row index of each row the draws are for
+    :type rows: numpy.ndarray
+    """
+    def __init__(self, key, rows):
+        self.rows = np.asarray(rows, dtype=np.uint64)
+        self.draws = 0
+        # Hash of every row under this stream's key, shared by all of the stream's draws.
+        self._row_hashes = _mix64(self.rows ^ np.uint64(key))
+
+    def _bits(self, size):
+        if size is None:
+            raise Exception("Counter-based random draws must be row-aligned: pass one value per row (size=len(rows)).")
+        shape = (size,) if np.isscalar(size) else tuple(size)
+        if len(shape) == 0 or shape[0] != len(self.rows):
+            raise Exception(f"Counter-based random draws must be row-aligned: got size {size} for {len(self.rows)} rows.")
+        per_row = int(np.prod(shape[1:]))
+        # Draw n of a stream uses counters [n << 32, (n << 32) + per_row).
+        counters = (np.uint64(self.draws) << np.uint64(32)) + np.arange(per_row, dtype=np.uint64)
+        self.draws += 1
+        bits = _mix64(self._row_hashes[:, None] + _mix64(counters * _DRAW_MULTIPLIER)[None, :])
+        return bits.reshape(shape)
+
+    def random(self, size=None):
+        """ Uniform floats in [0, 1), as `numpy.random.Generator.random`. """
+        return (self._bits(size) >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+    def integers(self, low, high=None, size=None, endpoint=False):
+        """ Uniform integers in [low, high) (or [low, high] with endpoint=True), as `numpy.random.Generator.integers`. """
+        if high is None:
+            low, high = 0, low
+        if endpoint:
+            high = high + 1
+        return low + (self.random(size) * (high - low)).astype(np.int64)
+
+    def row_seeds(self):
+        """ One 64-bit seed per row (e.g. to reseed the `random` module before calling per-record code), as Python ints. """
+        return self._bits(len(self.rows)).tolist()
+
+class CounterStreams:
+    """ Factory of the CounterRNG streams of a run. """
+    def __init__(self, seed):
+        self.seed = seed
+
+    def rng(self, *key, rows):
+        """
+        :param key: Identifies the stream within the run, e.g. ("sample", variable_name)
+        :param rows: Global row indices the stream's draws are for
+        :rtype: CounterRNG
+        """
+        return CounterRNG(stream_key(self.seed, *key), rows)
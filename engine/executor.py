@@ -0,0 +1,67 @@
+import time
+import numpy as np
+from .columnar import apply_relationship
+
+"""
+Fused relationship execution.
+
+Rather than every relationship of a plan making its own pass over all of a chunk's records, the executor applies the whole
+ordered plan to one block of records before moving on to the next block, so that the columns a block touches stay in cache
+while every relationship runs over them. Time spent in each relationship is accumulated along the way.
+"""
+
+# Rows per block. Small enough for a block's dependency columns to stay cache-resident, large enough for vectorized
+# relationships to amortize their per-call overhead.
+DEFAULT_BLOCK_SIZE = 16384
+
+class RelationshipExecutor:
+    def __init__(self, relationship_plan, block_size=DEFAULT_BLOCK_SIZE):
+        """
+        :param relationship_plan: Ordered relationships, see `Register.plan`
+        :type relationship_plan: list
+        :param block_size: Number of records the whole plan is applied to at a time
+        :type block_size: int
+        """
+        if block_size < 1:
+            raise Exception(f"block_size must be a positive integer (block_size={block_size})")
+        self.relationship_plan = relationship_plan
+        self.block_size = block_size
+
+    def run(self, columns, rng=None, streams=None, start=0):
+        """
+        Apply the plan to every record of `columns` in place.
+        :param streams: If given, `rng` is ignored and each relationship draws from its own counter-based stream, keyed by the
+                        global row index of each record, so that the block size doesn't change the records
+        :type streams: CounterStreams
+        :param start: Global row index of the first record of `columns`
+        :type start: int
+        :return: Seconds spent in each relationship, as { "<position>:<relationship_name>": seconds } in plan order (keyed by
+                 position as well, since the same relationship may be configured more than once)
+        :rtype: dict
+        """
+        keys = [timing_key(position, relationship) for position, relationship in enumerate(self.relationship_plan)]
+        timings = {key: 0.0 for key in keys}
+        if len(self.relationship_plan) == 0:
+            return timings
+        for block_start in range(0, columns.row_count, self.block_size):
+            # Views into `columns`, so modifications made on a block are made on the chunk.
+            block_stop = min(block_start + self.block_size, columns.row_count)
+            block = columns.slice(block_start, block_stop)
+            if streams is not None:
+                rows = np.arange(start + block_start, start + block_stop, dtype=np.int64)
+            for position, relationship in enumerate(self.relationship_plan):
+                relationship_start = time.perf_counter()
+                block_rng = rng if streams is None else streams.rng("relationship", position, relationship["name"], rows=rows)
+                apply_relationship(block, relationship, rng=block_rng)
+                timings[keys[position]] += time.perf_counter() - relationship_start
+        return timings
+
+def timing_key(position, relationship):
+    """ Key of a relationship's timings, from its position in the plan and its name. """
+    return f'{position}:{relationship["name"]}'
+
+def add_timings(totals, timings):
+    """ Accumulate per-relationship `timings` into `totals` in place. """
+    for name in timings:
+        totals[name] = totals.get(name, 0.0) + timings[name]
+    return totals
@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from .cache import hash_template
+from .compression import get_codec
+from .parallel import split_shards
+
+"""
+Checkpointed generation jobs.
+
+A job generates a file as a sequence of segments of `segment_size` rows, each written to its own file in the job directory.
+A segment is first written under a hidden temporary name, synced to disk and renamed into place, and only then recorded in
+the job's manifest (`_manifest.json`, itself replaced atomically). The manifest therefore only ever lists complete segments,
+along with everything the records depend on (template hash, seed, row count, segment/chunk size, sampler, RNG mode, format).
+
+Rerunning a job resumes after its last committed segment. Segments are aligned on chunk boundaries and every chunk draws from
+an RNG stream derived from the seed and its position in the file (see engine/parallel.py), so a resumed job produces exactly
+the same segments as an uninterrupted one.
+
+The segments, in manifest order, are the generated file: csv segments after the first have no header row, and text formats
+can be concatenated as-is into a single file (`assemble_segments`), compressed or not. Parquet and arrow segments are
+standalone files which are read together as a dataset (e.g. `pyarrow.dataset.dataset(job_dir)`, which skips the manifest
+since its name starts with "_").
+"""
+
+MANIFEST_NAME = "_manifest.json"
+MANIFEST_VERSION = 1
+DEFAULT_SEGMENT_SIZE = 1000000
+# Job settings that the generated records depend on. A job can only be resumed with the same ones.
+JOB_SETTINGS = ["template_hash", "relationships_hash", "seed", "row_count", "segment_size", "chunk_size", "sampler", "rng_mode", "output_format", "extension"]
+# Formats whose segments concatenate into a single valid file.
+ASSEMBLED_FORMATS = ["csv", "jsonl"]
+
+def hash_file(path):
+    """ sha256 of a file's contents, None if there's no file. """
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return hash_template(f.read())
+
+def segment_extension(writer_class, output_path=None):
+    """ Extension of segment files, compressed like `output_path` (text formats only, see engine/compression.py). """
+    if output_path is not None and get_codec(output_path) is not None:
+        return writer_class.extension + Path(output_path).suffix
+    return writer_class.extension
+
+def segment_path(job_dir, segment_index, extension):
+    return Path(job_dir) / f"segment-{segment_index:05d}{extension}"
+
+def temporary_segment_path(job_dir, segment_index, extension):
+    """ Hidden path a segment is written to before being committed (ignored by dataset readers). """
+    return Path(job_dir) / f".segment-{segment_index:05d}{extension}"
+
+def _sync(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+def read_manifest(job_dir):
+    """
+    :return: The manifest of the job in `job_dir`, or None if there's no job there yet.
+    :rtype: dict
+    """
+    try:
+        with open(Path(job_dir) / MANIFEST_NAME, "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise Exception(f'Job manifest "{Path(job_dir) / MANIFEST_NAME}" has version {manifest.get("version")}, expected {MANIFEST_VERSION}.')
+    return manifest
+
+def write_manifest(job_dir, manifest):
+    """ Atomically replace the job's manifest, so that it is never seen partially written. """
+    path = Path(job_dir) / MANIFEST_NAME
+    tmp_path = Path(f"{path}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def open_job(job_dir, settings):
+    """
+    Start a new job in `job_dir`, or resume the one already there.
+    Committed segments whose file is missing or doesn't have its recorded size are dropped, along with every segment after
+    them, so that they are generated again.
+    :param settings: Value of each of JOB_SETTINGS, plus the template path
+    :type settings: dict
+    :return: The job's manifest
+    :rtype: dict
+    """
+    Path(job_dir).mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(job_dir)
+    if manifest is None:
+        manifest = {"version": MANIFEST_VERSION, **settings, "rows_completed": 0, "segments": [], "output_path": None}
+        write_manifest(job_dir, manifest)
+        return manifest
+
+    mismatches = [
+        f"- {setting}: {manifest.get(setting)} (job) != {settings[setting]}"
+        for setting in JOB_SETTINGS if manifest.get(setting) != settings[setting]
+    ]
+    if len(mismatches) > 0:
+        raise Exception(
+            f'Cannot resume the job in "{job_dir}", it was started with different settings:\n' + "\n".join(mismatches) +
+            "\nRerun it with the original settings, or use a new job directory."
+        )
+    # The segments of an assembled job have been concatenated into its output file.
+    segments = manifest["segments"] if manifest["output_path"] is None else []
+    for i, segment in enumerate(segments):
+        path = Path(job_dir) / segment["file"]
+        if not path.is_file() or path.stat().st_size != segment["bytes"]:
+            print(f'Segment "{path}" is missing or incomplete, generating it again along with every segment after it.')
+            manifest["segments"] = manifest["segments"][:i]
+            manifest["rows_completed"] = segment["start"]
+            write_manifest(job_dir, manifest)
+            break
+    # Leftovers of a segment that was being written when the job stopped (including ".<pid>..segment-*" files, which
+    # earlier versions wrote segments through).
+    for path in Path(job_dir).glob(".*segment-*"):
+        path.unlink()
+    return manifest
+
+def pending_segments(manifest):
+    """
+    Segments of the job that haven't been committed yet.
+    :return: list of (segment_index, start_row, segment_row_count)
+    """
+    committed = len(manifest["segments"])
+    return split_shards(manifest["row_count"], manifest["segment_size"])[committed:]
+
+def commit_segment(job_dir, manifest, segment, tmp_path):
+    """
+    Move a fully written segment into place and record it in the manifest.
+    :param segment: (segment_index, start_row, segment_row_count)
+    """
+    segment_index, start, segment_row_count = segment
+    if segment_index != len(manifest["segments"]):
+        raise Exception(f"Segments must be committed in order (got segment {segment_index}, expected {len(manifest['segments'])}).")
+    path = segment_path(job_dir, segment_index, manifest["extension"])
+    _sync(tmp_path)
+    os.replace(tmp_path, path)
+    manifest["segments"].append({
+        "file": path.name,
+        "start": start,
+        "rows": segment_row_count,
+        "bytes": path.stat().st_size
+    })
+    manifest["rows_completed"] = start + segment_row_count
+    write_manifest(job_dir, manifest)
+    return path
+
+def assemble_segments(job_dir, manifest, output_path, remove_segments=True):
+    """
+    Concatenate the committed segments of a finished job into `output_path`, without decoding or re-encoding them.
+    Only supported by the formats of ASSEMBLED_FORMATS. The output is written to a temporary file and renamed into place
+    once complete, and segments are only removed after that, so an interrupted assembly can simply be run again.
+    """
+    if manifest["output_format"] not in ASSEMBLED_FORMATS:
+        raise Exception(
+            f'{manifest["output_format"]} segments cannot be assembled into a single file without rewriting them. '
+            f'Read the segments of "{job_dir}" as a dataset instead.'
+        )
+    if manifest["rows_completed"] != manifest["row_count"]:
+        raise Exception(f'The job in "{job_dir}" is not finished ({manifest["rows_completed"]}/{manifest["row_count"]} rows).')
+    tmp_path = Path(f"{output_path}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as output:
+        for segment in manifest["segments"]:
+            with open(Path(job_dir) / segment["file"], "rb") as f:
+                shutil.copyfileobj(f, output, 16 * 1024 * 1024)
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(tmp_path, output_path)
+    manifest["output_path"] = str(output_path)
+    write_manifest(job_dir, manifest)
+    if remove_segments:
+        for segment in manifest["segments"]:
+            (Path(job_dir) / segment["file"]).unlink(missing_ok=True)
+    return output_path
@@ -0,0 +1,166 @@
+import sys
+import time
+from contextlib import contextmanager
+from .executor import add_timings
+
+"""
+Run metrics.
+
+`generate_cde` returns a RunMetrics describing where the time and memory of a run went: wall time of every phase (template
+load and its steps, sampling of each variable, each relationship, writing), the peak memory use of each phase, and rows/sec.
+Sampling and relationship times are summed over every chunk of the run, and worker processes report their own peaks.
+
+A phase's peak is the process' memory high-water mark, reset when the phase starts (`reset_peak_rss`). The mark can only be
+reset on Linux: elsewhere it covers the whole life of the process, so a phase reports the peak of any heavier phase before it,
+and the report labels it as cumulative.
+"""
+
+# "generate" is only used by the reference engine, which doesn't time sampling and relationships separately.
+PHASES = ["validate", "load", "generate", "sample", "relationships", "write"]
+
+def reset_peak_rss():
+    """
+    Reset the memory high-water mark of the current process to its current resident set size, so that `max_rss_mb` only
+    covers what runs after this. Only supported on Linux.
+    :return: Whether the mark was reset
+    :rtype: bool
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+def max_rss_mb():
+    """
+    Memory high-water mark (peak resident set size) of the current process in MB since it started or since the last
+    `reset_peak_rss`, or None where neither /proc nor `resource` is available.
+    :rtype: float
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere.
+    return max_rss / (1024 * 1024) if sys.platform == "darwin" else max_rss / 1024
+
+def shard_metrics(columns):
+    """ Metrics of a generated shard (ColumnarRows), in the form passed to `RunMetrics.add_shard`. """
+    return {
+        "sampling_timings": columns.sampling_timings,
+        "relationship_timings": columns.relationship_timings,
+        "max_rss_mb": columns.max_rss_mb
+    }
+
+def _max(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if len(values) > 0 else None
+
+class RunMetrics:
+    def __init__(self):
+        # { phase: { "seconds": ..., "max_rss_mb": ... } }, see PHASES
+        self.phases = {}
+        # { step: seconds } of the template load, e.g. parse/preprocess/compile or cache_read.
+        self.load_timings = {}
+        # { variable_name: seconds } spent selecting responses and generating values.
+        self.sampling_timings = {}
+        # { "<position>:<relationship_name>": seconds }, see `RelationshipExecutor.run`
+        self.relationship_timings = {}
+        self.row_count = 0
+        self.variable_count = 0
+        self.total_seconds = None
+        self.output_path = None
+        self.profile_output = None
+        # Whether phase peaks are measured per phase, or are the peak of the whole run so far (see `reset_peak_rss`).
+        self.per_phase_rss = reset_peak_rss()
+        self._start = time.perf_counter()
+
+    def add_phase(self, name, seconds, max_rss=None):
+        """ Accumulate `seconds` into a phase, keeping the largest memory peak seen for it. """
+        phase = self.phases.setdefault(name, {"seconds": 0.0, "max_rss_mb": None})
+        phase["seconds"] += seconds
+        phase["max_rss_mb"] = _max(phase["max_rss_mb"], max_rss)
+
+    @contextmanager
+    def phase(self, name):
+        """ Time a block of code as (part of) phase `name`. """
+        reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start, max_rss_mb())
+
+    def add_shard(self, metrics):
+        """ Accumulate the metrics of one generated shard (see `shard_metrics`). """
+        add_timings(self.sampling_timings, metrics["sampling_timings"])
+        add_timings(self.relationship_timings, metrics["relationship_timings"])
+        max_rss = metrics.get("max_rss_mb", {})
+        self.add_phase("sample", sum(metrics["sampling_timings"].values()), max_rss.get("sample"))
+        self.add_phase("relationships", sum(metrics["relationship_timings"].values()), max_rss.get("relationships"))
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self._start
+
+    @property
+    def rows_per_second(self):
+        if not self.total_seconds:
+            return None
+        return self.row_count / self.total_seconds
+
+    def to_dict(self):
+        return {
+            "row_count": self.row_count,
+            "variable_count": self.variable_count,
+            "total_seconds": self.total_seconds,
+            "rows_per_second": self.rows_per_second,
+            # Resetting the high-water mark for each phase loses the run's overall peak, which is the largest phase peak.
+            "max_rss_mb": _max(max_rss_mb(), *[phase["max_rss_mb"] for phase in self.phases.values()]),
+            "per_phase_rss": self.per_phase_rss,
+            "phases": self.phases,
+            "load_timings": self.load_timings,
+            "sampling_timings": self.sampling_timings,
+            "relationship_timings": self.relationship_timings,
+            "output_path": self.output_path,
+            "profile_output": self.profile_output
+        }
+
+    def report(self, top=10):
+        """
+        Human-readable summary of the run.
+        :param top: Number of slowest variables to list
+        :type top: int
+        :rtype: str
+        """
+        rss_label = "peak RSS" if self.per_phase_rss else "cumulative peak RSS"
+        def format_rss(max_rss):
+            return f", {rss_label} {max_rss:.0f}MB" if max_rss is not None else ""
+        lines = [f"Generated {self.row_count} rows in {self.total_seconds:.3f}s ({self.rows_per_second:,.0f} rows/s)."]
+        lines.append("Phases:")
+        for name in PHASES:
+            if name not in self.phases:
+                continue
+            phase = self.phases[name]
+            lines.append(f'- {name}: {phase["seconds"]:.3f}s{format_rss(phase["max_rss_mb"])}')
+            if name == "load":
+                for step in self.load_timings:
+                    lines.append(f"    {step}: {self.load_timings[step]:.3f}s")
+            elif name == "sample":
+                slowest = sorted(self.sampling_timings.items(), key=lambda item: item[1], reverse=True)[:top]
+                for variable_name, seconds in slowest:
+                    lines.append(f"    {variable_name}: {seconds:.3f}s")
+            elif name == "relationships":
+                for relationship_key in self.relationship_timings:
+                    lines.append(f"    {relationship_key}: {self.relationship_timings[relationship_key]:.3f}s")
+        if self.profile_output is not None:
+            lines.append(f'cProfile stats written to "{self.profile_output}".')
+        return "\n".join(lines)
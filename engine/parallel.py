@@ -0,0 +1,146 @@
+import random
+import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .columnar import generate_columns
+from .counter_rng import RNG_MODES, CounterStreams
+from .executor import DEFAULT_BLOCK_SIZE, RelationshipExecutor
+from .metrics import max_rss_mb, reset_peak_rss, shard_metrics
+
+"""
+Sharded generation.
+
+`row_count` is split into fixed-size shards and every shard draws from its own RNG stream, derived from the run seed and the
+shard's index (never from which process it runs in or what ran before it). A given seed and shard size therefore always produce
+the same records, whether the shards are generated one after another or spread over a process pool.
+
+In the "counter" RNG mode (see engine/counter_rng.py), draws are keyed by the seed and global row index instead, so records
+don't depend on the shard size either, and any row range can be generated on its own (see `generate_row_range` in generate.py).
+"""
+
+def new_seed():
+    """ Draw a fresh seed from OS entropy, used when the caller does not specify one. """
+    return int(np.random.SeedSequence().entropy)
+
+def split_shards(row_count, shard_size, start=0):
+    """
+    Split `row_count` rows into consecutive shards of at most `shard_size` rows.
+    Shards are numbered by their position in the whole file, so that when `start` is a multiple of `shard_size`, the shards
+    (and their RNG streams) are the same as those of a run starting at row 0.
+    :param start: Global row index of the first row
+    :type start: int
+    :return: list of (shard_index, start_row, shard_row_count)
+    """
+    if shard_size < 1:
+        raise Exception(f"Shard/chunk size must be a positive integer (size={shard_size})")
+    first_shard = start // shard_size
+    return [
+        (first_shard + i, start + offset, min(shard_size, row_count - offset))
+        for i, offset in enumerate(range(0, row_count, shard_size))
+    ]
+
+def seed_shard(seed, shard_index):
+    """
+    Create the independent RNG stream of a shard.
+    The global `random` module is reseeded as well, since per-record relationships, UDFs, and lorem draw from it.
+    :rtype: numpy.random.Generator
+    """
+    seed_sequence = np.random.SeedSequence(seed, spawn_key=(shard_index,))
+    random.seed(int(seed_sequence.generate_state(2, dtype=np.uint64)[0]))
+    return np.random.default_rng(seed_sequence)
+
+def generate_shard(compiled, relationship_plan, seed, shard, sampler="alias", block_size=DEFAULT_BLOCK_SIZE, rng_mode="stream"):
+    """
+    Generate and post-process a single shard. The relationship plan is applied block by block (see engine/executor.py).
+    Time spent on each variable and relationship is recorded under the shard's `sampling_timings` and `relationship_timings`,
+    and the memory peak of each phase under its `max_rss_mb` (see engine/metrics.py).
+    :param shard: (shard_index, start_row, shard_row_count), see `split_shards`
+    :param rng_mode: One of RNG_MODES: "stream" draws from the shard's own RNG stream, "counter" from counter-based streams
+                     keyed by global row index
+    :type rng_mode: str
+    :rtype: ColumnarRows
+    """
+    shard_index, start, shard_row_count = shard
+    if rng_mode == "stream":
+        rng = seed_shard(seed, shard_index)
+        streams = None
+    elif rng_mode == "counter":
+        rng = None
+        streams = CounterStreams(seed)
+    else:
+        raise Exception(f'Unknown RNG mode "{rng_mode}". Expected one of: {", ".join(RNG_MODES)}')
+    reset_peak_rss()
+    columns = generate_columns(compiled, shard_row_count, rng=rng, sampler=sampler, start=start, seed=seed, streams=streams)
+    columns.max_rss_mb["sample"] = max_rss_mb()
+    reset_peak_rss()
+    columns.relationship_timings = RelationshipExecutor(relationship_plan, block_size=block_size).run(
+        columns, rng=rng, streams=streams, start=start
+    )
+    columns.max_rss_mb["relationships"] = max_rss_mb()
+    return columns
+
+def iter_shards(compiled, relationship_plan, row_count, shard_size, seed, sampler="alias", metrics=None, rng_mode="stream", start=0):
+    """
+    Generate shards one after another in the current process.
+    :param metrics: If given, the metrics of every shard are accumulated into it.
+    :type metrics: RunMetrics
+    :param rng_mode: One of RNG_MODES, see `generate_shard`
+    :param start: Global row index of the first row
+    """
+    for shard in split_shards(row_count, shard_size, start=start):
+        columns = generate_shard(compiled, relationship_plan, seed, shard, sampler=sampler, rng_mode=rng_mode)
+        if metrics is not None:
+            metrics.add_shard(shard_metrics(columns))
+        yield columns
+
+# Per-process state of pool workers, set once by `_init_worker` instead of being pickled with every shard.
+_worker_state = {}
+
+def _init_worker(compiled, relationship_plan, seed, sampler, encode, rng_mode):
+    _worker_state["compiled"] = compiled
+    _worker_state["sampler"] = sampler
+    _worker_state["relationship_plan"] = relationship_plan
+    _worker_state["seed"] = seed
+    _worker_state["encode"] = encode
+    _worker_state["rng_mode"] = rng_mode
+
+def _generate_shard_worker(shard):
+    columns = generate_shard(
+        _worker_state["compiled"],
+        _worker_state["relationship_plan"],
+        _worker_state["seed"],
+        shard,
+        sampler=_worker_state["sampler"],
+        rng_mode=_worker_state["rng_mode"]
+    )
+    return (_worker_state["encode"](columns), shard_metrics(columns))
+
+def iter_shards_parallel(compiled, relationship_plan, row_count, shard_size, seed, workers, encode, sampler="alias", metrics=None,
+                         rng_mode="stream", start=0):
+    """
+    Generate shards in a pool of `workers` processes and yield them in shard order.
+    Shards are serialized inside the workers by `encode` (a picklable function of ColumnarRows), so the parent only has to write
+    them out. At most `2 * workers` shards are in flight at once so that memory stays bounded.
+    :param metrics: If given, the metrics of every shard are accumulated into it (memory high-water marks being the workers').
+    :type metrics: RunMetrics
+    :param rng_mode: One of RNG_MODES, see `generate_shard`
+    :param start: Global row index of the first row
+    """
+    shards = split_shards(row_count, shard_size, start=start)
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(compiled, relationship_plan, seed, sampler, encode, rng_mode)
+    ) as executor:
+        pending = deque()
+        def next_result():
+            encoded, encoded_shard_metrics = pending.popleft().result()
+            if metrics is not None:
+                metrics.add_shard(encoded_shard_metrics)
+            return encoded
+        for shard in shards:
+            pending.append(executor.submit(_generate_shard_worker, shard))
+            if len(pending) >= 2 * workers:
+                yield next_result()
+        while len(pending) > 0:
+            yield next_result()
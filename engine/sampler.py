@@ -0,0 +1,111 @@
+import random
+import numpy as np
+
+"""
+Weighted response samplers.
+
+- "cdf": inverse CDF lookup, a binary search over the cumulative frequencies per draw (same approach as `random.choices`).
+- "alias": Walker/Vose alias method. Tables are built once per variable when the template is compiled, after which
+  every draw is O(1): pick a column uniformly, then keep it or take its alias depending on a single uniform draw.
+"""
+
+SAMPLERS = ["alias", "cdf"]
+
+class AliasTable:
+    def __init__(self, weights):
+        """
+        Build the alias table of a discrete distribution (Vose's method).
+        :param weights: Non-negative relative weights, they don't need to sum to 1.
+        :type weights: Sequence[float]
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        size = len(weights)
+        total = weights.sum()
+        if size == 0 or total <= 0:
+            raise Exception(f"Cannot build an alias table for weights {list(weights)}, their sum must be positive.")
+        scaled = weights * (size / total)
+        self.probability = np.ones(size, dtype=np.float64)
+        self.alias = np.arange(size, dtype=np.int64)
+        small = [i for i in range(size) if scaled[i] < 1]
+        large = [i for i in range(size) if scaled[i] >= 1]
+        while len(small) > 0 and len(large) > 0:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = (scaled[more] + scaled[less]) - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever remains is (up to floating-point error) exactly 1 and keeps its own column.
+        for i in small + large:
+            self.probability[i] = 1
+        self._probability_list = self.probability.tolist()
+        self._alias_list = self.alias.tolist()
+
+    def __len__(self):
+        return len(self.probability)
+
+    def sample(self, rng, size):
+        """
+        Vectorized draw of `size` indices.
+        :param rng: numpy.random.Generator
+        :rtype: numpy.ndarray
+        """
+        # A single uniform draw per sample: its integer part picks the column, its fractional part decides column vs alias.
+        draws = rng.random(size) * len(self.probability)
+        columns = draws.astype(np.int64)
+        np.minimum(columns, len(self.probability) - 1, out=columns)
+        keep = (draws - columns) < self.probability[columns]
+        return np.where(keep, columns, self.alias[columns])
+
+    def draw(self, random_module=random):
+        """ Scalar draw of a single index, using the `random` module (or a `random.Random` instance). """
+        column = int(random_module.random() * len(self._probability_list))
+        if random_module.random() < self._probability_list[column]:
+            return column
+        return self._alias_list[column]
+
+def sample_cdf(cumulative, rng, size):
+    """ Vectorized inverse CDF draw of `size` indices from cumulative weights. """
+    draws = rng.random(size) * cumulative[-1]
+    indices = np.searchsorted(cumulative, draws, side="right")
+    # Guard against floating-point draws landing exactly on the total.
+    np.minimum(indices, len(cumulative) - 1, out=indices)
+    return indices
+
+def check_sampler(compiled, sampler="alias", draws=200000, seed=None, max_z_score=5.0):
+    """
+    Statistical check of a sampler against the template's `frequency` values.
+    Draws `draws` responses for every variable and compares each response's empirical count to its expected binomial
+    distribution, failing if any count is more than `max_z_score` standard deviations away.
+    :param compiled: Compiled template
+    :type compiled: CompiledTemplate
+    :return: The largest z-score observed, as (z_score, variable_name, response_name)
+    :raises Exception: If any response frequency is off by more than `max_z_score` standard deviations.
+    """
+    rng = np.random.default_rng(seed)
+    worst = (0.0, None, None)
+    for variable_name in compiled.header:
+        variable = compiled[variable_name]
+        if sampler == "alias":
+            indices = variable.alias_table.sample(rng, draws)
+        else:
+            indices = sample_cdf(variable.cumulative, rng, draws)
+        counts = np.bincount(indices, minlength=len(variable.responses))
+        expected = variable.frequencies / variable.frequencies.sum()
+        for i, p in enumerate(expected):
+            if p == 0 or p == 1:
+                if counts[i] != p * draws:
+                    raise Exception(f'Sampler "{sampler}" drew {counts[i]}/{draws} of response "{variable.response_names[i]}" of "{variable_name}", expected frequency {p}.')
+                continue
+            z_score = abs(counts[i] - p * draws) / np.sqrt(draws * p * (1 - p))
+            if z_score > worst[0]:
+                worst = (float(z_score), variable_name, variable.response_names[i])
+            if z_score > max_z_score:
+                raise Exception(
+                    f'Sampler "{sampler}" drew response "{variable.response_names[i]}" of "{variable_name}" with empirical frequency '
+                    f'{counts[i] / draws:.5f}, expected {p:.5f} (z={z_score:.2f}).'
+                )
+    return worst
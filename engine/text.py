@@ -0,0 +1,96 @@
+import numpy as np
+from lorem.data import WORDS
+
+"""
+Bulk lorem ipsum generation.
+
+Equivalent to joining `TextLorem(srange=sentence_length).sentence()` a random number (in `num_sentences`) of times per cell,
+but a whole column of cells is drawn at once: sentence counts, sentence lengths and words are each a single vectorized draw
+from a precomputed word array, and Python is only used to join each cell's words together.
+"""
+
+class LoremGenerator:
+    def __init__(self, num_sentences, sentence_length, words=WORDS):
+        """
+        :param num_sentences: [min, max] number of sentences per cell (inclusive)
+        :param sentence_length: [min, max] number of words per sentence (inclusive)
+        :param words: Word pool to draw from, defaults to the `lorem` package's
+        """
+        self.min_sentences, self.max_sentences = num_sentences
+        self.min_words, self.max_words = sentence_length
+        self.words = np.array(words, dtype=object)
+        # Sentences start with a capitalized word.
+        self.capitalized_words = np.array([word[0].upper() + word[1:] for word in words], dtype=object)
+
+    def generate(self, count, rng):
+        """
+        Generate `count` cells of text.
+        :param rng: numpy.random.Generator
+        :rtype: list
+        """
+        sentence_counts = rng.integers(self.min_sentences, self.max_sentences + 1, size=count)
+        word_counts = rng.integers(self.min_words, self.max_words + 1, size=int(sentence_counts.sum()))
+        word_indices = rng.integers(0, len(self.words), size=int(word_counts.sum()))
+
+        tokens = self.words[word_indices]
+        sentence_ends = np.cumsum(word_counts)
+        sentence_starts = sentence_ends - word_counts
+        tokens[sentence_starts] = self.capitalized_words[word_indices[sentence_starts]]
+        # sentences end in periods.
+        tokens[sentence_ends - 1] += "."
+
+        # Word offsets of every cell, from the number of words in each cell's sentences.
+        sentence_cells = np.repeat(np.arange(count), sentence_counts)
+        cell_word_counts = np.bincount(sentence_cells, weights=word_counts, minlength=count).astype(np.int64)
+        cell_ends = np.cumsum(cell_word_counts).tolist()
+        tokens = tokens.tolist()
+        cells = []
+        start = 0
+        for end in cell_ends:
+            cells.append(" ".join(tokens[start:end]))
+            start = end
+        return cells
+
+    def generate_aligned(self, count, rng):
+        """
+        Same as `generate`, but every draw is row-aligned (one value, or a fixed number of values, per cell), so that a cell's
+        text only depends on its own draws. Used with counter-based RNGs (see engine/counter_rng.py).
+        :param rng: numpy.random.Generator or CounterRNG
+        :rtype: list
+        """
+        sentence_counts = rng.integers(self.min_sentences, self.max_sentences + 1, size=count)
+        word_counts = rng.integers(self.min_words, self.max_words + 1, size=(count, self.max_sentences))
+        word_indices = rng.integers(0, len(self.words), size=(count, self.max_sentences, self.max_words))
+
+        # Only the first sentence_counts[i] sentences of a cell, and the first word_counts[i, j] words of a sentence, are used.
+        word_positions = np.arange(self.max_words)
+        used = (np.arange(self.max_sentences)[None, :] < sentence_counts[:, None])[:, :, None] \
+            & (word_positions[None, None, :] < word_counts[:, :, None])
+        tokens = self.words[word_indices]
+        first = used & (word_positions == 0)
+        tokens[first] = self.capitalized_words[word_indices[first]]
+        tokens[used & (word_positions == word_counts[:, :, None] - 1)] += "."
+
+        cell_ends = np.cumsum(used.sum(axis=(1, 2))).tolist()
+        tokens = tokens[used].tolist()
+        cells = []
+        start = 0
+        for end in cell_ends:
+            cells.append(" ".join(tokens[start:end]))
+            start = end
+        return cells
+
+# One generator per (num_sentences, sentence_length) config, shared by every variable/chunk using it.
+_lorem_generators = {}
+
+def get_lorem_generator(config):
+    """
+    :param config: A `lorem` response_value_generator config, {"num_sentences": [min, max], "sentence_length": [min, max]}
+    :rtype: LoremGenerator
+    """
+    key = (tuple(config["num_sentences"]), tuple(config["sentence_length"]))
+    generator = _lorem_generators.get(key)
+    if generator is None:
+        generator = LoremGenerator(key[0], key[1])
+        _lorem_generators[key] = generator
+    return generator
@@ -0,0 +1,236 @@
+import copy
+import json
+import os
+import ruamel.yaml
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from relationships import Register
+from .compiled import CompiledTemplate, get_generator, preprocess_template
+
+"""
+Template validation.
+
+Checks a template before anything is generated: its structure against template_schema.json, that the frequencies of each
+variable don't exceed 1.0 and leave something to sample, that generator configs are usable (known UDFs, ordered ranges, ...),
+and that relationships exist, can be planned, and only reference variables (and, for rules and CPTs, responses) of the template.
+Variables are independent of each other, so large templates are checked in batches on a process pool.
+"""
+
+SCHEMA_FILE = Path(__file__).resolve().parent.parent / "template_schema.json"
+# Below this many variables, checking them in the current process is faster than starting a pool.
+PARALLEL_THRESHOLD = 2000
+VARIABLES_PER_BATCH = 500
+
+def load_schema(schema_file=SCHEMA_FILE):
+    with open(schema_file, "r") as f:
+        return json.load(f)
+
+# Per-process schema validators, created on first use.
+_validators = {}
+
+def _get_validators(schema_file):
+    if schema_file not in _validators:
+        try:
+            import jsonschema
+        except ImportError:
+            raise Exception("Template validation requires jsonschema. Install it with: pip3 install jsonschema")
+        schema = load_schema(schema_file)
+        validator_class = jsonschema.validators.validator_for(schema)
+        variable_schema = schema["properties"]["variables"]["additionalProperties"]
+        # The top-level validator only checks the template's own keys; variables are checked one by one.
+        top_level_schema = {**schema, "properties": {**schema["properties"], "variables": {"type": "object"}}}
+        _validators[schema_file] = (validator_class(top_level_schema), validator_class(variable_schema))
+    return _validators[schema_file]
+
+def _schema_errors(validator, instance, location):
+    return [
+        f'{location}{"".join(f"[{part!r}]" for part in error.absolute_path)}: {error.message}'
+        for error in sorted(validator.iter_errors(instance), key=lambda error: list(error.absolute_path))
+    ]
+
+def _check_pair(errors, location, name, pair, minimum=None):
+    if not isinstance(pair, list) or len(pair) != 2 or not all(isinstance(x, int) and not isinstance(x, bool) for x in pair):
+        errors.append(f"{location}: `{name}` should be a [min, max] pair of integers (got {pair!r}).")
+    elif pair[0] > pair[1]:
+        errors.append(f"{location}: `{name}` minimum {pair[0]} is greater than its maximum {pair[1]}.")
+    elif minimum is not None and pair[0] < minimum:
+        errors.append(f"{location}: `{name}` should be at least {minimum} (got {pair!r}).")
+
+def check_generator(location, response):
+    """ Check a response's `response_value_generator`, as it will be resolved by `get_generator`. """
+    errors = []
+    generator_schema = response.get("response_value_generator")
+    if generator_schema is None:
+        return errors
+    generator = get_generator(response)
+    if generator is None:
+        errors.append(f"{location}: `response_value_generator` doesn't configure any of udf, lorem, range, or valid_inputs.")
+        return errors
+    kind, config = generator
+    if kind == "udf":
+        name = config.get("name")
+        if name not in Register.udfs and name not in Register.batch_udfs:
+            errors.append(
+                f'{location}: unknown UDF "{name}". Make sure it is decorated with @udf and imported within relationships/__init__.py.'
+            )
+    elif kind == "lorem":
+        _check_pair(errors, f"{location}.lorem", "num_sentences", config.get("num_sentences"), minimum=1)
+        _check_pair(errors, f"{location}.lorem", "sentence_length", config.get("sentence_length"), minimum=1)
+    elif kind == "range":
+        _check_pair(errors, location, "range", config)
+    return errors
+
+def check_variable(variable_name, responses, variable_validator=None):
+    """
+    Check a single variable of a template (before `preprocess_template`).
+    :return: Error messages, empty if the variable is valid
+    :rtype: list
+    """
+    location = f'Variable "{variable_name}"'
+    if variable_validator is not None:
+        errors = _schema_errors(variable_validator, responses, location)
+        if len(errors) > 0:
+            return errors
+    errors = []
+    if not isinstance(responses, list) or len(responses) == 0:
+        return [f"{location}: should be a non-empty list of responses."]
+    total_freq = 0
+    no_freq_responses = 0
+    for i, response in enumerate(responses):
+        if not isinstance(response, dict):
+            errors.append(f"{location}[{i}]: responses should be mappings (got {response!r}).")
+            continue
+        frequency = response.get("frequency")
+        if frequency is None:
+            no_freq_responses += 1
+        elif isinstance(frequency, bool) or not isinstance(frequency, (int, float)) or frequency < 0:
+            errors.append(f'{location}, response "{response.get("response_name")}": frequency should be a non-negative number (got {frequency!r}).')
+        else:
+            total_freq += frequency
+        errors.extend(check_generator(f'{location}, response "{response.get("response_name")}"', response))
+    if total_freq > 1:
+        errors.append(f"{location}: sum of response frequencies should not exceed 1.0 (total_freq={total_freq})")
+    elif total_freq <= 0 and no_freq_responses == 0:
+        errors.append(f"{location}: all response frequencies are 0, no response can be sampled.")
+    return errors
+
+def _check_variables(batch, schema_file):
+    variable_validator = _get_validators(schema_file)[1] if schema_file is not None else None
+    errors = []
+    for variable_name, responses in batch:
+        errors.extend(check_variable(variable_name, responses, variable_validator))
+    return errors
+
+def check_relationships(relationships, variables, compiled=None):
+    """
+    Check that every relationship is registered, that they can be planned, and that they only reference variables of the template.
+    :param relationships: Relationship configuration, as loaded from a relationship file ({"relationships": [...]})
+    :type relationships: dict
+    :param variables: Variable names of the template
+    :type variables: Collection[str]
+    :param compiled: If given, the responses referenced by typed relationships are checked as well, as when generating
+                     (see `CompiledTemplate.relationship_errors`)
+    :type compiled: CompiledTemplate
+    :rtype: list
+    """
+    errors = []
+    # Each relationship is resolved and checked on its own, so that one invalid relationship doesn't hide the errors of the others.
+    resolved = []
+    for yaml_spec in relationships.get("relationships") or []:
+        try:
+            resolved.append(Register._get_relationship(yaml_spec))
+        except Exception as e:
+            errors.append(str(e))
+    if compiled is not None:
+        errors.extend(compiled.relationship_errors(resolved))
+    else:
+        for relationship in resolved:
+            for field in ["dependencies", "modifies"]:
+                for variable_name in relationship[field]:
+                    if variable_name not in variables:
+                        errors.append(
+                            f'Relationship "{relationship["name"]}" lists variable "{variable_name}" under its `{field}` field, '
+                            f'but the variable does not exist in the template.'
+                        )
+    # Planning errors (e.g. cycles) of the relationships that could be resolved.
+    try:
+        Register._plan(resolved)
+    except Exception as e:
+        errors.append(str(e))
+    return errors
+
+def validate_template(template, relationships=None, workers=None, schema_file=SCHEMA_FILE):
+    """
+    Validate a template, as loaded from YAML and before `preprocess_template`, in one pass.
+    :param template: Template to validate
+    :type template: dict
+    :param relationships: Relationship configuration to check against the template, if any
+    :type relationships: dict
+    :param workers: Size of the process pool checking variables. Defaults to the number of CPUs for templates of at least
+        PARALLEL_THRESHOLD variables, and to checking them in the current process otherwise.
+    :type workers: int
+    :param schema_file: jsonschema of templates, or None to skip the schema checks
+    :type schema_file: str
+    :return: Every error found, empty if the template is valid
+    :rtype: list
+    """
+    errors = []
+    if not isinstance(template, dict):
+        return ["Template should be a mapping with a `variables` field."]
+    if schema_file is not None:
+        errors.extend(_schema_errors(_get_validators(schema_file)[0], template, "Template"))
+    variables = template.get("variables")
+    if not isinstance(variables, dict):
+        return errors if len(errors) > 0 else ["Template should have a `variables` mapping."]
+
+    items = list(variables.items())
+    batches = [items[i:i + VARIABLES_PER_BATCH] for i in range(0, len(items), VARIABLES_PER_BATCH)]
+    if workers is None:
+        workers = (os.cpu_count() or 1) if len(items) >= PARALLEL_THRESHOLD else 1
+    if workers > 1 and len(batches) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for batch_errors in executor.map(_check_variables, batches, [schema_file] * len(batches)):
+                errors.extend(batch_errors)
+    else:
+        for batch in batches:
+            errors.extend(_check_variables(batch, schema_file))
+
+    if relationships is not None:
+        compiled = None
+        if len(errors) == 0:
+            # Responses can only be looked up in a compiled template, which can only be built from valid variables.
+            compiled_template = {"variables": copy.deepcopy(variables)}
+            preprocess_template(compiled_template)
+            compiled = CompiledTemplate(compiled_template)
+        errors.extend(check_relationships(relationships, variables, compiled=compiled))
+    return errors
+
+def check_template(template, relationships=None, workers=None, schema_file=SCHEMA_FILE):
+    """
+    `validate_template`, raising on invalid templates.
+    :raises Exception: Listing every error found.
+    """
+    errors = validate_template(template, relationships=relationships, workers=workers, schema_file=schema_file)
+    if len(errors) > 0:
+        raise Exception(f"Template is invalid ({len(errors)} errors):\n" + "\n".join(f"- {error}" for error in errors))
+
+def validate_template_file(template_file, relationship_file=None, workers=None):
+    """
+    Validate a template file and its relationship file (by default the one set under the template's `relationships` field).
+    The YAML is read with the safe (C) loader, which is much faster than the round-trip loader used for generation.
+    :raises Exception: Listing every error found.
+    """
+    yaml = ruamel.yaml.YAML(typ="safe")
+    with open(template_file, "r", encoding="utf-8-sig") as f:
+        template = yaml.load(f)
+    if relationship_file is None and isinstance(template, dict):
+        relationship_file = template.get("relationships")
+    relationships = None
+    if relationship_file is not None:
+        with open(relationship_file, "r") as f:
+            relationships = yaml.load(f)
+    check_template(template, relationships=relationships, workers=workers)
+    checked = f'{len(template["variables"])} variables'
+    if relationship_file is not None:
+        checked += f', relationships "{relationship_file}"'
+    print(f'Template "{template_file}" is valid ({checked}).')
@@ -0,0 +1,341 @@
+import csv
+import json
+import numpy as np
+from relationships import Register, UdfContext
+from .compression import get_codec, open_output
+from .csv_encoding import encode_csv_columns
+
+"""
+Output writers.
+
+A writer turns generated chunks into one output format. Chunks are written one at a time, each from its response index
+columns (see engine/columnar.py), so that a file never has to be held in memory as a whole.
+
+Writing is split in two steps so that it can be spread over worker processes: `encode` serializes a chunk into a payload
+without touching the output file (and can therefore run inside a worker), and `write` appends a payload to the file in order.
+
+Typed formats (parquet, arrow, jsonl) write every variable as either an "int" or a "string" column (see `infer_column_types`):
+integer codes stay integers and free text/IDs stay strings, with null for responses without a value.
+"""
+
+COLUMN_TYPES = ["int", "string"]
+
+def _value_type(value):
+    if value is None:
+        return None
+    # bool is a subclass of int, but True/False are not integer codes.
+    if isinstance(value, (int, np.integer)) and not isinstance(value, (bool, np.bool_)):
+        return "int"
+    return "string"
+
+def _probe_udf(config):
+    """ Generate a single value with a UDF to find out what type it returns. """
+    name = config["name"]
+    args = config.get("args", [])
+    kwargs = config.get("kwargs", {})
+    if Register.has_batch_udf(name):
+        context = UdfContext(np.random.default_rng(0), np.zeros(1, dtype=np.int64), seed=0)
+        values = Register.invoke_batch_udf(name, 1, context, *args, **kwargs)
+        return values.tolist()[0] if isinstance(values, np.ndarray) else list(values)[0]
+    return Register.invoke_udf(name, *args, **kwargs)
+
+def _generator_types(kind, config):
+    if kind == "range":
+        return {"int"}
+    elif kind == "lorem":
+        return {"string"}
+    elif kind == "valid_inputs":
+        return {_value_type(value) for value in config}
+    elif kind == "udf":
+        return {_value_type(_probe_udf(config))}
+    raise Exception(f'Unknown response_value_generator "{kind}"')
+
+def infer_column_types(compiled):
+    """
+    Decide the type of every column: "int" if every fixed response value and every generator of the variable produces
+    integers, "string" otherwise. UDFs are probed with a single call to see what they return.
+    :param compiled: Compiled template
+    :type compiled: CompiledTemplate
+    :return: { variable_name: "int" | "string" }
+    :rtype: dict
+    """
+    column_types = {}
+    for variable_name in compiled.header:
+        variable = compiled[variable_name]
+        value_types = set()
+        for i, value in enumerate(variable.values):
+            if i in variable.generators:
+                value_types |= _generator_types(*variable.generators[i])
+            else:
+                value_types.add(_value_type(value))
+        value_types.discard(None)
+        column_types[variable_name] = "int" if value_types == {"int"} else "string"
+    return column_types
+
+def typed_column(columns, variable_name, column_type):
+    """
+    Build the values of one column straight from its response indices.
+    :param columns: Generated records
+    :type columns: ColumnarRows
+    :param column_type: "int" or "string"
+    :return: (values, nulls). For "int" columns, `values` is an int64 array and `nulls` a boolean mask of missing values.
+        For "string" columns, `values` is an object array of str/None and `nulls` is None.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    variable = columns.compiled[variable_name]
+    indices = columns.indices[variable_name]
+    generated = columns.generated.get(variable_name)
+    generated_mask = variable.is_generated.take(indices) if generated is not None else None
+    if column_type == "int":
+        # Per-response tables, looked up for the whole column at once.
+        value_table = np.array([value if _value_type(value) == "int" else 0 for value in variable.values], dtype=np.int64)
+        null_table = np.array([value is None for value in variable.values], dtype=bool)
+        values = value_table.take(indices)
+        nulls = null_table.take(indices)
+        if generated_mask is not None and generated_mask.any():
+            generated_values = generated[generated_mask]
+            nulls[generated_mask] = [value is None for value in generated_values]
+            values[generated_mask] = [0 if value is None else int(value) for value in generated_values]
+        return (values, nulls)
+    if column_type == "string":
+        value_table = np.empty(len(variable.values), dtype=object)
+        value_table[:] = [None if value is None else str(value) for value in variable.values]
+        values = value_table.take(indices)
+        if generated_mask is not None and generated_mask.any():
+            values[generated_mask] = [None if value is None else str(value) for value in generated[generated_mask]]
+        return (values, None)
+    raise Exception(f'Unknown column type "{column_type}". Expected one of: {", ".join(COLUMN_TYPES)}')
+
+def typed_record_columns(records, header, column_types):
+    """
+    Typed columns of records given as lists of values in header order (as produced by the reference engine).
+    :return: One list of int/str/None values per variable
+    :rtype: list
+    """
+    typed_columns = []
+    for variable_name, values in zip(header, zip(*records) if len(records) > 0 else [[] for variable_name in header]):
+        convert = int if column_types[variable_name] == "int" else str
+        typed_columns.append([None if value is None else convert(value) for value in values])
+    return typed_columns
+
+class Writer:
+    """
+    Base class of output writers. Subclasses implement `encode` and `write` (and `open`/`close` if they need to).
+    :param output_path: Path of the output file
+    :type output_path: str
+    :param header: Variable names, in column order
+    :type header: list
+    :param column_types: { variable_name: "int" | "string" }, required by typed formats (see `infer_column_types`)
+    :type column_types: dict
+    :param compression_threads: Number of threads compressing text formats written to a compressed path (see engine/compression.py)
+    :type compression_threads: int
+    :param write_header: Whether to start the file with a header row (csv only), e.g. False for the segments of a file after the first
+    :type write_header: bool
+    """
+    format = None
+    extension = None
+
+    def __init__(self, output_path, header, column_types=None, compression_threads=None, write_header=True):
+        self.output_path = output_path
+        self.header = header
+        self.column_types = column_types
+        self.compression_threads = compression_threads
+        self.write_header = write_header
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    @classmethod
+    def encode(cls, columns, header, column_types=None):
+        """ Serialize a chunk of records (ColumnarRows) into a payload that `write` can append to the file. """
+        raise NotImplementedError
+
+    def write(self, payload):
+        raise NotImplementedError
+
+    def write_records(self, records):
+        """ Write records given as lists of values in header order. """
+        raise NotImplementedError
+
+    def write_chunk(self, columns):
+        self.write(self.encode(columns, self.header, self.column_types))
+
+class CsvWriter(Writer):
+    format = "csv"
+    extension = ".csv"
+
+    def open(self):
+        self.file = open_output(self.output_path, threads=self.compression_threads)
+        self.csv_writer = csv.writer(self.file, delimiter=",")
+        if self.write_header:
+            self.csv_writer.writerow(self.header)
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def encode(cls, columns, header, column_types=None):
+        """ Serialize the records of `columns` (without a header) to csv text, as written by `csv.writer`. """
+        return encode_csv_columns(columns)
+
+    def write(self, payload):
+        self.file.write(payload)
+
+    def write_records(self, records):
+        self.csv_writer.writerows(records)
+
+class JsonlWriter(Writer):
+    """ One JSON object per line, keyed by variable name, with integer columns as JSON numbers. """
+    format = "jsonl"
+    extension = ".jsonl"
+
+    def open(self):
+        self.file = open_output(self.output_path, threads=self.compression_threads)
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def encode(cls, columns, header, column_types=None):
+        typed_columns = []
+        for variable_name in header:
+            values, nulls = typed_column(columns, variable_name, column_types[variable_name])
+            values = values.tolist()
+            if nulls is not None:
+                for i in np.flatnonzero(nulls).tolist():
+                    values[i] = None
+            typed_columns.append(values)
+        return "".join(json.dumps(dict(zip(header, row))) + "\n" for row in zip(*typed_columns))
+
+    def write(self, payload):
+        self.file.write(payload)
+
+    def write_records(self, records):
+        typed_columns = typed_record_columns(records, self.header, self.column_types)
+        self.file.write("".join(json.dumps(dict(zip(self.header, row))) + "\n" for row in zip(*typed_columns)))
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise Exception("Writing parquet or arrow files requires pyarrow. Install it with: pip3 install pyarrow")
+    return pyarrow
+
+def _check_uncompressed(output_path, output_format):
+    if get_codec(output_path) is not None:
+        raise Exception(
+            f'Cannot write "{output_path}": {output_format} files are compressed internally, '
+            f'compressed output paths are only supported for text formats.'
+        )
+
+def arrow_schema(header, column_types):
+    pa = _import_pyarrow()
+    return pa.schema([
+        (variable_name, pa.int64() if column_types[variable_name] == "int" else pa.string())
+        for variable_name in header
+    ])
+
+def encode_record_batch(columns, header, column_types):
+    """ Build a pyarrow RecordBatch holding a chunk's typed columns. """
+    pa = _import_pyarrow()
+    arrays = []
+    for variable_name in header:
+        values, nulls = typed_column(columns, variable_name, column_types[variable_name])
+        if nulls is not None:
+            arrays.append(pa.array(values, type=pa.int64(), mask=nulls))
+        else:
+            arrays.append(pa.array(values, type=pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, schema=arrow_schema(header, column_types))
+
+def records_to_record_batch(records, header, column_types):
+    """ Build a pyarrow RecordBatch from records given as lists of values in header order. """
+    pa = _import_pyarrow()
+    schema = arrow_schema(header, column_types)
+    typed_columns = typed_record_columns(records, header, column_types)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(typed_columns, schema)],
+        schema=schema
+    )
+
+class ParquetWriter(Writer):
+    """ Parquet file with one row group per chunk. """
+    format = "parquet"
+    extension = ".parquet"
+
+    def open(self):
+        _check_uncompressed(self.output_path, self.format)
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+        self.parquet_writer = pq.ParquetWriter(self.output_path, arrow_schema(self.header, self.column_types))
+
+    def close(self):
+        self.parquet_writer.close()
+
+    @classmethod
+    def encode(cls, columns, header, column_types=None):
+        return encode_record_batch(columns, header, column_types)
+
+    def write(self, payload):
+        self.parquet_writer.write_batch(payload, row_group_size=max(1, payload.num_rows))
+
+    def write_records(self, records):
+        self.write(records_to_record_batch(records, self.header, self.column_types))
+
+class ArrowWriter(Writer):
+    """ Arrow IPC file with one record batch per chunk. """
+    format = "arrow"
+    extension = ".arrow"
+
+    def open(self):
+        _check_uncompressed(self.output_path, self.format)
+        pa = _import_pyarrow()
+        self.arrow_writer = pa.ipc.new_file(self.output_path, arrow_schema(self.header, self.column_types))
+
+    def close(self):
+        self.arrow_writer.close()
+
+    @classmethod
+    def encode(cls, columns, header, column_types=None):
+        return encode_record_batch(columns, header, column_types)
+
+    def write(self, payload):
+        self.arrow_writer.write_batch(payload)
+
+    def write_records(self, records):
+        self.write(records_to_record_batch(records, self.header, self.column_types))
+
+WRITERS = {
+    writer.format: writer for writer in [CsvWriter, ParquetWriter, ArrowWriter, JsonlWriter]
+}
+OUTPUT_FORMATS = list(WRITERS)
+
+def get_writer(output_format):
+    if output_format not in WRITERS:
+        raise Exception(f'Unknown output format "{output_format}". Expected one of: {", ".join(OUTPUT_FORMATS)}')
+    return WRITERS[output_format]
+
+class ChunkEncoder:
+    """
+    Picklable `encode` function of a format, for serializing chunks inside worker processes (see `iter_shards_parallel`).
+    """
+    def __init__(self, output_format, header, column_types=None):
+        self.writer = get_writer(output_format)
+        self.header = header
+        self.column_types = column_types
+
+    def __call__(self, columns):
+        return self.writer.encode(columns, self.header, self.column_types)
+
+def encode_csv(columns):
+    """ Serialize the records of `columns` (without a header) to csv text, as written by `csv.writer`. """
+    return CsvWriter.encode(columns, columns.header)
@@ -0,0 +1,597 @@
+import click
+import codecs
+import csv
+import io
+import os
+import ruamel.yaml
+from ruamel.yaml.scalarstring import DoubleQuotedScalarString
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from engine import get_generator
+
+"""
+Template fitting.
+
+Learns the response frequencies of a template (and the ranges of its integer responses) from real or sample CDE files, e.g.
+`RADx_Tier1CDE_SampleData_V1.csv`. Input CSVs are streamed in chunks of rows, and every chunk is reduced to counts per
+response before the next one is read, so memory use doesn't depend on the size of the inputs. Files are split into byte
+ranges (at line boundaries) that are counted independently, optionally on a process pool.
+"""
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_PRECISION = 4
+# Below this many bytes per part, splitting a file isn't worth the overhead of a worker.
+MIN_PART_BYTES = 8 * 1024 * 1024
+# Examples of values matching no response that are kept per variable.
+MAX_UNMATCHED_EXAMPLES = 5
+
+def _is_integer_response(response):
+    """ Integer responses (no response_value, generated with `range` or named "integer") get their range fitted. """
+    if response.get("response_value") is not None:
+        return False
+    generator = get_generator(response)
+    if generator is not None:
+        return generator[0] == "range"
+    return response.get("response_name") == "integer"
+
+def response_lookup(template):
+    """
+    Build how each CSV value is attributed to a response of its variable: values matching a response code go to that
+    response, other integers to the variable's integer response (if any), and anything else to its text response (if any).
+    :return: { variable_name: (code_indices, integer_index, text_index, response_count) }, code_indices being
+        { csv_value: response_index }
+    :rtype: dict
+    """
+    lookup = {}
+    for variable_name, responses in template["variables"].items():
+        code_indices = {}
+        integer_index = None
+        text_index = None
+        for i, response in enumerate(responses):
+            if response.get("response_value") is not None:
+                code_indices.setdefault(str(response["response_value"]), i)
+            elif _is_integer_response(response):
+                integer_index = i if integer_index is None else integer_index
+            elif text_index is None:
+                text_index = i
+        lookup[variable_name] = (code_indices, integer_index, text_index, len(responses))
+    return lookup
+
+def new_variable_counts(response_count):
+    return {
+        "counts": [0] * response_count,
+        "unmatched": 0,
+        "unmatched_examples": [],
+        "integer_min": None,
+        "integer_max": None
+    }
+
+def merge_counts(counts, other):
+    """ Add the counts of `other` ({ variable_name: variable counts }) into `counts`. """
+    for variable_name, other_counts in other.items():
+        if variable_name not in counts:
+            counts[variable_name] = other_counts
+            continue
+        variable_counts = counts[variable_name]
+        variable_counts["counts"] = [a + b for a, b in zip(variable_counts["counts"], other_counts["counts"])]
+        variable_counts["unmatched"] += other_counts["unmatched"]
+        examples = variable_counts["unmatched_examples"]
+        examples.extend(example for example in other_counts["unmatched_examples"] if example not in examples)
+        del examples[MAX_UNMATCHED_EXAMPLES:]
+        for key, pick in [("integer_min", min), ("integer_max", max)]:
+            values = [value for value in (variable_counts[key], other_counts[key]) if value is not None]
+            variable_counts[key] = pick(values) if len(values) > 0 else None
+    return counts
+
+def attribute_value(value, lookup):
+    """
+    Attribute a CSV value to a response of its variable.
+    :param lookup: The variable's entry of `response_lookup`
+    :return: (response index or None if the value matches no response, the value as an int if attributed to the integer response)
+    :rtype: (int, int)
+    """
+    code_indices, integer_index, text_index = lookup[:3]
+    i = code_indices.get(value)
+    if i is not None:
+        return (i, None)
+    if integer_index is not None:
+        try:
+            return (integer_index, int(value))
+        except ValueError:
+            pass
+    if text_index is not None and value != "":
+        return (text_index, None)
+    return (None, None)
+
+def count_column(variable_counts, column, lookup):
+    """ Count the values of one column of a chunk of rows. """
+    counts = variable_counts["counts"]
+    # Distinct values per chunk are few for coded variables, so only those are looked up.
+    for value, count in Counter(column).items():
+        i, integer = attribute_value(value, lookup)
+        if i is not None:
+            counts[i] += count
+            if integer is not None:
+                if variable_counts["integer_min"] is None or integer < variable_counts["integer_min"]:
+                    variable_counts["integer_min"] = integer
+                if variable_counts["integer_max"] is None or integer > variable_counts["integer_max"]:
+                    variable_counts["integer_max"] = integer
+            continue
+        variable_counts["unmatched"] += count
+        if len(variable_counts["unmatched_examples"]) < MAX_UNMATCHED_EXAMPLES and value not in variable_counts["unmatched_examples"]:
+            variable_counts["unmatched_examples"].append(value)
+
+class _RangeReader(io.RawIOBase):
+    """ Raw reader over the bytes of a file from `start` up to `end` (or EOF if None). """
+    def __init__(self, f, start, end):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = end - start if end is not None else None
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer) if self.remaining is None else min(len(buffer), self.remaining)
+        data = self.f.read(size)
+        buffer[:len(data)] = data
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        return len(data)
+
+def read_header(input_file):
+    """ :return: (header, offset of the first record) """
+    with open(input_file, "rb") as f:
+        first_line = f.readline()
+        header = next(csv.reader([first_line.decode("utf-8-sig")]))
+        return (header, f.tell())
+
+def split_csv(input_file, parts):
+    """
+    Split the records of a CSV file into byte ranges that start at line boundaries.
+    Ranges are only valid if no quoted field contains a newline at a split point, which is checked when counting them.
+    :return: (header, [(start, end), ...])
+    :rtype: (list, list)
+    """
+    header, data_start = read_header(input_file)
+    size = os.path.getsize(input_file)
+    parts = max(1, min(parts, (size - data_start) // MIN_PART_BYTES))
+    boundaries = [data_start]
+    with open(input_file, "rb") as f:
+        for i in range(1, parts):
+            f.seek(data_start + (size - data_start) * i // parts)
+            f.readline()
+            if f.tell() > boundaries[-1] and f.tell() < size:
+                boundaries.append(f.tell())
+    boundaries.append(size)
+    return (header, list(zip(boundaries[:-1], boundaries[1:])))
+
+def iter_csv_chunks(input_file, start, end, header, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read the records between byte offsets `start` and `end` (or EOF if None) of a CSV file, `chunk_size` rows at a time.
+    :return: Generator of chunks, as a tuple of values per column of `header`
+    """
+    row_count = 0
+    with open(input_file, "rb") as f:
+        text = io.TextIOWrapper(io.BufferedReader(_RangeReader(f, start, end)), encoding="utf-8", newline="")
+        reader = csv.reader(text)
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if len(rows) == 0:
+                break
+            for i, row in enumerate(rows):
+                if len(row) != len(header):
+                    raise Exception(
+                        f'Record {row_count + i + 1} after byte {start} of "{input_file}" has {len(row)} fields, '
+                        f'expected {len(header)}. If the file contains quoted newlines, fit it with a single worker.'
+                    )
+            row_count += len(rows)
+            yield list(zip(*rows))
+
+def split_inputs(input_files, workers=None):
+    """
+    Parts of the input files to read: whole files, or byte ranges of them if there are several workers (see `split_csv`).
+    :return: [(input_file, start, end, header), ...]
+    :rtype: list
+    """
+    parts = []
+    for input_file in input_files:
+        if workers is not None and workers > 1:
+            header, ranges = split_csv(input_file, workers)
+        else:
+            header, data_start = read_header(input_file)
+            ranges = [(data_start, None)]
+        parts.extend((input_file, start, end, header) for start, end in ranges)
+    return parts
+
+def map_parts(function, parts, workers=None, **kwargs):
+    """ Call `function(*part, **kwargs)` on every part, on a process pool if there are several workers, in order. """
+    if workers is not None and workers > 1 and len(parts) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(function, *part, **kwargs) for part in parts]
+            for future in futures:
+                yield future.result()
+    else:
+        for part in parts:
+            yield function(*part, **kwargs)
+
+def count_csv_range(input_file, start, end, header, lookup, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Count the responses of every template variable in the records between byte offsets `start` and `end` of a CSV file.
+    :param lookup: Output of `response_lookup`
+    :type lookup: dict
+    :return: (row_count, { variable_name: variable counts })
+    :rtype: (int, dict)
+    """
+    columns = [(i, variable_name) for i, variable_name in enumerate(header) if variable_name in lookup]
+    counts = {variable_name: new_variable_counts(lookup[variable_name][3]) for i, variable_name in columns}
+    row_count = 0
+    for record_columns in iter_csv_chunks(input_file, start, end, header, chunk_size=chunk_size):
+        for i, variable_name in columns:
+            count_column(counts[variable_name], record_columns[i], lookup[variable_name])
+        row_count += len(record_columns[0])
+    return (row_count, counts)
+
+def count_responses(template, input_files, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Count the responses of every template variable over CSV files.
+    :param workers: Size of the process pool counting file parts. If None or 1, files are read in the current process, whole.
+    :type workers: int
+    :return: (row_count, { variable_name: variable counts }, [csv columns that aren't template variables])
+    :rtype: (int, dict, list)
+    """
+    lookup = response_lookup(template)
+    parts = []
+    unknown_columns = []
+    for input_file, start, end, header in split_inputs(input_files, workers):
+        unknown_columns.extend(column for column in header if column not in lookup and column not in unknown_columns)
+        file_lookup = {variable_name: lookup[variable_name] for variable_name in header if variable_name in lookup}
+        parts.append((input_file, start, end, header, file_lookup))
+
+    row_count = 0
+    counts = {}
+    for part_row_count, part_counts in map_parts(count_csv_range, parts, workers, chunk_size=chunk_size):
+        row_count += part_row_count
+        merge_counts(counts, part_counts)
+    return (row_count, counts, unknown_columns)
+
+def fit_frequencies(counts, precision=DEFAULT_PRECISION):
+    """
+    Frequencies of a variable's responses from their counts, rounded to `precision` decimals.
+    Their sum never exceeds 1.0 as computed by `preprocess_template` (in floating point, in order), taking units of the last
+    decimal off the most frequent response if rounding would make it do so.
+    :rtype: list
+    """
+    total = sum(counts)
+    scale = 10 ** precision
+    # Work in integer units of the last decimal so that rounding errors can be corrected exactly.
+    units = [round(count * scale / total) for count in counts]
+    largest = units.index(max(units))
+    units[largest] -= max(0, sum(units) - scale)
+    # Unobserved responses get an integer 0, which reads better than 0.0 across the thousands of codes of a template.
+    frequencies = [unit / scale if count > 0 else 0 for unit, count in zip(units, counts)]
+    while sum(frequencies) > 1:
+        units[largest] -= 1
+        frequencies[largest] = units[largest] / scale
+    return frequencies
+
+def apply_counts(template, counts, precision=DEFAULT_PRECISION, fit_ranges=True):
+    """
+    Write fitted frequencies (and integer ranges) into a template, in place. Every response of a fitted variable gets an
+    explicit frequency, 0 for responses that were never observed. Variables without any matched value are left untouched.
+    :return: Names of the variables that were fitted
+    :rtype: list
+    """
+    fitted = []
+    for variable_name, variable_counts in counts.items():
+        responses = template["variables"][variable_name]
+        if sum(variable_counts["counts"]) == 0:
+            continue
+        for response, frequency in zip(responses, fit_frequencies(variable_counts["counts"], precision)):
+            response["frequency"] = frequency
+        fitted.append(variable_name)
+        if not fit_ranges or variable_counts["integer_min"] is None:
+            continue
+        for response in responses:
+            if _is_integer_response(response):
+                generator = response.get("response_value_generator")
+                if generator is None:
+                    generator = response["response_value_generator"] = {}
+                if generator.get("range"):
+                    # Update the sequence in place, keeping its comments.
+                    generator["range"][0] = variable_counts["integer_min"]
+                    generator["range"][1] = variable_counts["integer_max"]
+                else:
+                    generator["range"] = [variable_counts["integer_min"], variable_counts["integer_max"]]
+                break
+    return fitted
+
+def _round_trip_yaml():
+    yaml = ruamel.yaml.YAML()
+    # Keep the layout of templates generated by template.py.
+    yaml.indent(sequence=4, offset=2)
+    yaml.preserve_quotes = True
+    yaml.representer.add_representer(type(None), lambda self, data: self.represent_scalar('tag:yaml.org,2002:null', 'null'))
+    return yaml
+
+def text_style(path):
+    """
+    Encoding and line endings of a text file, so that a file derived from it can be written the same way.
+    :return: ("utf-8-sig" if the file starts with a BOM else "utf-8", "\r\n" or "\n")
+    :rtype: (str, str)
+    """
+    with open(path, "rb") as f:
+        head = f.read(64 * 1024)
+    encoding = "utf-8-sig" if head.startswith(codecs.BOM_UTF8) else "utf-8"
+    first_line_end = head.find(b"\n")
+    newline = "\r\n" if first_line_end > 0 and head[first_line_end - 1:first_line_end] == b"\r" else "\n"
+    return (encoding, newline)
+
+def default_output_path(template_file):
+    """ Path fitted templates are written to by default, e.g. cde_template_fitted.yaml for cde_template.yaml. """
+    path = Path(template_file)
+    return str(path.with_name(f"{path.stem}_fitted{path.suffix}"))
+
+def fit_template(template_file, input_files, output_path, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, precision=DEFAULT_PRECISION, fit_ranges=True):
+    """
+    Fit the frequencies of a template to CDE files and write the fitted template.
+    The template is edited through ruamel's round-trip loader, so its comments and layout are kept, and is written with the
+    same encoding (BOM or not) and line endings as `template_file`.
+    :param template_file: Template to fit
+    :type template_file: str
+    :param input_files: CDE CSV files (with a header of variable names) to learn frequencies from
+    :type input_files: list
+    :param output_path: Output path of the fitted template (may be `template_file`, which is then overwritten)
+    :type output_path: str
+    :param workers: Size of the process pool counting the input files, split into parts
+    :type workers: int
+    :param chunk_size: Number of rows read and counted at a time
+    :type chunk_size: int
+    :param precision: Number of decimals of the fitted frequencies
+    :type precision: int
+    :param fit_ranges: Set the `range` of integer responses to the observed min and max
+    :type fit_ranges: bool
+    :return: Summary of the fit: { "row_count", "fitted_variables", "unfitted_variables", "unknown_columns", "unmatched" },
+        unmatched being { variable_name: (count, examples) } for values that matched no response.
+    :rtype: dict
+    """
+    yaml = _round_trip_yaml()
+    with open(template_file, "r", encoding="utf-8-sig") as f:
+        template = yaml.load(f)
+    row_count, counts, unknown_columns = count_responses(template, input_files, workers=workers, chunk_size=chunk_size)
+    fitted = apply_counts(template, counts, precision=precision, fit_ranges=fit_ranges)
+    encoding, newline = text_style(template_file)
+    with open(output_path, "w", encoding=encoding, newline=newline) as f:
+        yaml.dump(template, f)
+    return {
+        "row_count": row_count,
+        "fitted_variables": fitted,
+        "unfitted_variables": [variable_name for variable_name in template["variables"] if variable_name not in fitted],
+        "unknown_columns": unknown_columns,
+        "unmatched": {
+            variable_name: (counts[variable_name]["unmatched"], counts[variable_name]["unmatched_examples"])
+            for variable_name in counts if counts[variable_name]["unmatched"] > 0
+        }
+    }
+
+def count_joint_range(input_file, start, end, header, joints, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Count the co-occurring raw values of groups of variables in the records between byte offsets `start` and `end` of a CSV file.
+    :param joints: Groups of variables, e.g. parents followed by their child
+    :type joints: list
+    :return: One Counter of { (value, ...): count } per group
+    :rtype: list
+    """
+    positions = [[header.index(variable_name) for variable_name in joint] for joint in joints]
+    counts = [Counter() for joint in joints]
+    for record_columns in iter_csv_chunks(input_file, start, end, header, chunk_size=chunk_size):
+        for joint_counts, joint_positions in zip(counts, positions):
+            joint_counts.update(zip(*[record_columns[i] for i in joint_positions]))
+    return counts
+
+def learn_cpts(template, input_files, cpts, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, precision=DEFAULT_PRECISION, min_count=1):
+    """
+    Learn conditional probability tables (see relationships/cpt.py) from CDE files.
+    Values are attributed to responses as when fitting frequencies; records where a parent or the child matches no response are
+    left out, and so are combinations of parent responses seen in fewer than `min_count` records.
+    :param cpts: (parents, child) pairs to learn, parents being a list of variables
+    :type cpts: list
+    :return: CPT relationship configurations, as written under `relationships` in a relationships file
+    :rtype: list
+    """
+    lookup = response_lookup(template)
+    joints = []
+    for parents, child in cpts:
+        for variable_name in parents + [child]:
+            if variable_name not in lookup:
+                raise Exception(f'Variable "{variable_name}" of CPT {parents} -> {child} does not exist in the template.')
+        joints.append(tuple(parents) + (child,))
+    parts = split_inputs(input_files, workers)
+    for input_file, start, end, header in parts:
+        for joint in joints:
+            missing = [variable_name for variable_name in joint if variable_name not in header]
+            if len(missing) > 0:
+                raise Exception(f'"{input_file}" has no column for {", ".join(missing)}.')
+
+    counts = [Counter() for joint in joints]
+    for part_counts in map_parts(count_joint_range, parts, workers, joints=joints, chunk_size=chunk_size):
+        for joint_counts, joint_part_counts in zip(counts, part_counts):
+            joint_counts.update(joint_part_counts)
+
+    relationships = []
+    for (parents, child), joint, joint_counts in zip(cpts, joints, counts):
+        # { (parent response index, ...): [count per child response] }
+        child_responses = template["variables"][child]
+        combinations = {}
+        for values, count in joint_counts.items():
+            indices = [attribute_value(value, lookup[variable_name])[0] for variable_name, value in zip(joint, values)]
+            if None in indices:
+                continue
+            combinations.setdefault(tuple(indices[:-1]), [0] * len(child_responses))[indices[-1]] += count
+        table = []
+        for key, child_counts in sorted(combinations.items(), key=lambda item: (-sum(item[1]), item[0])):
+            if sum(child_counts) < min_count:
+                continue
+            table.append({
+                "when": {
+                    parent: template["variables"][parent][i]["response_name"] for parent, i in zip(parents, key)
+                },
+                "probabilities": {
+                    child_responses[i]["response_name"]: frequency
+                    for i, frequency in enumerate(fit_frequencies(child_counts, precision)) if frequency > 0
+                }
+            })
+        relationships.append({
+            "type": "cpt",
+            "name": f'{child}_given_{"_".join(parents)}',
+            "parents": list(parents),
+            "child": child,
+            "table": table
+        })
+    return relationships
+
+def parse_cpt(spec):
+    """ Parse a "PARENT[,PARENT...]:CHILD" CLI argument into (parents, child). """
+    if spec.count(":") != 1:
+        raise Exception(f'CPTs should be given as PARENT[,PARENT...]:CHILD (got "{spec}").')
+    parents, child = spec.split(":")
+    return ([parent.strip() for parent in parents.split(",")], child.strip())
+
+def learn_cpt_file(template_file, input_files, cpts, output_path, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, precision=DEFAULT_PRECISION, min_count=1):
+    """
+    Learn conditional probability tables from CDE files and write them as a relationships file.
+    :param cpts: (parents, child) pairs to learn, see `learn_cpts`
+    :type cpts: list
+    :return: The learned relationship configurations
+    :rtype: list
+    """
+    yaml = ruamel.yaml.YAML(typ="safe")
+    with open(template_file, "r", encoding="utf-8-sig") as f:
+        template = yaml.load(f)
+    relationships = learn_cpts(template, input_files, cpts, workers=workers, chunk_size=chunk_size, precision=precision, min_count=min_count)
+    # Response names are arbitrary strings, some of which (e.g. "No", "Yes", "Off") YAML 1.1 loaders read as booleans.
+    quoted_relationships = [
+        {
+            **relationship,
+            "table": [
+                {
+                    "when": {parent: DoubleQuotedScalarString(response_name) for parent, response_name in entry["when"].items()},
+                    "probabilities": {
+                        DoubleQuotedScalarString(response_name): frequency for response_name, frequency in entry["probabilities"].items()
+                    }
+                }
+                for entry in relationship["table"]
+            ]
+        }
+        for relationship in relationships
+    ]
+    yaml = ruamel.yaml.YAML()
+    yaml.indent(sequence=4, offset=2)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(
+            f"# Conditional probability tables learned by fit.py from: {', '.join(input_files)}\n"
+            f"# Copy these entries under `relationships` of the relationships file used by a template (see relationships/cpt.py).\n"
+        )
+        yaml.dump({"relationships": quoted_relationships}, f)
+    return relationships
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit the response frequencies of a CDE template to real or sample CDE files")
+    parser.add_argument("-t", "--template", help="Template to fit", action="store", default="cde_template.yaml")
+    parser.add_argument(
+        "-i",
+        "--input",
+        help="CDE CSV file to learn frequencies from. May be repeated.",
+        action="append",
+        required=True
+    )
+    parser.add_argument(
+        "-o",
+        "--output_path",
+        help="Output path of the fitted template. Defaults to TEMPLATE with a _fitted suffix (e.g. cde_template_fitted.yaml).",
+        action="store",
+        default=None
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Count parts of the input files on this many worker processes.",
+        action="store",
+        type=int,
+        default=1
+    )
+    parser.add_argument("-c", "--chunk_size", help="Rows read and counted at a time", action="store", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--precision", help="Decimals of the fitted frequencies", action="store", type=int, default=DEFAULT_PRECISION)
+    parser.add_argument(
+        "--no_ranges",
+        help="Don't set the range of integer responses to the observed min and max.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--cpt",
+        help="Instead of fitting frequencies, learn the conditional probability table of CHILD given PARENTS, as PARENT[,PARENT...]:CHILD. May be repeated.",
+        action="append",
+        default=[]
+    )
+    parser.add_argument(
+        "--cpt_output",
+        help="Output path of the relationships file of learned conditional probability tables",
+        action="store",
+        default="cpt_relationships.yaml"
+    )
+    parser.add_argument(
+        "--min_count",
+        help="Leave parent response combinations seen in fewer records out of learned conditional probability tables",
+        action="store",
+        type=int,
+        default=1
+    )
+
+    args = parser.parse_args()
+    output_path = args.output_path if args.output_path is not None else default_output_path(args.template)
+
+    if len(args.cpt) > 0:
+        relationships = learn_cpt_file(
+            args.template,
+            args.input,
+            [parse_cpt(cpt) for cpt in args.cpt],
+            args.cpt_output,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            precision=args.precision,
+            min_count=args.min_count
+        )
+        print(f"Learned {len(relationships)} conditional probability tables, written under \"{args.cpt_output}\":")
+        for relationship in relationships:
+            print(f'- {relationship["name"]}: {len(relationship["table"])} parent response combinations')
+        raise SystemExit(0)
+
+    if Path(output_path).is_file():
+        if not click.confirm(f"Template file already exists under \"{output_path}\". Its frequencies will be overwritten by the fitted ones. Continue anyways?"):
+            print("Cancelled template fitting.")
+            raise SystemExit(1)
+
+    summary = fit_template(
+        args.template,
+        args.input,
+        output_path,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        precision=args.precision,
+        fit_ranges=not args.no_ranges
+    )
+    print(
+        f"Fitted {len(summary['fitted_variables'])} variables of \"{args.template}\" to {summary['row_count']} records, "
+        f"written under \"{output_path}\"."
+    )
+    if len(summary["unfitted_variables"]) > 0:
+        print(f"Not found in the input (left as is): {', '.join(summary['unfitted_variables'])}")
+    if len(summary["unknown_columns"]) > 0:
+        print(f"Columns that aren't template variables (ignored): {', '.join(summary['unknown_columns'])}")
+    for variable_name, (count, examples) in summary["unmatched"].items():
+        print(f"- {variable_name}: {count} values matched no response, e.g. {', '.join(repr(example) for example in examples)}")
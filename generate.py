@@ -1,68 +1,138 @@
 import ruamel.yaml as yaml
-import csv
+import os
 import random
+import numpy as np
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
 from lorem.text import TextLorem
 from relationships import Register
+from engine import SAMPLERS, CompiledTemplate, preprocess_template, load_template, ColumnarRows, RelationshipColumns, OUTPUT_FORMATS, ChunkEncoder, get_writer, infer_column_types, RunMetrics, validate_template_file, new_seed, generate_shard, iter_shards, iter_shards_parallel, RNG_MODES, DEFAULT_SEGMENT_SIZE, hash_file, segment_extension, read_manifest, open_job, pending_segments, temporary_segment_path, commit_segment, assemble_segments, ASSEMBLED_FORMATS
 
 DEFAULT_CDE_OUTPUT_NAME = f"synthetic_cde_{datetime.now().strftime('%m-%d-%Y')}"
+# "columnar" stores each variable as an array of response indices (see engine/columnar.py).
+# "reference" is the original dict-per-cell implementation, kept for comparison.
+GENERATION_MODES = ["columnar", "reference"]
+# Shard size used for multi-process generation when no chunk size is given.
+# Output only depends on the seed and the shard size, never on the number of workers.
+DEFAULT_CHUNK_SIZE = 100000
 
-def save_cde(cde_header, cde_rows, output_path):
+def save_cde(cde_header, cde_rows, output_path, output_format="csv", column_types=None, compression_threads=None, metrics=None, write_header=True, atomic=True):
     """
-    Save the generated CDE file to a csv file.
-    :param cde: Generated CDE data
-    :type cde: list
+    Save the generated CDE file in one of OUTPUT_FORMATS.
+    Text formats (csv, jsonl) are compressed if `output_path` ends in a compressed extension (.gz, .zst, see engine/compression.py).
+    :param cde_header: Variable names, in column order
+    :type cde_header: list
+    :param cde_rows: Generated CDE data. Either the full data or an iterable of chunks (ColumnarRows or payloads already
+        encoded by the format's writer, see engine/writers.py), which are written one at a time as they are produced.
+        Full ColumnarRows are written in slices of DEFAULT_CHUNK_SIZE rows.
+    :type cde_rows: list | ColumnarRows | Iterable[ColumnarRows | str]
     :param output_path: Output path of the generated synthetic CDE file
     :type output_path: str
+    :param output_format: Output file format, one of OUTPUT_FORMATS
+    :type output_format: str
+    :param column_types: { variable_name: "int" | "string" }, required by every format except csv (see `infer_column_types`)
+    :type column_types: dict
+    :param compression_threads: Number of threads compressing the output, if compressed
+    :type compression_threads: int
+    :param metrics: If given, time spent writing (excluding generating the chunks) is recorded into its "write" phase.
+    :type metrics: RunMetrics
+    :param write_header: Whether to write a header row (csv only)
+    :type write_header: bool
+    :param atomic: Write to a temporary file that is only moved to `output_path` once complete. Disable when `output_path`
+        is itself a temporary path (e.g. a job's segments, see engine/jobs.py).
+    :type atomic: bool
+    :return: The path the file was written to
+    :rtype: str
     """
+    writer_class = get_writer(output_format)
     i = 0
     while output_path is None:
-        path = Path(f"{DEFAULT_CDE_OUTPUT_NAME}_{str(i)}.csv")
+        path = Path(f"{DEFAULT_CDE_OUTPUT_NAME}_{str(i)}{writer_class.extension}")
         if not path.is_file():
             output_path = str(path)
         i += 1
 
 
-    csv_rows = [[cde_row[variable] for variable in cde_header] for cde_row in cde_rows]
-    cde_csv = [cde_header] + csv_rows
+    write_phase = (lambda: metrics.phase("write")) if metrics is not None else nullcontext
+    # Written next to the output under a hidden name (keeping its extensions, which select the compression), and only moved
+    # into place once complete, so that a failed run never leaves a truncated file that looks valid.
+    tmp_path = Path(output_path).with_name(f".{os.getpid()}.{Path(output_path).name}") if atomic else Path(output_path)
+    writer = writer_class(str(tmp_path), cde_header, column_types, compression_threads=compression_threads, write_header=write_header)
+    try:
+        if isinstance(cde_rows, list):
+            # Records of the reference engine.
+            with write_phase():
+                with writer:
+                    writer.write_records([[cde_row[variable] for variable in cde_header] for cde_row in cde_rows])
+        else:
+            if isinstance(cde_rows, ColumnarRows):
+                # Encoded a slice at a time, so that the encoded text of the whole file is never held in memory at once.
+                chunks = (
+                    cde_rows.slice(start, min(start + DEFAULT_CHUNK_SIZE, cde_rows.row_count))
+                    for start in range(0, cde_rows.row_count, DEFAULT_CHUNK_SIZE)
+                )
+            else:
+                chunks = cde_rows
+            with write_phase():
+                writer.open()
+            try:
+                for chunk in chunks:
+                    with write_phase():
+                        if isinstance(chunk, ColumnarRows):
+                            # Values are only looked up from the response index columns at write time.
+                            writer.write_chunk(chunk)
+                        else:
+                            writer.write(chunk)
+            finally:
+                with write_phase():
+                    writer.close()
+        if atomic:
+            os.replace(tmp_path, output_path)
+    finally:
+        if atomic and tmp_path.exists():
+            tmp_path.unlink()
 
-    with open(output_path, "w+") as out_file:
-        writer = csv.writer(out_file, delimiter=",")
-        for row in cde_csv:
-            writer.writerow(row)
+    return output_path
 
     
 
-def preprocess_template(template):
-    for variable_name in template["variables"]:
-        responses = template["variables"][variable_name]
-        no_freq_responses = []
-        total_freq = 0
-        for response in responses:
-            if response.get("frequency") is None:
-                no_freq_responses.append(response)
-            else:
-                total_freq += response["frequency"]
-        if total_freq > 1:
-            raise Exception(f"Sum of response frequencies for variable \"{variable_name}\" should not exceed 1.0 (total_freq={total_freq})")
-        if len(no_freq_responses) > 0:
-            remaining_freq = 1 - total_freq
-            per_response_freq = remaining_freq / len(no_freq_responses)
-            # Due to floating-point imprecision, this will result in very slightly less or more than 1.0 total frequency,
-            for response in no_freq_responses:
-                response["frequency"] = per_response_freq
-
-def generate_rows(template, relationships, row_count):
+def _split_batch_modifications(relationship, rows):
+    """
+    Invoke a vectorized relationship over all reference-engine records and split its masked assignments back into
+    per-record modifications, so that they can be applied in the same way as a regular relationship's.
+    """
+    rng = np.random.default_rng(random.getrandbits(64))
+    batch_modifications = Register.invoke_relationship_batch(
+        relationship,
+        RelationshipColumns.from_records(rows, relationship, rng)
+    )
+    record_modifications = [{} for record in rows]
+    if batch_modifications is None:
+        return record_modifications
+    for modified_variable in batch_modifications:
+        for mask, modified_response in batch_modifications[modified_variable]:
+            for i in np.flatnonzero(mask):
+                record_modifications[i][modified_variable] = modified_response
+    return record_modifications
+
+def generate_rows(template, relationships, row_count, compiled=None, sampler="cdf"):
+    if compiled is None:
+        compiled = CompiledTemplate(template)
     header_row = list(template["variables"].keys())
     rows = [{variable: None for variable in header_row} for i in range(row_count)]
     for variable_name in template["variables"]:
         responses = template["variables"][variable_name]
-        selected_responses = random.choices(
-            responses,
-            weights=[response["frequency"] for response in responses],
-            k=row_count
-        )
+        if sampler == "alias":
+            # O(1) per draw from the alias table precomputed for the variable.
+            alias_table = compiled[variable_name].alias_table
+            selected_responses = [responses[alias_table.draw()] for i in range(row_count)]
+        else:
+            selected_responses = random.choices(
+                responses,
+                weights=[response["frequency"] for response in responses],
+                k=row_count
+            )
         for i in range(row_count):
             selected_response = selected_responses[i]
             selected_response_name = selected_response.get("response_name")
@@ -96,69 +166,281 @@ def generate_rows(template, relationships, row_count):
             }
     # After bulk generation is complete, go through and manually regenerate responses on each record using relationships.
     relationship_plan = Register.plan(relationships["relationships"])
+    compiled.check_relationships(relationship_plan)
     # for dependency_node in relationship_plan:
     print("Starting post-processing of records.")
     if len(relationship_plan) == 0:
         print("- No relationships loaded.")
     for relationship in relationship_plan:
         print(f'- Processing relationship: {relationship["name"]}')    
-        for record in rows:
-            modifications = Register.invoke_relationship(
-                relationship,
-                record
-            )
+        if relationship.get("vectorized"):
+            record_modifications = _split_batch_modifications(relationship, rows)
+        else:
+            record_modifications = (Register.invoke_relationship(relationship, record) for record in rows)
+        for record, modifications in zip(rows, record_modifications):
             if modifications is None: continue
             for modified_variable in modifications:
                 modified_response = modifications[modified_variable]
-                # These are functionally equivalent, except for special responses (i.e. text), in which it is necessary to support both.
-                response_name = modified_response.get("response_name")
-                response_value = modified_response.get("response_value")
-                if response_name is not None:
-                    for res in template["variables"][modified_variable]:
-                        if res["response_name"] == response_name:
-                            response = res
-                            break
-                elif response_value is not None:
-                    for res in template["variables"][modified_variable]:
-                        if res["response_value"] == response_value:
-                            response = res
-                            break
-                else:
-                    raise Exception("Could not interpret modification requested by relationship:", modified_response)
+                # O(1) lookup through the compiled template's response indexes.
+                response_index = compiled.resolve(modified_variable, modified_response, relationship["name"])
+                response = compiled[modified_variable].responses[response_index]
 #                 print(f'''\
 # Relationship "{relationship["name"]}" modified variable {modified_variable}: changed {record[modified_variable]["response_name"]} -> {response["response_name"]}')\
 # ''')
                 record[modified_variable] = {
-                    "response_name": res["response_name"],
-                    "response_value": res["response_value"]
+                    "response_name": response["response_name"],
+                    "response_value": response.get("response_value")
                 }
     
     return (header_row, [{variable: record[variable]["response_value"] for variable in record} for record in rows])
 
-def generate_cde(template_file, row_count, relationship_file=None, output_path=None):
+def _compile(template):
+    if isinstance(template, CompiledTemplate):
+        return template
+    return CompiledTemplate(template)
+
+def _plan_relationships(relationships, compiled):
+    relationship_plan = Register.plan(relationships["relationships"])
+    # Fail on unknown variables before generating anything.
+    compiled.check_relationships(relationship_plan)
+    print("Post-processing records with relationships:")
+    if len(relationship_plan) == 0:
+        print("- No relationships loaded.")
+    for relationship in relationship_plan:
+        print(f'- {relationship["name"]}')
+    return relationship_plan
+
+def generate_columnar_rows(template, relationships, row_count, seed=None, sampler="alias", rng_mode="stream", start=0):
+    """
+    Columnar equivalent of `generate_rows`. Responses are kept as index arrays and are only converted into values when saved.
+    `template` may be either a preprocessed template or its CompiledTemplate.
+    The records are generated as a single shard, i.e. identical to `iter_columnar_chunks` with `chunk_size=row_count`.
+    :param rng_mode: One of RNG_MODES (see engine/counter_rng.py)
+    :type rng_mode: str
+    :param start: Global row index of the first record (counter RNG mode only)
+    :type start: int
+    :rtype: (list, ColumnarRows)
+    """
+    if seed is None:
+        seed = new_seed()
+    compiled = _compile(template)
+    relationship_plan = _plan_relationships(relationships, compiled)
+    columns = generate_shard(compiled, relationship_plan, seed, (0, start, row_count), sampler=sampler, rng_mode=rng_mode)
+    return (compiled.header, columns)
+
+def generate_row_range(template, relationships, start, stop, seed, sampler="alias"):
+    """
+    Generate rows [start, stop) of the file generated for `seed` in the counter RNG mode (see engine/counter_rng.py).
+    Every row only depends on the seed and its index, so ranges can be generated independently, in any order or on different
+    machines, and concatenated into exactly the file that generating all of the rows at once produces.
+    :param seed: Seed of the whole file, required since ranges of different seeds don't belong to the same file
+    :type seed: int
+    :rtype: (list, ColumnarRows)
+    """
+    if start < 0 or stop < start:
+        raise Exception(f"Invalid row range {start}:{stop}. Expected 0 <= START <= END.")
+    return generate_columnar_rows(template, relationships, stop - start, seed=seed, sampler=sampler, rng_mode="counter", start=start)
+
+def parse_row_range(text):
+    """
+    Parse a row range given as "START:END" (END excluded).
+    :rtype: (int, int)
+    """
+    try:
+        start, stop = [int(bound) for bound in text.split(":")]
+    except ValueError:
+        raise ValueError(f'Invalid row range "{text}". Expected START:END, e.g. 1000000:2000000.')
+    if start < 0 or stop < start:
+        raise ValueError(f'Invalid row range "{text}". Expected 0 <= START <= END.')
+    return (start, stop)
+
+def iter_columnar_chunks(template, relationships, row_count, chunk_size, seed=None, sampler="alias", metrics=None, rng_mode="stream", start=0):
+    """
+    Streaming form of `generate_columnar_rows`. Generates, post-processes, and yields the records one chunk of at most
+    `chunk_size` rows at a time so that only a single chunk is ever held in memory.
+    Each chunk is a shard with its own RNG stream derived from `seed` (see engine/parallel.py).
+    :param chunk_size: Maximum number of rows per chunk
+    :type chunk_size: int
+    :param seed: Seed of the run. A random seed is used if not specified.
+    :type seed: int
+    :param metrics: If given, time spent on each variable and relationship is accumulated into it.
+    :type metrics: RunMetrics
+    :param rng_mode: One of RNG_MODES. In "counter" mode, the records don't depend on the chunk size.
+    :type rng_mode: str
+    :param start: Global row index of the first record (counter RNG mode only)
+    :type start: int
+    :rtype: Iterator[ColumnarRows]
+    """
+    if seed is None:
+        seed = new_seed()
+    compiled = _compile(template)
+    relationship_plan = _plan_relationships(relationships, compiled)
+    return iter_shards(compiled, relationship_plan, row_count, chunk_size, seed, sampler=sampler, metrics=metrics, rng_mode=rng_mode, start=start)
+
+def iter_columnar_chunks_parallel(template, relationships, row_count, chunk_size, workers, seed=None, sampler="alias", metrics=None, output_format="csv", column_types=None, rng_mode="stream", start=0):
+    """
+    Multi-process form of `iter_columnar_chunks`. Shards are generated by a pool of `workers` processes and yielded, in order,
+    already encoded by the writer of `output_format` (e.g. csv text). Produces exactly the same file as `iter_columnar_chunks`
+    for a given seed and chunk size.
+    :param column_types: Column types of the typed output formats, see `infer_column_types`
+    :type column_types: dict
+    :rtype: Iterator
+    """
+    if seed is None:
+        seed = new_seed()
+    compiled = _compile(template)
+    relationship_plan = _plan_relationships(relationships, compiled)
+    encode = ChunkEncoder(output_format, compiled.header, column_types)
+    return iter_shards_parallel(compiled, relationship_plan, row_count, chunk_size, seed, workers, encode, sampler=sampler, metrics=metrics, rng_mode=rng_mode, start=start)
+
+def generate_job(job_dir, manifest, compiled, relationship_plan, workers=1, column_types=None, compression_threads=None, metrics=None):
+    """
+    Generate the segments of a job (see engine/jobs.py) that haven't been committed yet, committing each one to the job's
+    manifest as soon as it is written, so that an interrupted job can be resumed from its last committed segment.
+    :param manifest: The job's manifest, see `open_job`
+    :type manifest: dict
+    :param workers: Number of processes to generate each segment's chunks with
+    :type workers: int
+    :return: Number of segments generated
+    :rtype: int
+    """
+    output_format = manifest["output_format"]
+    segments = pending_segments(manifest)
+    segment_count = len(manifest["segments"]) + len(segments)
+    if len(manifest["segments"]) > 0 and len(segments) > 0:
+        print(f'Resuming job "{job_dir}" at row {manifest["rows_completed"]} ({len(manifest["segments"])}/{segment_count} segments committed).')
+    for segment in segments:
+        segment_index, start, segment_row_count = segment
+        shard_args = (compiled, relationship_plan, segment_row_count, manifest["chunk_size"], manifest["seed"])
+        shard_kwargs = {"sampler": manifest["sampler"], "metrics": metrics, "rng_mode": manifest["rng_mode"], "start": start}
+        if workers > 1:
+            encode = ChunkEncoder(output_format, compiled.header, column_types)
+            chunks = iter_shards_parallel(*shard_args, workers, encode, **shard_kwargs)
+        else:
+            chunks = iter_shards(*shard_args, **shard_kwargs)
+        tmp_path = temporary_segment_path(job_dir, segment_index, manifest["extension"])
+        # Only the first segment has a header row, so that text segments concatenate into the whole file. The segment is
+        # written straight to its temporary path, which only `commit_segment` moves into place.
+        save_cde(compiled.header, chunks, str(tmp_path), output_format=output_format, column_types=column_types, compression_threads=compression_threads, metrics=metrics, write_header=segment_index == 0, atomic=False)
+        path = commit_segment(job_dir, manifest, segment, tmp_path)
+        print(f'Committed segment {segment_index + 1}/{segment_count} (rows {start}:{start + segment_row_count}) to "{path}".')
+    return len(segments)
+
+def generate_cde(template_file, row_count, relationship_file=None, output_path=None, mode="columnar", chunk_size=None, seed=None, workers=1, use_cache=True, sampler=None, output_format="csv", compression_threads=None, profile=False, profile_output=None, validate=False, rng_mode=None, rows=None, job_dir=None, segment_size=None, assemble=False):
     """
     Generate a synthetic CDE file from a template file.
     :param template_file: File path to CDE generation template.
     :type template_file: str
     :param output_path: Output path of the generated synthetic CDE file
     :type output_path: str
+    :param mode: Generation engine to use, one of GENERATION_MODES
+    :type mode: str
+    :param chunk_size: Stream the generation in chunks of this many rows, DEFAULT_CHUNK_SIZE if not specified (columnar mode only)
+    :type chunk_size: int
+    :param seed: Seed for reproducible output. For a given seed and chunk size, the output is always the same, whatever the
+                 number of workers.
+    :type seed: int
+    :param workers: Number of processes to generate chunks with (columnar mode only)
+    :type workers: int
+    :param use_cache: Whether to use the compiled template cache (see engine/cache.py)
+    :type use_cache: bool
+    :param sampler: Weighted response sampler, one of SAMPLERS. Defaults to "alias" in columnar mode and "cdf" in reference mode.
+    :type sampler: str
+    :param output_format: Output file format, one of OUTPUT_FORMATS
+    :type output_format: str
+    :param compression_threads: Number of threads compressing the output when `output_path` ends in .gz or .zst
+    :type compression_threads: int
+    :param profile: Print a breakdown of where the run's time and memory went
+    :type profile: bool
+    :param profile_output: If given, profile the run (main process only) with cProfile and dump its stats to this path
+    :type profile_output: str
+    :param validate: Validate the template and its relationships (see engine/validation.py) before loading and generating anything
+    :type validate: bool
+    :param rng_mode: One of RNG_MODES. "stream" (default) draws each chunk from its own RNG stream. "counter" keys every draw
+                     by seed and row index instead, so the output doesn't depend on the chunk size (columnar mode only).
+    :type rng_mode: str
+    :param rows: If given as (start, end), only generate rows [start, end) of the file, in the counter RNG mode
+    :type rows: tuple
+    :param job_dir: If given, generate the file as a checkpointed job in this directory (see engine/jobs.py): the output is
+                    written in segments of `segment_size` rows, and rerunning the job resumes after its last committed segment
+    :type job_dir: str
+    :param segment_size: Number of rows per segment of a job, a multiple of `chunk_size`
+    :type segment_size: int
+    :param assemble: Concatenate the segments of a finished job into `output_path` (csv and jsonl only)
+    :type assemble: bool
+    :return: Timings and memory usage of the run
+    :rtype: RunMetrics
     """
-    with open(template_file, "r") as f:
-        template = yaml.round_trip_load(f)
+    if mode not in GENERATION_MODES:
+        raise Exception(f'Unknown generation mode "{mode}". Expected one of: {", ".join(GENERATION_MODES)}')
+    if mode != "columnar" and (chunk_size is not None or workers > 1):
+        raise Exception(f'Chunked and multi-process generation are only supported in "columnar" mode.')
+    if mode == "columnar" and chunk_size is None:
+        # Shards are seeded by their index, so they must be the same size whatever the number of workers.
+        chunk_size = DEFAULT_CHUNK_SIZE
+    if rows is not None:
+        if rng_mode == "stream":
+            raise Exception(f'Row ranges can only be generated in the "counter" RNG mode.')
+        rng_mode = "counter"
+    if rng_mode is None:
+        rng_mode = "stream"
+    if rng_mode not in RNG_MODES:
+        raise Exception(f'Unknown RNG mode "{rng_mode}". Expected one of: {", ".join(RNG_MODES)}')
+    if mode != "columnar" and rng_mode != "stream":
+        raise Exception(f'The "counter" RNG mode and row ranges are only supported in "columnar" mode.')
+    if job_dir is not None:
+        if mode != "columnar":
+            raise Exception(f'Jobs are only supported in "columnar" mode.')
+        if rows is not None:
+            raise Exception("Row ranges cannot be generated as a job.")
+        if segment_size is None:
+            segment_size = max(1, DEFAULT_SEGMENT_SIZE // chunk_size) * chunk_size
+        # Chunks of a resumed job are only numbered as in an uninterrupted one if segments start on chunk boundaries.
+        if segment_size < 1 or (rng_mode == "stream" and segment_size % chunk_size != 0):
+            raise Exception(f"The segment size ({segment_size}) of a job must be a positive multiple of its chunk size ({chunk_size}).")
+        if assemble and output_format not in ASSEMBLED_FORMATS:
+            raise Exception(f'Only {" and ".join(ASSEMBLED_FORMATS)} jobs can be assembled into a single file, the segments of {output_format} jobs are read as a dataset.')
+    elif assemble or segment_size is not None:
+        raise Exception("Segments can only be sized and assembled when generating a job.")
+    if sampler is None:
+        sampler = "alias" if mode == "columnar" else "cdf"
+    if sampler not in SAMPLERS:
+        raise Exception(f'Unknown sampler "{sampler}". Expected one of: {", ".join(SAMPLERS)}')
+    if output_format not in OUTPUT_FORMATS:
+        raise Exception(f'Unknown output format "{output_format}". Expected one of: {", ".join(OUTPUT_FORMATS)}')
 
-    if relationship_file is None:
-        relationship_file = template.get("relationships")
-        
-    if relationship_file is not None:
-        with open(relationship_file, "r") as f:
-            relationships = yaml.round_trip_load(f)
-    else:
-        relationships = {
-            "relationships": []
-        }
+    if profile_output is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    metrics = RunMetrics()
 
-    preprocess_template(template)
+    if validate:
+        with metrics.phase("validate"):
+            validate_template_file(template_file, relationship_file=relationship_file, workers=workers if workers > 1 else None)
 
+    with metrics.phase("load"):
+        # Preprocessed and compiled, or read from the compiled template cache if the template hasn't changed.
+        template, compiled = load_template(template_file, use_cache=use_cache, timings=metrics.load_timings)
+
+        if relationship_file is None:
+            relationship_file = template.get("relationships")
+            
+        if relationship_file is not None:
+            with open(relationship_file, "r") as f:
+                relationships = yaml.round_trip_load(f)
+        else:
+            relationships = {
+                "relationships": []
+            }
+
+
+    start = 0
+    if rows is not None:
+        start, stop = rows
+        if row_count is not None and row_count != stop - start:
+            raise Exception(f"row_count ({row_count}) doesn't match the number of rows in {start}:{stop}.")
+        row_count = stop - start
     if row_count is None:
         row_count = template.get("row_count", None)
     # row_count is either not given in template or also `null`
@@ -176,13 +458,87 @@ variables:
         output_path = template.get("output_path", None)
 
 
-    [cde_header, cde_rows] = generate_rows(template, relationships, row_count)
+    # Typed formats write each variable as an int or a string column, see engine/writers.py.
+    column_types = infer_column_types(compiled) if output_format != "csv" else None
 
-    save_cde(cde_header, cde_rows, output_path)
+    if rng_mode == "counter" and seed is None and job_dir is None:
+        # Other row ranges of the same file can only be generated with the same seed.
+        seed = new_seed()
+        print(f"Seed: {seed}")
 
-    print(
-        f"Generated synthetic CDE file under \"{output_path}\" with {row_count} rows and {len(cde_header)} variables using template \"{template_file}\"."
-    )
+    # Sampling and relationship timings are accumulated over every chunk (columnar mode only).
+    if job_dir is not None:
+        if seed is None:
+            # A restarted job carries on with the seed it was started with.
+            existing_manifest = read_manifest(job_dir)
+            seed = existing_manifest["seed"] if existing_manifest is not None else new_seed()
+        manifest = open_job(job_dir, {
+            "template": str(template_file),
+            "template_hash": hash_file(template_file),
+            "relationships_hash": hash_file(relationship_file),
+            "seed": seed,
+            "row_count": row_count,
+            "segment_size": segment_size,
+            "chunk_size": chunk_size,
+            "sampler": sampler,
+            "rng_mode": rng_mode,
+            "output_format": output_format,
+            "extension": segment_extension(get_writer(output_format), output_path)
+        })
+        cde_header = compiled.header
+        if manifest["output_path"] is not None:
+            print(f'Job "{job_dir}" is already finished and assembled into "{manifest["output_path"]}".')
+        else:
+            relationship_plan = _plan_relationships(relationships, compiled)
+            generate_job(job_dir, manifest, compiled, relationship_plan, workers=workers, column_types=column_types, compression_threads=compression_threads, metrics=metrics)
+            if assemble:
+                if output_path is None:
+                    output_path = str(Path(job_dir) / f"{Path(job_dir).name}{manifest['extension']}")
+                with metrics.phase("write"):
+                    assemble_segments(job_dir, manifest, output_path)
+        # The output of a job that isn't assembled is its directory of segments.
+        output_path = manifest["output_path"] or job_dir
+    elif mode == "reference":
+        if seed is not None:
+            random.seed(seed)
+        with metrics.phase("generate"):
+            [cde_header, cde_rows] = generate_rows(template, relationships, row_count, compiled=compiled, sampler=sampler)
+    elif workers > 1:
+        cde_header = compiled.header
+        cde_rows = iter_columnar_chunks_parallel(compiled, relationships, row_count, chunk_size, workers, seed=seed, sampler=sampler, metrics=metrics, output_format=output_format, column_types=column_types, rng_mode=rng_mode, start=start)
+    else:
+        cde_header = compiled.header
+        cde_rows = iter_columnar_chunks(compiled, relationships, row_count, chunk_size, seed=seed, sampler=sampler, metrics=metrics, rng_mode=rng_mode, start=start)
+
+    if job_dir is None:
+        output_path = save_cde(cde_header, cde_rows, output_path, output_format=output_format, column_types=column_types, compression_threads=compression_threads, metrics=metrics)
+
+    metrics.row_count = row_count
+    metrics.variable_count = len(cde_header)
+    metrics.output_path = output_path
+    metrics.finish()
+    if profile_output is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_output)
+        metrics.profile_output = profile_output
+
+    if profile:
+        print(metrics.report())
+    elif len(metrics.relationship_timings) > 0:
+        print("Time spent in relationships:")
+        for name in metrics.relationship_timings:
+            print(f"- {name}: {metrics.relationship_timings[name]:.3f}s")
+
+    if job_dir is not None:
+        print(
+            f"Generated synthetic CDE job under \"{job_dir}\" with {row_count} rows and {len(cde_header)} variables using template \"{template_file}\" (output: \"{output_path}\")."
+        )
+    else:
+        row_range = f" ({start}:{start + row_count})" if rows is not None else ""
+        print(
+            f"Generated synthetic CDE file under \"{output_path}\" with {row_count} rows{row_range} and {len(cde_header)} variables using template \"{template_file}\"."
+        )
+    return metrics
 
 
 if __name__ == "__main__":
@@ -219,16 +575,155 @@ if __name__ == "__main__":
         action="store",
         default=None
     )
+    parser.add_argument(
+        "-m",
+        "--mode",
+        help="Generation engine. \"columnar\" (default) keeps responses as index arrays, \"reference\" builds a dict per cell.",
+        action="store",
+        choices=generate.GENERATION_MODES,
+        default="columnar"
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk_size",
+        help=f"Stream generation in chunks of CHUNK_SIZE rows (default {DEFAULT_CHUNK_SIZE}), keeping memory usage constant regardless of ROW_COUNT.",
+        action="store",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        help="Seed for reproducible generation. The same seed and CHUNK_SIZE always produce the same file, regardless of WORKERS.",
+        action="store",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        help="Number of processes to generate chunks with.",
+        action="store",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--rng",
+        help="\"stream\" (default) draws each chunk from its own RNG stream. \"counter\" keys every draw by SEED and row index, so the file doesn't depend on CHUNK_SIZE.",
+        action="store",
+        choices=generate.RNG_MODES,
+        default=None
+    )
+    parser.add_argument(
+        "--rows",
+        help="Only generate rows START:END (END excluded) of the file generated for SEED in the counter RNG mode. Implies --rng counter.",
+        action="store",
+        type=generate.parse_row_range,
+        default=None
+    )
+    parser.add_argument(
+        "--job",
+        help="Generate the file as a resumable job in the JOB directory: rows are written in segments committed to JOB/_manifest.json, and rerunning the same command resumes after the last committed segment.",
+        action="store",
+        default=None
+    )
+    parser.add_argument(
+        "--segment_size",
+        help=f"Rows per segment of a job, a multiple of CHUNK_SIZE (about {generate.DEFAULT_SEGMENT_SIZE} by default).",
+        action="store",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "--assemble",
+        help="Concatenate the segments of a finished csv or jsonl job into OUTPUT_PATH, as-is (without re-encoding them).",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--sampler",
+        help="Weighted response sampler. \"alias\" (O(1) per draw) is the default in columnar mode, \"cdf\" in reference mode.",
+        action="store",
+        choices=generate.SAMPLERS,
+        default=None
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output file format. \"parquet\" and \"arrow\" require pyarrow.",
+        action="store",
+        choices=generate.OUTPUT_FORMATS,
+        default="csv"
+    )
+    parser.add_argument(
+        "--compression_threads",
+        help="Number of threads compressing the output when OUTPUT_PATH ends in .gz or .zst (csv and jsonl formats).",
+        action="store",
+        type=int,
+        default=None
+    )
+    parser.add_argument(
+        "--validate",
+        help="Check the template against template_schema.json, its frequencies and generators, and its relationships before generating.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Print the time and peak memory of each phase, the slowest variables, and each relationship.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile_output",
+        help="Profile the run with cProfile and dump its stats to PROFILE_OUTPUT (readable with pstats/snakeviz).",
+        action="store",
+        default=None
+    )
+    parser.add_argument(
+        "--no_cache",
+        help="Always parse the template YAML, without reading or writing its compiled cache file.",
+        action="store_true"
+    )
 
     args = parser.parse_args()
     template = args.template
     relationships = args.relationships
     row_count = args.row_count
     output_path = args.output_path
+    mode = args.mode
+    chunk_size = args.chunk_size
+    seed = args.seed
+    workers = args.workers
+    use_cache = not args.no_cache
+    sampler = args.sampler
+    output_format = args.format
+    compression_threads = args.compression_threads
+    profile = args.profile
+    profile_output = args.profile_output
+    validate = args.validate
+    rng_mode = args.rng
+    rows = args.rows
+    job_dir = args.job
+    segment_size = args.segment_size
+    assemble = args.assemble
 
     generate.generate_cde(
         template,
         row_count,
         relationship_file=relationships,
-        output_path=output_path
+        output_path=output_path,
+        mode=mode,
+        chunk_size=chunk_size,
+        seed=seed,
+        workers=workers,
+        use_cache=use_cache,
+        sampler=sampler,
+        output_format=output_format,
+        compression_threads=compression_threads,
+        profile=profile,
+        profile_output=profile_output,
+        validate=validate,
+        rng_mode=rng_mode,
+        rows=rows,
+        job_dir=job_dir,
+        segment_size=segment_size,
+        assemble=assemble
     )
\ No newline at end of file
@@ -1,3 +1,5 @@
 from .register import *
 from .udfs import *
-from .relationships import *
\ No newline at end of file
+from .relationships import *
+from .cpt import *
+from .rules import *
\ No newline at end of file
@@ -0,0 +1,110 @@
+import numpy as np
+from .register import relationship_type
+
+"""
+Conditional probability table (CPT) relationships.
+
+A CPT relationship resamples a child variable from P(child response | parent responses), configured in a relationships file:
+```yaml
+relationships:
+  - type: cpt
+    name: vaping_given_smoking # Optional
+    parents: [nih_smoking_yn]
+    child: nih_vaping_yn
+    table:
+      - when: {nih_smoking_yn: "Yes"}
+        probabilities: {"Yes": 0.4, "No": 0.55}
+```
+Records whose parent responses match a `when` entry get their child response redrawn from its `probabilities`. If these sum
+to less than 1.0, the remainder is the chance of keeping the independently sampled response, and records matching no entry
+keep it as well. Responses are referenced by `response_name`. Tables can be learned from CDE files with `fit.py --cpt`.
+
+The table is compiled once, when the relationship is configured, into a mixed-radix lookup from parent responses to table
+entries and a cumulative probability row per entry, so a batch is resampled with a few vectorized lookups however large
+the table is.
+"""
+
+def _configure_cpt(yaml_spec):
+    parents = yaml_spec.get("parents")
+    child = yaml_spec.get("child")
+    table = yaml_spec.get("table")
+    source = f'CPT relationship "{yaml_spec.get("name", child)}"'
+    if not isinstance(parents, list) or len(parents) == 0 or not isinstance(child, str):
+        raise Exception(f"{source} requires `parents` (a list of variables) and `child` (a variable).")
+    if child in parents:
+        raise Exception(f'{source} lists its child "{child}" as one of its parents.')
+    if not isinstance(table, list) or len(table) == 0:
+        raise Exception(f"{source} requires a non-empty `table` of {{when, probabilities}} entries.")
+
+    # Distinct responses of each parent and of the child appearing in the table, in order of appearance.
+    parent_responses = [[] for parent in parents]
+    child_responses = []
+    entries = []
+    for i, entry in enumerate(table):
+        when = entry.get("when") or {}
+        probabilities = entry.get("probabilities") or {}
+        if set(when) != set(parents):
+            raise Exception(f"{source}: `when` of table entry {i} should give a response for exactly the parents {parents} (got {list(when)}).")
+        if any(not isinstance(probability, (int, float)) or probability < 0 for probability in probabilities.values()):
+            raise Exception(f"{source}: probabilities of table entry {i} should be non-negative numbers.")
+        if sum(probabilities.values()) > 1 + 1e-9:
+            raise Exception(f"{source}: probabilities of table entry {i} should not exceed 1.0 (total={sum(probabilities.values())}).")
+        key = []
+        for j, parent in enumerate(parents):
+            if when[parent] not in parent_responses[j]:
+                parent_responses[j].append(when[parent])
+            key.append(parent_responses[j].index(when[parent]))
+        for response_name in probabilities:
+            if response_name not in child_responses:
+                child_responses.append(response_name)
+        entries.append((key, probabilities))
+
+    radix = [len(responses) for responses in parent_responses]
+    entry_of_key = np.full(int(np.prod(radix)), -1, dtype=np.int64)
+    cumulative = np.zeros((len(entries), len(child_responses)), dtype=np.float64)
+    for i, (key, probabilities) in enumerate(entries):
+        flat_key = int(np.ravel_multi_index(key, radix))
+        if entry_of_key[flat_key] != -1:
+            raise Exception(f"{source}: table entries {entry_of_key[flat_key]} and {i} have the same `when`.")
+        entry_of_key[flat_key] = i
+        cumulative[i] = np.cumsum([probabilities.get(response_name, 0) for response_name in child_responses])
+    return (list(parents), [child], {
+        "parents": list(parents),
+        "child": child,
+        "parent_responses": parent_responses,
+        "child_responses": child_responses,
+        "entry_of_key": entry_of_key,
+        "cumulative": cumulative
+    })
+
+def _check_cpt(kwargs, resolve):
+    for parent, responses in zip(kwargs["parents"], kwargs["parent_responses"]):
+        for response_name in responses:
+            resolve(parent, {"response_name": response_name})
+    for response_name in kwargs["child_responses"]:
+        resolve(kwargs["child"], {"response_name": response_name})
+
+@relationship_type("cpt", configure=_configure_cpt, check=_check_cpt)
+def conditional_probability_table(columns, parents, child, parent_responses, child_responses, entry_of_key, cumulative):
+    row_count = len(columns)
+    # Mixed-radix key of every record's parent responses, -1 where a parent's response doesn't appear in the table.
+    key = np.zeros(row_count, dtype=np.int64)
+    in_table = np.ones(row_count, dtype=bool)
+    for parent, responses in zip(parents, parent_responses):
+        code = np.full(row_count, -1, dtype=np.int64)
+        for i, response_name in enumerate(responses):
+            code[columns[parent].is_response(response_name)] = i
+        in_table &= code >= 0
+        key = key * len(responses) + code
+    entry = np.where(in_table, entry_of_key[np.where(in_table, key, 0)], -1)
+    # Always drawn for every record, so that the stream of random numbers doesn't depend on the data.
+    draws = columns.rng.random(row_count)
+    rows = np.flatnonzero(entry >= 0)
+    # Index of the drawn child response, len(child_responses) meaning the sampled response is kept.
+    choices = (draws[rows, None] >= cumulative[entry[rows]]).sum(axis=1)
+    assignments = []
+    for i, response_name in enumerate(child_responses):
+        mask = np.zeros(row_count, dtype=bool)
+        mask[rows[choices == i]] = True
+        assignments.append((mask, {"response_name": response_name}))
+    return {child: assignments}
@@ -1,26 +1,85 @@
-import networkx as nx
+class UdfContext:
+    """
+    Context handed to batch UDFs along with the number of values to generate.
+    :param rng: numpy.random.Generator that should be used for any randomness
+    :param rows: Global row index (within the whole generated file) of each of the values being generated
+    :param seed: Seed of the whole run (shared by all shards/workers), or None
+    """
+    def __init__(self, rng, rows, seed=None):
+        self.rng = rng
+        self.rows = rows
+        self.seed = seed
 
 class Register:
     udfs = {}
+    batch_udfs = {}
     relationships = {}
+    relationship_types = {}
     @classmethod
     def register_udf(cls, name, func):
         cls.udfs[name] = func
     @classmethod
-    def register_relationship(cls, name, udf, dependencies, modifies):
+    def register_batch_udf(cls, name, func):
+        cls.batch_udfs[name] = func
+    @classmethod
+    def register_relationship(cls, name, udf, dependencies, modifies, vectorized=False):
         cls.relationships[name] = {
             "name": name,
             "dependencies": dependencies,
             "modifies": modifies,
-            "udf": udf
+            "udf": udf,
+            "vectorized": vectorized
+        }
+    @classmethod
+    def register_relationship_type(cls, type_name, udf, configure, check=None):
+        cls.relationship_types[type_name] = {
+            "udf": udf,
+            "configure": configure,
+            "check": check
+        }
+    @classmethod
+    def _get_typed_relationship(cls, yaml_spec):
+        type_name = yaml_spec["type"]
+        if type_name not in cls.relationship_types:
+            raise Exception(f'Unknown relationship type "{type_name}". Make sure it is decorated with @relationship_type and imported within relationships/__init__.py.')
+        relationship_type = cls.relationship_types[type_name]
+        dependencies, modifies, kwargs = relationship_type["configure"](yaml_spec)
+        return {
+            "name": yaml_spec.get("name", f'{type_name}:{",".join(modifies)}'),
+            "type": type_name,
+            "dependencies": dependencies,
+            "modifies": modifies,
+            "udf": relationship_type["udf"],
+            "vectorized": True,
+            "args": [],
+            "kwargs": kwargs
         }
     @classmethod
+    def check_relationship(cls, relationship, resolve):
+        """
+        Check the responses that a typed relationship references against the template, before generating anything.
+        :param resolve: resolve(variable_name, {"response_name": ...} or {"response_value": ...}), raising if the variable
+                        has no such response (see `CompiledTemplate.resolve`)
+        :raises Exception: On the first response that doesn't exist.
+        """
+        type_name = relationship.get("type")
+        if type_name is None:
+            return
+        check = cls.relationship_types[type_name]["check"]
+        if check is not None:
+            check(relationship["kwargs"], resolve)
+    @classmethod
     def _get_relationship(cls, yaml_spec):
+        if "type" in yaml_spec:
+            return cls._get_typed_relationship(yaml_spec)
         name = yaml_spec["name"]
         args = yaml_spec.get("args", [])
         kwargs = yaml_spec.get("kwargs", {})
 
-        relationship = cls.relationships[name]
+        if name not in cls.relationships:
+            raise Exception(f'Unknown relationship "{name}". Make sure it is decorated with @relationship and imported within relationships/__init__.py.')
+        # Copy, so that the same relationship can be configured more than once with different args/kwargs.
+        relationship = dict(cls.relationships[name])
 
         relationship["args"] = args
         relationship["kwargs"] = kwargs
@@ -29,11 +88,33 @@ class Register:
         
     @classmethod
     def invoke_udf(cls, udf_name, *args, **kwargs):
+        if udf_name not in cls.udfs and udf_name in cls.batch_udfs:
+            raise Exception(f'UDF "{udf_name}" only has a batch form, which is only supported by the columnar engine.')
         return cls.udfs[udf_name](
             *args,
             **kwargs
         )
     @classmethod
+    def has_batch_udf(cls, udf_name):
+        return udf_name in cls.batch_udfs
+    @classmethod
+    def invoke_batch_udf(cls, udf_name, n, context, *args, **kwargs):
+        """
+        Invoke the batch form of a UDF to generate `n` values at once.
+        :param context: Randomness and row information for the values being generated
+        :type context: UdfContext
+        :return: Sequence (or array) of `n` values
+        """
+        ret_val = cls.batch_udfs[udf_name](
+            n,
+            context,
+            *args,
+            **kwargs
+        )
+        if len(ret_val) != n:
+            raise Exception(f'Batch UDF "{udf_name}" returned {len(ret_val)} values but {n} were requested.')
+        return ret_val
+    @classmethod
     def invoke_relationship(cls, relationship, full_record):
         name = relationship["name"]
         dependencies = relationship["dependencies"]
@@ -49,6 +130,32 @@ class Register:
                 if variable not in modifies:
                     raise Exception(f'Attempted modification of variable "{variable}" in relationship "{name}" but not listed under its `modifies` field.')
         return ret_val
+    @classmethod
+    def invoke_relationship_batch(cls, relationship, columns):
+        """
+        Invoke a vectorized relationship over a whole batch of records.
+        :param columns: Read-only dependency columns of the batch (see `RelationshipColumns` in engine/columnar.py)
+        :return: None or { [variable_name]: [(mask, modified_response), ...] }, assignments being applied in order.
+            A single (mask, modified_response) tuple returned by the relationship is wrapped in a list.
+        """
+        name = relationship["name"]
+        modifies = relationship["modifies"]
+        ret_val = cls.invoke_udf(
+            relationship["udf"],
+            columns,
+            *relationship.get("args", []),
+            **relationship.get("kwargs", {})
+        )
+        if ret_val is not None:
+            for variable in ret_val:
+                if variable not in modifies:
+                    raise Exception(f'Attempted modification of variable "{variable}" in relationship "{name}" but not listed under its `modifies` field.')
+                assignments = ret_val[variable]
+                if isinstance(assignments, tuple):
+                    assignments = ret_val[variable] = [assignments]
+                if not isinstance(assignments, list) or not all(isinstance(assignment, tuple) and len(assignment) == 2 for assignment in assignments):
+                    raise Exception(f'Vectorized relationship "{name}" must return (mask, modified_response) or a list of them for variable "{variable}".')
+        return ret_val
         
     @classmethod
     def plan(cls, relationships):
@@ -58,78 +165,87 @@ class Register:
             1) requires nih_disability -> modifies nih_blind
             2) requires nih_blind -> modifies nih_diabetes (nonsense example)
         Then the plan needs to handle relationship 1 before relationship 2.
+        Every configured relationship appears in the plan exactly once.
+        """
+        stages = cls.plan_stages(relationships)
+        return [relationship for stage in stages for relationship in stage]
+    @classmethod
+    def plan_stages(cls, relationships):
+        """
+        Same as `plan`, but grouped into stages: the relationships within a stage don't read or write each other's
+        variables, so they can run in any order (or concurrently), as long as every earlier stage has completed.
         """
         relationships = [cls._get_relationship(relationship) for relationship in relationships]
-        plan, G = cls._plan(relationships)
-        return plan
+        return cls._plan(relationships)
+    @classmethod
+    def _dependency_edges(cls, relationships):
+        """
+        Edges (i, j) of the relationship-level DAG, meaning relationships[i] must run before relationships[j]:
+        - relationships[i] modifies a variable that relationships[j] depends on, or
+        - both modify the same variable, in which case the order they are configured in is kept.
+        """
+        edges = set()
+        for i, relationship in enumerate(relationships):
+            modifies = set(relationship["modifies"])
+            for j, other in enumerate(relationships):
+                if i == j:
+                    continue
+                if modifies.intersection(other["dependencies"]):
+                    edges.add((i, j))
+                elif i < j and modifies.intersection(other["modifies"]):
+                    edges.add((i, j))
+        return edges
     @classmethod
     def _plan(cls, relationships):
         """
-        Use a DAG to plan relationship order.
-
-        This could probably be implemented more efficiently (without including a large dependency like networkx)
-        but it doesn't really seem worth the effort to implement a tree dependency planner by hand.
+        Topologically sort the relationship-level DAG (Kahn's algorithm), one level at a time.
+        Ties are broken by the order relationships are configured in, so plans are deterministic.
         """
-        G = nx.DiGraph()
-        for relationship in relationships:
-
-            dependencies = relationship["dependencies"]
-            modifies = relationship["modifies"]
-
-            # is_modified_by = [
-            #     relationship for relationship in relationships
-            #     if any([dependency for dependency in dependencies if dependency in relationship["modifies"]])
-            # ]
-            # modified_relationships = [
-            #     relationship for relationship in relationships
-            #     if any([modified for modified in modifies if modified in relationship["dependencies"]])
-            # ]
-
-
-            for dependency_variable in dependencies:
-                # for response in dependencies[dependency_variable]:
-                for modified_variable in modifies:
-                    # modified_response = modifies[modified_variable]
-                    G.add_edge(
-                        f"{dependency_variable}",
-                        f"{modified_variable}"
-                    )
-
-        # Not super familiar with this area of network/graph theory and constructing & traversing dependency trees.
-        # I think that this is the proper implementation in networkx, but I haven't tested it very thoroughly.
-        dependency_path = list(nx.topological_sort(G))
-        plan = []
-        for dependency in dependency_path:
-            variable_name = dependency
-            # variable_name = dependency.split(":")[0]
-            # response_name = dependency.split(":")[1]
-            for relationship in relationships:
-                if (
-                    variable_name in relationship["dependencies"]
-                    # response_name in relationship["dependencies"][variable_name]
-                ):
-                    plan.append(relationship)
-        #     [
-        #         relationship for relationship in relationships
-        #         if (
-        #             dependency_node["variable_name"] in relationship["dependencies"] and
-        #             dependency_node["response_name"] in relationship["dependencies"][dependency_node["variable_name"]]
-        #         )
-        #     ] for dependency_node in dependency_path
-        # ]
-
-        return plan, G
+        edges = cls._dependency_edges(relationships)
+        successors = {i: [] for i in range(len(relationships))}
+        in_degree = {i: 0 for i in range(len(relationships))}
+        for i, j in sorted(edges):
+            successors[i].append(j)
+            in_degree[j] += 1
+
+        stages = []
+        ready = [i for i in range(len(relationships)) if in_degree[i] == 0]
+        planned = 0
+        while len(ready) > 0:
+            stages.append([relationships[i] for i in ready])
+            planned += len(ready)
+            next_ready = []
+            for i in ready:
+                for j in successors[i]:
+                    in_degree[j] -= 1
+                    if in_degree[j] == 0:
+                        next_ready.append(j)
+            ready = sorted(next_ready)
+        if planned != len(relationships):
+            cyclic = [relationships[i]["name"] for i in range(len(relationships)) if in_degree[i] > 0]
+            raise Exception(f"Relationships {cyclic} depend on each other's modifications in a cycle and cannot be planned.")
+        return stages
 
 """
 A UDF is used as an escape hatch in response_value_generator for more sophisticated generation.
 Relationships also use self-registered UDFs. 
+
+A batch UDF (batch=True) generates many values per call: it takes `n` and a UdfContext followed by the UDF's args/kwargs,
+and returns a sequence (or array) of `n` values. A batch UDF may share its name with a regular UDF, in which case the
+columnar engine prefers the batch form and the reference engine keeps calling the regular one.
 """
-def udf(name):
+def udf(name, batch=False):
     def decorator(func):
-        Register.register_udf(
-            name,
-            func
-        )
+        if batch:
+            Register.register_batch_udf(
+                name,
+                func
+            )
+        else:
+            Register.register_udf(
+                name,
+                func
+            )
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
         return wrapper
@@ -138,8 +254,11 @@ def udf(name):
 """
 A relationship is a means of post-processing related fields after initial record generation.
 Essentially, a UDF to modify a field which is dependent on another (ex: education affects employment).
+
+A vectorized relationship (vectorized=True) is invoked once per batch of records instead of once per record.
+It receives the batch's dependency columns and returns masked assignments.
 """
-def relationship(name, dependencies, modifies):
+def relationship(name, dependencies, modifies, vectorized=False):
     def decorator(func):
         udf_name = f"__relationship_udf:{name}__"
         Register.register_udf(
@@ -150,7 +269,34 @@ def relationship(name, dependencies, modifies):
             name,
             udf_name,
             dependencies,
-            modifies
+            modifies,
+            vectorized=vectorized
+        )
+        def wrapper(*args, **kwargs):
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+"""
+A relationship type builds relationships from their YAML configuration alone, e.g. conditional probability tables, so that
+new relationships don't require writing Python. A relationship configured with `type: <type_name>` is passed to `configure`,
+which returns its (dependencies, modifies, kwargs). The decorated function is then invoked as a vectorized relationship
+with these kwargs. Its `name` is optional and defaults to "<type_name>:<modified variables>".
+`check(kwargs, resolve)`, if given, resolves every response that the configured relationship references, so that
+misspelled responses are reported when the plan is checked against the template rather than during generation.
+"""
+def relationship_type(type_name, configure, check=None):
+    def decorator(func):
+        udf_name = f"__relationship_type_udf:{type_name}__"
+        Register.register_udf(
+            udf_name,
+            func
+        )
+        Register.register_relationship_type(
+            type_name,
+            udf_name,
+            configure,
+            check=check
         )
         def wrapper(*args, **kwargs):
             return func(*args, **kwargs)
@@ -160,17 +306,27 @@ def relationship(name, dependencies, modifies):
 def debug_planning(file):
     # Debug planning process.
     import matplotlib.pyplot as plt
+    import networkx as nx
     import ruamel.yaml as yaml
 
     with open(file, "r") as f:
         relationships = yaml.round_trip_load(f)["relationships"]
-    plan, G = Register._plan([Register._get_relationship(rel) for rel in relationships])
+    relationships = [Register._get_relationship(rel) for rel in relationships]
+    stages = Register._plan(relationships)
+    plan = [relationship for stage in stages for relationship in stage]
+
+    G = nx.DiGraph()
+    G.add_nodes_from([relationship["name"] for relationship in relationships])
+    for i, j in Register._dependency_edges(relationships):
+        G.add_edge(relationships[i]["name"], relationships[j]["name"])
 
     fig, axes = plt.subplots(nrows=2, ncols=1)
     ax = axes.flatten()
 
     nx.draw(G, nx.drawing.nx_pydot.graphviz_layout(G, prog="twopi"), with_labels=True, ax=ax[0])
     ax[0].set_axis_off()
+    for i, stage in enumerate(stages):
+        print(f"Stage {i}:", [relationship["name"] for relationship in stage])
 
     G_plan = nx.DiGraph()
     for i, dependency in enumerate(plan):
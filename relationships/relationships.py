@@ -1,5 +1,5 @@
+import numpy as np
 from .register import relationship
-from random import random
 
 """
 A relationship is a post-generation utility for correlating relationships between fields.
@@ -15,6 +15,13 @@ Detailed info regarding implementation found in readme. Basics are as follows:
   that any variables accessed from `responses` are listed as dependencies.
 - A relationship should output None or a dict of { [variable_name]: modified_response }. If a modified response's frequency is not specified,
   it is interpreted that the modified response *must* be chosen (similar to frequency: 1.0 but without conflicts arising from exceeding the 1.0 frequency limit).
+- A vectorized relationship (@relationship(..., vectorized=True)) is called once per batch of records rather than once per record.
+  Its first arg is `columns`, where `columns[variable_name]` is a view of a dependency column exposing `response_names`, `response_values`
+  and `is_response(response_name)` (a boolean mask), and `columns.rng` is a numpy Generator to be used for any randomness.
+  It should output None or a dict of { [variable_name]: (mask, modified_response) }, assigning modified_response to the records where mask is True,
+  or { [variable_name]: [(mask, modified_response), ...] } to assign several responses (applied in order).
+
+All of the relationships below are vectorized, since they are conditional overwrites of whole columns.
 """
 
 @relationship(
@@ -29,31 +36,31 @@ Detailed info regarding implementation found in readme. Basics are as follows:
             "nih_walk_climb",
             "nih_dress_bathe",
             "nih_errand",
-    ]
+    ],
+    vectorized=True
 )
-def no_disability(responses):
-    nih_disability = responses["nih_disability"]
-    if nih_disability["response_name"] == "No":
-        return {
-            "nih_deaf": {
-                "response_name": "Skip Logic"
-            },
-            "nih_blind": {
-                "response_name": "Skip Logic"
-            },
-            "nih_memory": {
-                "response_name": "Skip Logic"
-            },
-            "nih_walk_climb": {
-                "response_name": "Skip Logic"
-            },
-            "nih_dress_bathe": {
-                "response_name": "Skip Logic"
-            },
-            "nih_errand": {
-                "response_name": "Skip Logic"
-            }
-        }
+def no_disability(columns):
+    no_disability = columns["nih_disability"].is_response("No")
+    return {
+        "nih_deaf": (no_disability, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_blind": (no_disability, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_memory": (no_disability, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_walk_climb": (no_disability, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_dress_bathe": (no_disability, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_errand": (no_disability, {
+            "response_name": "Skip Logic"
+        })
+    }
 
 @relationship(
     name="no_smoking",
@@ -65,25 +72,25 @@ def no_disability(responses):
         "nih_nicotine_yn",
         "nih_vape_freq",
         "nih_cig_smoke_freq"
-    ]
+    ],
+    vectorized=True
 )
-def no_smoking(responses):
-    nih_smoking_yn = responses["nih_smoking_yn"]
-    if nih_smoking_yn["response_name"] == "No":
-        return {
-            "nih_vaping_yn": {
-                "response_name": "Skip Logic"
-            },
-            "nih_nicotine_yn": {
-                "response_name": "Skip Logic"
-            },
-            "nih_vape_freq": {
-                "response_name": "Skip Logic"
-            },
-            "nih_cig_smoke_freq": {
-                "response_name": "Skip Logic"
-            }
-        }
+def no_smoking(columns):
+    no_smoking = columns["nih_smoking_yn"].is_response("No")
+    return {
+        "nih_vaping_yn": (no_smoking, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_nicotine_yn": (no_smoking, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_vape_freq": (no_smoking, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_cig_smoke_freq": (no_smoking, {
+            "response_name": "Skip Logic"
+        })
+    }
 
 @relationship(
     name="no_alcohol",
@@ -94,22 +101,22 @@ def no_smoking(responses):
         "nih_lifetime_use_alcohol",
         "nih_alcohol_yrs",
         "nih_alcohol_frequency"
-    ]
+    ],
+    vectorized=True
 )
-def no_alcohol(responses):
-    nih_alcohol_yn = responses["nih_alcohol_yn"]
-    if nih_alcohol_yn["response_name"] == "No":
-        return {
-            "nih_lifetime_use_alcohol": {
-                "response_name": "Skip Logic"
-            },
-            "nih_alcohol_yrs": {
-                "response_name": "Skip Logic"
-            },
-            "nih_alcohol_frequency": {
-                "response_name": "Skip Logic"
-            }
-        }
+def no_alcohol(columns):
+    no_alcohol = columns["nih_alcohol_yn"].is_response("No")
+    return {
+        "nih_lifetime_use_alcohol": (no_alcohol, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_alcohol_yrs": (no_alcohol, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_alcohol_frequency": (no_alcohol, {
+            "response_name": "Skip Logic"
+        })
+    }
 
 @relationship(
     name="no_cancer",
@@ -119,19 +126,19 @@ def no_alcohol(responses):
     modifies=[
         "nih_cancer_active_treatment",
         "nih_cancer_past_yr"
-    ]
+    ],
+    vectorized=True
 )
-def no_cancer(responses):
-    nih_cancer = responses["nih_cancer"]
-    if nih_cancer["response_name"] == "No":
-        return {
-            "nih_cancer_active_treatment": {
-                "response_name": "Skip Logic"
-            },
-            "nih_cancer_past_yr": {
-                "response_name": "Skip Logic"
-            }
-        }
+def no_cancer(columns):
+    no_cancer = columns["nih_cancer"].is_response("No")
+    return {
+        "nih_cancer_active_treatment": (no_cancer, {
+            "response_name": "Skip Logic"
+        }),
+        "nih_cancer_past_yr": (no_cancer, {
+            "response_name": "Skip Logic"
+        })
+    }
 
 @relationship(
     name="no_chronic_kidney_disease",
@@ -140,16 +147,16 @@ def no_cancer(responses):
     ],
     modifies=[
         "nih_chronic_kidney_disease_treatment"
-    ]
+    ],
+    vectorized=True
 )
-def no_chronic_kidney_disease(responses):
-    nih_chronic_kidney_disease = responses["nih_chronic_kidney_disease"]
-    if nih_chronic_kidney_disease["response_name"] == "No":
-        return {
-            "nih_chronic_kidney_disease_treatment": {
-                "response_name": "Skip Logic"
-            }
-        }
+def no_chronic_kidney_disease(columns):
+    no_chronic_kidney_disease = columns["nih_chronic_kidney_disease"].is_response("No")
+    return {
+        "nih_chronic_kidney_disease_treatment": (no_chronic_kidney_disease, {
+            "response_name": "Skip Logic"
+        })
+    }
 
 @relationship(
     name="age_associated_diseases",
@@ -160,56 +167,43 @@ def no_chronic_kidney_disease(responses):
         "nih_alz",
         "nih_neurodegenerative",
         "nih_osteoporosis"
-    ]
+    ],
+    vectorized=True
 )
-def age_associated_diseases(responses):
-    nih_age = responses["nih_age"]
-    age = int(nih_age["response_value"])
+def age_associated_diseases(columns):
+    age = columns["nih_age"].response_values.astype(np.int64)
     def lerp(a, b, t):
         return a + t * (b - a)
     """
     Lerped estimate of the percentage chance that an individual of a given age has an age-progressive disease.
 
-    :param age: The current age of the individual.
+    :param age: The current age of each individual.
     :param min_age: The minimum age at which the onset of the disease becomes viable. Before this age, the chance of having the disease is considered 0.
     :param max_age: The age at which the chance of the onset of a disease caps out. Beyond this age, the chance remains at the cap.
     :param min_chance: The starting chance of having a disease (for minimized age).
     :param max_chance: The ending chance of having a disease (as age maxes out).
     """
     def disease_chance(age, min_age=50, max_age=80, min_chance=0.005, max_chance=0.05):
-        # # Starts at a 0.5% chance of disease
-        # min_chance = 0.005
-        # # Caps out at a 5% chance of disease
-        # max_chance = 0.05
-        # # Age at which the onset of an age-progressive disease is possible.
-        # min_age = 50
-        # # Age at which the chance of the onset of an age-progressive disease caps out.
-        # max_age = 88
-
         age_prop = (age - min_age) / (max_age - min_age)
-        if age_prop < 0: return 0
-        if age_prop > 1: age_prop = 1
-        return lerp(min_chance, max_chance, age_prop)
-    
-    ret_val = {}
+        chance = lerp(min_chance, max_chance, np.minimum(age_prop, 1))
+        chance[age_prop < 0] = 0
+        return chance
+
+    rng = columns.rng
+    row_count = len(columns)
 
     # Begin rolling for diseases
-    if random() < disease_chance(age):
-        ret_val["nih_alz"] = {
+    return {
+        "nih_alz": (rng.random(row_count) < disease_chance(age), {
             "response_name": "Yes"
-        }
-    if random() < disease_chance(age):
-        ret_val["nih_neurodegenerative"] = {
+        }),
+        "nih_neurodegenerative": (rng.random(row_count) < disease_chance(age), {
             "response_name": "Yes"
-        }
-    if random() < disease_chance(
-        age,
-        min_age=40
-    ):
-        ret_val["nih_osteoporosis"] = {
+        }),
+        "nih_osteoporosis": (rng.random(row_count) < disease_chance(age, min_age=40), {
             "response_name": "Yes"
-        }
-    return ret_val
+        })
+    }
 
 @relationship(
     name="pregnancy_prerequisites",
@@ -219,20 +213,18 @@ def age_associated_diseases(responses):
     ],
     modifies=[
         "nih_pregnancy"
-    ]
+    ],
+    vectorized=True
 )
-def pregnancy_prerequisites(responses):
-    nih_sex = responses["nih_sex"]
-    nih_age = responses["nih_age"]
-    age = int(nih_age["response_value"])
-
-    if nih_sex["response_name"] != "Female" or age > 60:
-        # Ideally disable `Pregnant` response for non-female/too old.
-        return {
-            "nih_pregnancy": {
-                "response_name": "Not Pregnant"
-            }
-        }
+def pregnancy_prerequisites(columns):
+    age = columns["nih_age"].response_values.astype(np.int64)
+    # Ideally disable `Pregnant` response for non-female/too old.
+    not_pregnant = ~columns["nih_sex"].is_response("Female") | (age > 60)
+    return {
+        "nih_pregnancy": (not_pregnant, {
+            "response_name": "Not Pregnant"
+        })
+    }
 
 @relationship(
     name="gestational_diabetes",
@@ -241,16 +233,16 @@ def pregnancy_prerequisites(responses):
     ],
     modifies=[
         "nih_gestational_diabetes"
-    ]
+    ],
+    vectorized=True
 )
-def gestational_diabetes(responses):
-    nih_pregnancy = responses["nih_pregnancy"]
-    if nih_pregnancy["response_name"] != "Pregnant":
-        return {
-            "nih_gestational_diabetes": {
-                "response_name": "Skip Logic"
-            }
-        }
+def gestational_diabetes(columns):
+    not_pregnant = ~columns["nih_pregnancy"].is_response("Pregnant")
+    return {
+        "nih_gestational_diabetes": (not_pregnant, {
+            "response_name": "Skip Logic"
+        })
+    }
 
 @relationship(
     name="diabetes_types",
@@ -259,13 +251,13 @@ def gestational_diabetes(responses):
     ],
     modifies=[
         "nih_t2dm"
-    ]
+    ],
+    vectorized=True
 )
-def diabetes_types(responses):
-    nih_t1d = responses["nih_t1d"]
-    if nih_t1d["response_name"] == "Yes":
-        return {
-            "nih_t2dm": {
-                "response_name": "Skip Logic"
-            }
-        }
\ No newline at end of file
+def diabetes_types(columns):
+    type_1_diabetes = columns["nih_t1d"].is_response("Yes")
+    return {
+        "nih_t2dm": (type_1_diabetes, {
+            "response_name": "Skip Logic"
+        })
+    }
\ No newline at end of file
@@ -0,0 +1,70 @@
+from .register import relationship_type
+
+"""
+Declarative rule relationships.
+
+Most relationships are skip logic: if a variable has some response, set a list of other variables to a fixed response. Such
+rules can be declared directly in a relationships file rather than written in Python:
+```yaml
+relationships:
+  - type: rule
+    name: no_smoking # Optional
+    when: {nih_smoking_yn: No}
+    set: {nih_vaping_yn: Skip Logic, nih_nicotine_yn: Skip Logic}
+```
+Every condition of `when` must hold (AND). A condition is a response name, a list of response names (any of them), or
+{not: response name(s)}. `set` maps each modified variable to a response name, or to a modification such as
+{response_value: -9941}. A rule is parsed once, when it is configured, and its responses are checked against the template
+before generating anything. It is applied to a batch of records as a single mask followed by one masked assignment per
+modified variable.
+"""
+
+def _configure_rule(yaml_spec):
+    when = yaml_spec.get("when")
+    set_ = yaml_spec.get("set")
+    source = f'Rule "{yaml_spec["name"]}"' if "name" in yaml_spec else "Rule"
+    if not isinstance(when, dict) or len(when) == 0:
+        raise Exception(f"{source} requires `when`, a mapping of {{variable: response}} conditions.")
+    if not isinstance(set_, dict) or len(set_) == 0:
+        raise Exception(f"{source} requires `set`, a mapping of {{variable: response}} modifications.")
+    conditions = []
+    for variable_name, condition in when.items():
+        negate = isinstance(condition, dict)
+        if negate:
+            if list(condition) != ["not"]:
+                raise Exception(f'{source}: condition on "{variable_name}" should be a response name, a list of them, or {{not: ...}}.')
+            condition = condition["not"]
+        response_names = list(condition) if isinstance(condition, list) else [condition]
+        if len(response_names) == 0:
+            raise Exception(f'{source}: condition on "{variable_name}" lists no responses.')
+        conditions.append((variable_name, response_names, negate))
+    assignments = []
+    for variable_name, response in set_.items():
+        assignments.append((variable_name, dict(response) if isinstance(response, dict) else {"response_name": response}))
+    return (list(when), list(set_), {
+        "conditions": conditions,
+        "assignments": assignments
+    })
+
+def _check_rule(kwargs, resolve):
+    for variable_name, response_names, negate in kwargs["conditions"]:
+        for response_name in response_names:
+            resolve(variable_name, {"response_name": response_name})
+    for variable_name, modified_response in kwargs["assignments"]:
+        resolve(variable_name, modified_response)
+
+@relationship_type("rule", configure=_configure_rule, check=_check_rule)
+def rule(columns, conditions, assignments):
+    mask = None
+    for variable_name, response_names, negate in conditions:
+        column = columns[variable_name]
+        matches = column.is_response(response_names[0])
+        for response_name in response_names[1:]:
+            matches |= column.is_response(response_name)
+        if negate:
+            matches = ~matches
+        mask = matches if mask is None else mask & matches
+    return {
+        variable_name: (mask, modified_response)
+        for variable_name, modified_response in assignments
+    }
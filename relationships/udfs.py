@@ -1,5 +1,6 @@
 from random import randint
 from .register import udf
+from utils.record_ids import RecordIdGenerator, growing_width_ids
 
 @udf("test_record_id")
 def test_record_id():
@@ -7,14 +8,41 @@ def test_record_id():
     x = str(randint(0, 999999)).rjust(6, "0")
     return f"TEST_{x}"
 
+@udf("test_record_id", batch=True)
+def test_record_id_batch(n, context):
+    """
+    Batch form of test_record_id. Unlike the regular form, IDs are unique across the whole file (see `record_id`).
+    Rows from 1,000,000 on get IDs with as many more digits as they need (e.g. "TEST_0042917" for row 1,234,567).
+    """
+    return growing_width_ids(context.rows, min_width=6, prefix="TEST_", key=context.seed or 0)
+
+@udf("record_id", batch=True)
+def record_id(n, context, width=6, prefix="", offset=0):
+    """
+    Return unique IDs in the format "<prefix><width digits>" (ex: "TEST_042917" for width=6, prefix="TEST_").
+    IDs are a keyed permutation of each record's row index, so no two rows of a file share an ID, even across workers.
+    Files generated with the same seed can be kept from overlapping by giving them distinct row offsets.
+    """
+    return RecordIdGenerator(width=width, prefix=prefix, key=context.seed or 0).generate(context.rows + offset)
+
 @udf("age_generator")
 def age_generator(min_age, max_age):
     """ Return a number in the inclusive range [min_age, max_age]. """
     # In the future, perhaps a probability distribution could be added.
     return randint(min_age, max_age)
 
+@udf("age_generator", batch=True)
+def age_generator_batch(n, context, min_age, max_age):
+    """ Batch form of age_generator. """
+    return context.rng.integers(min_age, max_age, size=n, endpoint=True)
+
 @udf("zip_code_generator")
 def zip_code_generator():
     # Valid US postal codes range from 00001-99999.
     return str(randint(1, 99999)).rjust(5, "0")
-    
\ No newline at end of file
+    
+
+@udf("zip_code_generator", batch=True)
+def zip_code_generator_batch(n, context):
+    """ Batch form of zip_code_generator. """
+    return [f"{x:05d}" for x in context.rng.integers(1, 99999, size=n, endpoint=True).tolist()]
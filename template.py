@@ -1,23 +1,43 @@
 import click
 import csv
+import json
+import math
+import os
+import re
 import ruamel.yaml
 from ruamel.yaml.comments import CommentedMap, CommentedSeq
 from pathlib import Path
 from _version import __version__
 
-def generate_template_csv(mapping_file, output_path):
+# Comments of the generated template, shared by both emitters.
+ROW_COUNT_COMMENT = (
+    "How many records of data to generate. If null, `generate.py` will expect [-n ROW_COUNT] argument to be specified.\n"
+    "Ex: `row_count: 1000` will generate 1000 records of data when the template is run."
+)
+OUTPUT_PATH_COMMENT = (
+    "File name/path to output the data under (or `null` to auto-generate a name). Can be overriden by [-o OUTPUT_PATH] argument.\n"
+    "Ex: `output_path: my_synthetic_cde.csv` will output the synthetic CDE under `my_synthetic_cde.csv` when the template is run."
+)
+GENERATOR_COMMENT = "Requires special configuration."
+# { generator_key: (comment, { child_key_or_index: comment or (comment, children) }) }
+GENERATOR_COMMENTS = {
+    "lorem": ("Generates pseudo-Latin text.", {
+        "num_sentences": (None, {0: "Minimum number of sentences", 1: "Maximum number of sentences"}),
+        "sentence_length": (None, {0: "Minimum number of words per sentence", 1: "Maximum number of words per sentence"})
+    }),
+    "range": ("Chooses a random integer in the inclusive range.", {0: "Minimum value", 1: "Maximum value"}),
+    "valid_inputs": ("Randomly chooses a value from the list. Ex: ['a', 'b', 'c'] or [1, 2, 3]", {})
+}
+
+def read_mapping(mapping_file):
     """
-    Generate a template file for CDE generation from a RADx CDE mapping file.
+    Build the responses of every variable of a RADx CDE mapping file, with all frequencies unset.
     :param mapping_file: File path to mapping file
     :type mapping_file: str
-    :param output_path: Output path of the generated template file
-    :type output_path: str
+    :return: { variable_name: [response, ...] } in mapping file order
+    :rtype: dict
     """
-    template = {
-        "row_count": 1000,
-        "output_path": None,
-        "variables": {}
-    }
+    variables = {}
     with open(mapping_file, "r") as f:
         reader = csv.DictReader(f, delimiter=",")
         i = 0
@@ -69,14 +89,261 @@ def generate_template_csv(mapping_file, output_path):
                 else:
                     raise Exception(f"Parsing response with length {len(possible_response)} is not implemented. Response: {possible_response}")
             
-            template["variables"][variable_name] = variable_template
+            variables[variable_name] = variable_template
+    return variables
+
+def _response_key(response):
+    """
+    Identity of a response when merging: its code for regular responses, its name (e.g. "text") for special responses,
+    which have no `response_value`. Codes are stable across cookbook versions while their labels may be reworded.
+    """
+    if response.get("response_value") is not None:
+        return ("response_value", response["response_value"])
+    return ("response_name", response.get("response_name"))
+
+def merge_template(existing_template, mapped_variables):
+    """
+    Merge freshly mapped variables into an existing template.
+    Variables and responses are taken from the mapping, in its order. Responses that already exist in the template (same code,
+    or same name for special responses) keep everything set on them, such as `frequency` and `response_value_generator`,
+    with their `response_name` updated to the mapping's. Top-level options (`row_count`, `relationships`, ...) are kept as is.
+    :param existing_template: Template loaded from YAML
+    :type existing_template: dict
+    :param mapped_variables: Output of `read_mapping`
+    :type mapped_variables: dict
+    :return: The merged template and a summary of the changes, as
+        { "added_variables", "removed_variables", "added_responses", "removed_responses", "renamed_responses" }
+        where response changes are lists of (variable_name, response_name).
+    :rtype: (dict, dict)
+    """
+    existing_variables = existing_template.get("variables") or {}
+    changes = {
+        "added_variables": [variable_name for variable_name in mapped_variables if variable_name not in existing_variables],
+        "removed_variables": [variable_name for variable_name in existing_variables if variable_name not in mapped_variables],
+        "added_responses": [],
+        "removed_responses": [],
+        "renamed_responses": []
+    }
+    variables = {}
+    for variable_name, mapped_responses in mapped_variables.items():
+        if variable_name not in existing_variables:
+            variables[variable_name] = mapped_responses
+            continue
+        existing_responses = {}
+        for response in existing_variables[variable_name]:
+            existing_responses.setdefault(_response_key(response), response)
+        responses = []
+        for mapped_response in mapped_responses:
+            key = _response_key(mapped_response)
+            response = existing_responses.pop(key, None)
+            if response is None:
+                changes["added_responses"].append((variable_name, mapped_response["response_name"]))
+                responses.append(mapped_response)
+                continue
+            if response.get("response_name") != mapped_response["response_name"]:
+                changes["renamed_responses"].append((variable_name, mapped_response["response_name"]))
+                response = {**response, "response_name": mapped_response["response_name"]}
+            responses.append(response)
+        for response in existing_responses.values():
+            changes["removed_responses"].append((variable_name, response.get("response_name")))
+        variables[variable_name] = responses
+
+    template = {key: value for key, value in existing_template.items() if key != "variables"}
+    template["variables"] = variables
+    return (template, changes)
+
+def load_existing_template(template_file):
+    """ Load a template as plain data, with the C YAML loader when available (comments aren't needed for merging). """
+    yaml = ruamel.yaml.YAML(typ="safe")
+    with open(template_file, "r", encoding="utf-8-sig") as f:
+        return yaml.load(f)
+
+def dump_template_commented(template, out_file, document_comment):
+    """ Dump a template through ruamel, commenting it node by node. """
+    yaml = ruamel.yaml.YAML()
+    # Ensure that `None` is dumped as `null`.
+    yaml.representer.add_representer(type(None), lambda self, data: self.represent_scalar('tag:yaml.org,2002:null', 'null'))
+    # Makes list yaml more readable
+    yaml.indent(sequence=4, offset=2)
+
+    commented_yaml = CommentedMap(template)
+    commented_yaml.yaml_set_start_comment(document_comment, indent=0)
+    commented_yaml.yaml_set_comment_before_after_key(
+        "row_count",
+        ROW_COUNT_COMMENT,
+        indent=0
+    )
+    commented_yaml.yaml_set_comment_before_after_key(
+        "output_path",
+        OUTPUT_PATH_COMMENT,
+        indent=0
+    )
+
+    for variable in commented_yaml["variables"]:
+        commented_yaml["variables"][variable] = CommentedSeq(commented_yaml["variables"][variable])
+        for i, response in enumerate(commented_yaml["variables"][variable]):
+            commented_yaml["variables"][variable][i] = CommentedMap(commented_yaml["variables"][variable][i])
+        for response in commented_yaml["variables"][variable]:
+            # response.yaml_set_comment_before_after_key("frequency", "Change this!", indent=6)
+            response.yaml_set_comment_before_after_key(
+                "response_value_generator",
+                GENERATOR_COMMENT,
+                indent=6
+            )
+            if "response_value_generator" in response:
+                generator = CommentedMap(response["response_value_generator"])
+                response["response_value_generator"] = generator
+                generator.yaml_set_comment_before_after_key("lorem", GENERATOR_COMMENTS["lorem"][0], indent=8)
+                generator.yaml_set_comment_before_after_key("range", GENERATOR_COMMENTS["range"][0], indent=8)
+                generator.yaml_set_comment_before_after_key(
+                    "valid_inputs",
+                    GENERATOR_COMMENTS["valid_inputs"][0],
+                    indent=8
+                )
+                if generator.get("lorem") is not None:
+                    generator["lorem"] = CommentedMap(generator["lorem"])
+                    generator["lorem"]["num_sentences"] = CommentedSeq(generator["lorem"]["num_sentences"])
+                    generator["lorem"]["sentence_length"] = CommentedSeq(generator["lorem"]["sentence_length"])
+
+                    generator["lorem"]["num_sentences"].yaml_set_comment_before_after_key(0, "Minimum number of sentences", indent=12)
+                    generator["lorem"]["num_sentences"].yaml_set_comment_before_after_key(1, "Maximum number of sentences", indent=12)
+
+                    generator["lorem"]["sentence_length"].yaml_set_comment_before_after_key(0, "Minimum number of words per sentence", indent=12)
+                    generator["lorem"]["sentence_length"].yaml_set_comment_before_after_key(1, "Maximum number of words per sentence", indent=12)
+                if generator.get("range") is not None:
+                    generator["range"] = CommentedSeq(generator["range"])
+                    generator["range"].yaml_set_comment_before_after_key(0, "Minimum value", indent=10)
+                    generator["range"].yaml_set_comment_before_after_key(1, "Maximum value", indent=10)
+
+
+    yaml.dump(commented_yaml, out_file)
+
+# Strings that can safely be written as plain (unquoted) YAML scalars without being read back as another type.
+_PLAIN_SCALAR = re.compile(r"[A-Za-z(][A-Za-z0-9 _.,()/'&+\-]*")
+_RESERVED_SCALARS = {
+    "y", "n", "yes", "no", "true", "false", "on", "off", "null"
+}
+
+def _yaml_scalar(value):
+    """ Format a scalar as YAML, quoting strings (as JSON, which is valid YAML) unless they are unambiguously plain. """
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return ".nan"
+        if math.isinf(value):
+            return ".inf" if value > 0 else "-.inf"
+        return repr(value)
+    text = str(value)
+    if _PLAIN_SCALAR.fullmatch(text) and not text.endswith(" ") and text.lower() not in _RESERVED_SCALARS:
+        return text
+    return json.dumps(text, ensure_ascii=False)
+
+def _emit_comment(lines, comment, indent):
+    if comment is not None:
+        for line in comment.split("\n"):
+            lines.append(f"{' ' * indent}# {line}")
+
+def _emit_block(lines, value, indent, comments=None):
+    """
+    Append `value` (a mapping or sequence) as block YAML lines at `indent`, laid out as the ruamel emitter of
+    `dump_template_commented` does: mapping keys at `indent`, sequence dashes at `indent + 2`.
+    :param comments: Comments to emit before children, { key_or_index: comment or (comment, child_comments) }
+    :type comments: dict
+    """
+    if comments is None:
+        comments = {}
+    items = value.items() if isinstance(value, dict) else enumerate(value)
+    for key, child in items:
+        comment = comments.get(key)
+        comment, child_comments = comment if isinstance(comment, tuple) else (comment, None)
+        if isinstance(value, dict):
+            _emit_comment(lines, comment, indent)
+            prefix = f"{' ' * indent}{_yaml_scalar(key)}:"
+            child_indent = indent + 2
+        else:
+            _emit_comment(lines, comment, indent + 2)
+            prefix = f"{' ' * (indent + 2)}-"
+            child_indent = indent + 4
+        if isinstance(child, (dict, list)) and len(child) > 0:
+            if isinstance(value, list) and isinstance(child, dict):
+                # The first key of a mapping inside a sequence goes on the dash's line.
+                child_lines = []
+                _emit_block(child_lines, child, child_indent, child_comments)
+                lines.append(f"{prefix} {child_lines[0].lstrip()}")
+                lines.extend(child_lines[1:])
+            elif isinstance(value, list):
+                lines.append(f"{prefix} {json.dumps(child, ensure_ascii=False)}")
+            else:
+                lines.append(prefix)
+                _emit_block(lines, child, indent if isinstance(child, list) else child_indent, child_comments)
+        elif isinstance(child, dict):
+            lines.append(f"{prefix} {{}}")
+        elif isinstance(child, list):
+            lines.append(f"{prefix} []")
+        else:
+            lines.append(f"{prefix} {_yaml_scalar(child)}")
+
+def dump_template_fast(template, out_file, document_comment):
+    """
+    Stream a template as YAML text, one variable at a time, with the same fixed comment layout as `dump_template_commented`
+    but without building a ruamel node tree. Loading the output gives the same data as loading the commented template.
+    """
+    lines = []
+    for line in document_comment.rstrip("\n").split("\n"):
+        lines.append("#" if line in ["", "#"] else f"# {line}")
+    lines.append("")
+    top_level_comments = {"row_count": ROW_COUNT_COMMENT, "output_path": OUTPUT_PATH_COMMENT}
+    _emit_block(lines, {key: value for key, value in template.items() if key != "variables"}, 0, top_level_comments)
+    out_file.write("\n".join(lines) + "\n")
+
+    out_file.write("variables:\n" if len(template["variables"]) > 0 else "variables: {}\n")
+    for variable_name, responses in template["variables"].items():
+        lines = []
+        response_comments = {
+            i: (None, {"response_value_generator": (GENERATOR_COMMENT, GENERATOR_COMMENTS)})
+            for i, response in enumerate(responses) if isinstance(response, dict)
+        }
+        _emit_block(lines, {variable_name: responses}, 2, {variable_name: (None, response_comments)})
+        out_file.write("\n".join(lines) + "\n")
+
+def generate_template_csv(mapping_file, output_path, merge=False, fast=False):
+    """
+    Generate a template file for CDE generation from a RADx CDE mapping file.
+    :param mapping_file: File path to mapping file
+    :type mapping_file: str
+    :param output_path: Output path of the generated template file
+    :type output_path: str
+    :param merge: If a template already exists under `output_path`, merge the mapping file into it (see `merge_template`)
+        rather than overwriting it. Merged templates are always written with `dump_template_fast`.
+    :type merge: bool
+    :param fast: Stream the YAML text directly (see `dump_template_fast`) rather than building a commented ruamel document.
+        Much faster and lighter for large mapping files, with the same content and comments.
+    :type fast: bool
+    """
+    template = {
+        "row_count": 1000,
+        "output_path": None,
+        "variables": read_mapping(mapping_file)
+    }
     
-    if Path(output_path).is_file():
+    merging = merge and Path(output_path).is_file()
+    if merging:
+        template, changes = merge_template(load_existing_template(output_path), template["variables"])
+        print(f"Merging \"{mapping_file}\" into existing template \"{output_path}\":")
+        for change in changes:
+            print(f"- {change.replace('_', ' ').capitalize()}: {len(changes[change])}")
+            for item in changes[change]:
+                print(f"    {item if isinstance(item, str) else ' / '.join(str(part) for part in item)}")
+    elif Path(output_path).is_file():
         if not click.confirm(f"Template file already exists under \"{output_path}\". You will LOSE ALL DATA under the existing template. Continue anyways?"):
             print("Cancelled template generation.")
             return
-    with open(output_path, "w+", encoding="utf-8") as out_file:
-        document_comment = f"""\
+    document_comment = f"""\
 Template generated using v{__version__}.
 Source mapping file: "{mapping_file}".
 #
@@ -105,65 +372,20 @@ Notes:
   for template files.
 
 """
-        yaml = ruamel.yaml.YAML()
-        # Ensure that `None` is dumped as `null`.
-        yaml.representer.add_representer(type(None), lambda self, data: self.represent_scalar('tag:yaml.org,2002:null', 'null'))
-        # Makes list yaml more readable
-        yaml.indent(sequence=4, offset=2)
-        
-        commented_yaml = CommentedMap(template)
-        commented_yaml.yaml_set_start_comment(document_comment, indent=0)
-        commented_yaml.yaml_set_comment_before_after_key(
-            "row_count",
-            "How many records of data to generate. If null, `generate.py` will expect [-n ROW_COUNT] argument to be specified.\n" \
-            "Ex: `row_count: 1000` will generate 1000 records of data when the template is run.",
-            indent=0
-        )
-        commented_yaml.yaml_set_comment_before_after_key(
-            "output_path",
-            "File name/path to output the data under (or `null` to auto-generate a name). Can be overriden by [-o OUTPUT_PATH] argument.\n" \
-            "Ex: `output_path: my_synthetic_cde.csv` will output the synthetic CDE under `my_synthetic_cde.csv` when the template is run.",
-            indent=0
-        )
-
-        for variable in commented_yaml["variables"]:
-            commented_yaml["variables"][variable] = CommentedSeq(commented_yaml["variables"][variable])
-            for i, response in enumerate(commented_yaml["variables"][variable]):
-                commented_yaml["variables"][variable][i] = CommentedMap(commented_yaml["variables"][variable][i])
-            for response in commented_yaml["variables"][variable]:
-                # response.yaml_set_comment_before_after_key("frequency", "Change this!", indent=6)
-                response.yaml_set_comment_before_after_key(
-                    "response_value_generator",
-                    "Requires special configuration.",
-                    indent=6
-                )
-                if "response_value_generator" in response:
-                    generator = CommentedMap(response["response_value_generator"])
-                    response["response_value_generator"] = generator
-                    generator.yaml_set_comment_before_after_key("lorem", "Generates pseudo-Latin text.", indent=8)
-                    generator.yaml_set_comment_before_after_key("range", "Chooses a random integer in the inclusive range.", indent=8)
-                    generator.yaml_set_comment_before_after_key(
-                        "valid_inputs",
-                        "Randomly chooses a value from the list. Ex: ['a', 'b', 'c'] or [1, 2, 3]",
-                        indent=8
-                    )
-                    if "lorem" in generator:
-                        generator["lorem"] = CommentedMap(generator["lorem"])
-                        generator["lorem"]["num_sentences"] = CommentedSeq(generator["lorem"]["num_sentences"])
-                        generator["lorem"]["sentence_length"] = CommentedSeq(generator["lorem"]["sentence_length"])
-
-                        generator["lorem"]["num_sentences"].yaml_set_comment_before_after_key(0, "Minimum number of sentences", indent=12)
-                        generator["lorem"]["num_sentences"].yaml_set_comment_before_after_key(1, "Maximum number of sentences", indent=12)
-
-                        generator["lorem"]["sentence_length"].yaml_set_comment_before_after_key(0, "Minimum number of words per sentence", indent=12)
-                        generator["lorem"]["sentence_length"].yaml_set_comment_before_after_key(1, "Maximum number of words per sentence", indent=12)
-                    if "range" in generator:
-                        generator["range"] = CommentedSeq(generator["range"])
-                        generator["range"].yaml_set_comment_before_after_key(0, "Minimum value", indent=10)
-                        generator["range"].yaml_set_comment_before_after_key(1, "Maximum value", indent=10)
-
-
-        yaml.dump(commented_yaml, out_file)
+    # Written next to the template and only moved into place once complete, so that a failed dump never truncates the
+    # (possibly hand-tuned) template under `output_path`.
+    tmp_path = Path(f"{output_path}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as out_file:
+            # Merged templates are plain data (see `load_existing_template`), so they are written in a single streamed pass.
+            if fast or merging:
+                dump_template_fast(template, out_file, document_comment)
+            else:
+                dump_template_commented(template, out_file, document_comment)
+        os.replace(tmp_path, output_path)
+    finally:
+        if tmp_path.is_file():
+            tmp_path.unlink()
     print(
         f"Generated new template file under \"{output_path}\" with {len(template['variables'])} variables " \
         f"and {sum([len(template['variables'][variable]) for variable in template['variables']])} possible responses."
@@ -188,9 +410,21 @@ if __name__ == "__main__":
         action="store",
         default="cde_template.yaml"
     )
+    parser.add_argument(
+        "--merge",
+        help="If OUTPUT_PATH already exists, update it with the mapping file's variables and responses, keeping the frequencies and generators set on it.",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--fast",
+        help="Write the template YAML directly, variable by variable, instead of through ruamel's commented document model.",
+        action="store_true"
+    )
 
     args = parser.parse_args()
     mapping_file = args.mapping_file
     output_path = args.output_path
+    merge = args.merge
+    fast = args.fast
 
-    generate_template_csv(mapping_file, output_path)
\ No newline at end of file
+    generate_template_csv(mapping_file, output_path, merge=merge, fast=fast)
\ No newline at end of file
@@ -0,0 +1,109 @@
+import numpy as np
+
+"""
+Collision-free record IDs.
+
+Record IDs are computed rather than drawn: the global row index of a record (a counter) is passed through a keyed bijection
+of [0, 10^width) -- a Feistel network with cycle walking -- and formatted as `prefix` + zero-padded digits.
+Distinct rows therefore always get distinct IDs, IDs still look random, no set of previously issued IDs needs to be kept,
+and shards generated by different workers never collide since each of them only sees its own global row indices.
+"""
+
+FEISTEL_ROUNDS = 4
+
+def _mix64(x):
+    """ splitmix64 finalizer, applied elementwise to a uint64 array (arithmetic wraps modulo 2^64). """
+    x = x * np.uint64(0x9E3779B97F4A7C15)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+class RecordIdGenerator:
+    def __init__(self, width=6, prefix="", key=0):
+        """
+        :param width: Number of digits of each ID. At most 10^width unique IDs can be generated.
+        :type width: int
+        :param prefix: String prepended to every ID, e.g. "TEST_"
+        :type prefix: str
+        :param key: Key of the permutation. The same key always maps the same row to the same ID.
+        :type key: int
+        """
+        if width < 1 or width > 18:
+            raise Exception(f"Record ID width must be between 1 and 18 digits (width={width})")
+        self.width = width
+        self.prefix = prefix
+        self.capacity = 10 ** width
+        # Smallest even number of bits covering the ID space, so that both Feistel halves are the same size.
+        self.half_bits = max(1, ((self.capacity - 1).bit_length() + 1) // 2)
+        self.half_mask = np.uint64((1 << self.half_bits) - 1)
+        round_keys = _mix64(np.array(
+            [(int(key) * FEISTEL_ROUNDS + i) & 0xFFFFFFFFFFFFFFFF for i in range(FEISTEL_ROUNDS)],
+            dtype=np.uint64
+        ))
+        self.round_keys = [np.uint64(round_key) for round_key in round_keys]
+        self._powers_of_ten = np.uint64(10) ** np.arange(width - 1, -1, -1, dtype=np.uint64)
+
+    def _encrypt(self, values):
+        half_bits = np.uint64(self.half_bits)
+        left = values >> half_bits
+        right = values & self.half_mask
+        for round_key in self.round_keys:
+            left, right = right, left ^ (_mix64(right ^ round_key) & self.half_mask)
+        return (left << half_bits) | right
+
+    def permute(self, rows):
+        """
+        Map row indices to their unique numeric IDs.
+        :param rows: Global row indices, each in [0, 10^width)
+        :type rows: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        rows = np.asarray(rows, dtype=np.uint64)
+        if len(rows) > 0 and int(rows.max()) >= self.capacity:
+            raise Exception(
+                f"Cannot generate more than {self.capacity} unique {self.width}-digit record IDs (row {int(rows.max())} requested). "
+                f"Increase the record ID width."
+            )
+        ids = self._encrypt(rows)
+        # Cycle walking: re-encrypt the IDs that fall outside of [0, 10^width) until they land inside. This keeps the
+        # mapping a bijection and only takes a couple of rounds on average, since the Feistel domain is less than 4x the ID space.
+        outside = np.flatnonzero(ids >= np.uint64(self.capacity))
+        while len(outside) > 0:
+            ids[outside] = self._encrypt(ids[outside])
+            outside = outside[ids[outside] >= np.uint64(self.capacity)]
+        return ids
+
+    def generate(self, rows):
+        """
+        Format the IDs of the given global row indices.
+        :rtype: list
+        """
+        ids = self.permute(rows)
+        # Build the zero-padded ASCII digits of every ID at once rather than formatting them one by one.
+        digits = ((ids[:, None] // self._powers_of_ten) % np.uint64(10)).astype(np.uint8) + ord("0")
+        formatted = np.ascontiguousarray(digits).view(f"S{self.width}").ravel().astype(str)
+        if self.prefix:
+            formatted = np.char.add(self.prefix, formatted)
+        return formatted.tolist()
+
+def growing_width_ids(rows, min_width=6, prefix="", key=0):
+    """
+    IDs of at least `min_width` digits, each row getting as many digits as it needs: rows below 10^min_width get
+    `min_width`-digit IDs, rows in [10^min_width, 10^(min_width + 1)) get one more digit, etc. IDs of different widths never
+    collide since they have different lengths, and a row's ID doesn't depend on which other rows are generated with it.
+    :param rows: Global row indices
+    :type rows: numpy.ndarray
+    :rtype: list
+    """
+    rows = np.asarray(rows, dtype=np.uint64)
+    if len(rows) == 0:
+        return []
+    widths = np.maximum(min_width, np.char.str_len(rows.astype(str)))
+    ids = np.empty(len(rows), dtype=object)
+    for width in np.unique(widths).tolist():
+        mask = widths == width
+        ids[mask] = RecordIdGenerator(width=width, prefix=prefix, key=key).generate(rows[mask])
+    return ids.tolist()